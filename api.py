@@ -1,14 +1,44 @@
 """REST API для другого сервиса"""
+import asyncio
+import csv
+import hashlib
+import io
 import json
+import os
+import time
 from contextlib import asynccontextmanager
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from archive import archiver
+from budget import CHEAP, LOCAL, hour_label, hour_start, token_budget
+from config import settings
+from coordination import change_watcher, leader_election
 from database import db
+from events import event_hub
+from metrics import (
+    MODERATION_WORKER_QUEUE,
+    OPENAI_BUDGET_MODE,
+    OPENAI_CIRCUIT_OPEN,
+    OPENAI_CONCURRENCY_LIMIT,
+    OPENAI_SPEND_RATE,
+    PENDING_MESSAGES,
+    QUEUE_DEPTH,
+    MetricsMiddleware,
+    loop_monitor,
+    registry,
+)
+from message_pipeline import submit_message
+from moderation_worker import moderation_workers
 from openai_service import openai_service
+from phrase_pool import phrase_pool
+from rows import ALL_COLUMNS, LIST_COLUMNS, MESSAGE_FIELDS
+from serialization import FastJSONResponse, dumps, dumps_text, raw_json
+import telegram_bot
 
 
 class ResetQueueResponse(BaseModel):
@@ -17,6 +47,19 @@ class ResetQueueResponse(BaseModel):
     reset_count: int
 
 
+class ClaimRequest(BaseModel):
+    """Запрос на аренду сообщений из очереди"""
+    consumer: str = Field(..., min_length=1, max_length=100)
+    limit: int = Field(10, ge=1, le=100)
+    visibility_timeout: float = Field(30.0, gt=0, le=3600)  # Секунды до повторной выдачи
+
+
+class AckRequest(BaseModel):
+    """Подтверждение или отказ от арендованных сообщений"""
+    consumer: str = Field(..., min_length=1, max_length=100)
+    ids: Optional[List[int]] = None  # Для nack: None — все аренды потребителя
+
+
 class UpdateStatusRequest(BaseModel):
     """Запрос на обновление статуса"""
     status: str  # 'ok' или 'restricted'
@@ -30,19 +73,83 @@ class CreateMessageRequest(BaseModel):
     mood: Optional[str] = None
 
 
+async def _start_leader_jobs():
+    """Фоновые задачи, которые выполняет только один процесс API"""
+    # Сообщения, оставшиеся в статусе 'pending' после перезапуска
+    await moderation_workers.resume_pending()
+    if settings.phrase_pool_enabled:
+        phrase_pool.set_generator(openai_service.generate_phrases)
+    # Перенос старых сообщений в архив (ARCHIVE_AFTER_DAYS > 0)
+    archiver.start()
+    if telegram_bot.webhook_enabled() and settings.telegram_webhook_url:
+        try:
+            await telegram_bot.register_webhook()
+        except Exception as e:
+            print(f"[Telegram] Failed to set webhook: {e}")
+
+
+def _external_change(message: Dict[str, Any]):
+    """Сообщение изменено другим процессом: разбудить long-poll ожидающих.
+
+    Сообщения в статусе 'pending' из процесса бота (TELEGRAM_MODE=polling)
+    модерирует лидер; аренда в базе не даёт проверить сообщение дважды.
+    """
+    if message['status'] != 'pending':
+        moderation_workers.notify(message['id'])
+    elif leader_election.is_leader or settings.api_workers == 1:
+        moderation_workers.submit(message['id'])
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
+    multi_worker = settings.api_workers > 1
     # Инициализация базы данных
     await db.init_db()
+    # Счётчики токенов и расходы за последний час
+    await token_budget.start()
+    # Общая HTTP-сессия для запросов к OpenAI
+    await openai_service.start()
+    if settings.phrase_pool_enabled:
+        # Пул готовых фраз; пополняет его только лидер
+        await phrase_pool.start()
+    # Фоновые обработчики сообщений в статусе 'pending'
+    await moderation_workers.start(resume=False)
+    # Замер задержки event loop для /api/metrics
+    loop_monitor.start()
+    if telegram_bot.webhook_enabled():
+        # Обработчики бота в этом же event loop
+        await telegram_bot.start_webhook()
+    # Кэши в памяти и SSE узнают о записях других процессов API и процесса бота
+    change_watcher.add_listener(_external_change)
+    await change_watcher.start()
+    if multi_worker:
+        await leader_election.start(_start_leader_jobs)
+    else:
+        await _start_leader_jobs()
     
     yield
+    
+    await change_watcher.stop()
+    if multi_worker:
+        await leader_election.stop()
+    await archiver.stop()
+    if telegram_bot.webhook_enabled():
+        await telegram_bot.stop_webhook()
+    await loop_monitor.stop()
+    await moderation_workers.stop()
+    await phrase_pool.stop()
+    await openai_service.close()
+    await token_budget.stop()
+    # Закрываем соединения с базой данных
+    await db.close()
 
 
 app = FastAPI(
     title="Shalapin Bot API",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 app.add_middleware(
@@ -52,6 +159,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/api/messages")
@@ -62,8 +170,8 @@ async def get_messages() -> list[Dict[str, Any]]:
     Сообщения НЕ помечаются как забранные и остаются в очереди.
     Возвращает список из последних 5 сообщений, отсортированных по дате создания (новые первыми).
     """
-    messages = await db.get_latest_messages(limit=5)
-    return messages
+    # Готовый JSON из кэша последних одобренных сообщений
+    return FastJSONResponse(await db.get_latest_messages_json(limit=5))
 
 
 @app.post("/api/queue/reset")
@@ -81,61 +189,431 @@ async def reset_queue() -> ResetQueueResponse:
     )
 
 
+@app.post("/api/queue/claim")
+async def claim_messages(request: ClaimRequest) -> Dict[str, Any]:
+    """
+    Арендовать до `limit` сообщений для экрана `consumer` одним запросом.
+    
+    Арендованные сообщения не выдаются другим потребителям. Если их не
+    подтвердить через `/api/queue/ack` за `visibility_timeout` секунд,
+    они будут выданы повторно.
+    """
+    messages = await db.claim_messages(
+        request.consumer,
+        limit=request.limit,
+        visibility_timeout=request.visibility_timeout
+    )
+    return {"messages": messages}
+
+
+@app.post("/api/queue/ack")
+async def ack_messages(request: AckRequest) -> Dict[str, Any]:
+    """Подтвердить показ арендованных сообщений (помечаются забранными)"""
+    acked = await db.ack_messages(request.consumer, request.ids or [])
+    return {"acked": acked}
+
+
+@app.post("/api/queue/nack")
+async def nack_messages(request: AckRequest) -> Dict[str, Any]:
+    """Вернуть арендованные сообщения в очередь (без `ids` — все аренды потребителя)"""
+    released = await db.nack_messages(request.consumer, request.ids)
+    return {"released": released}
+
+
 @app.get("/api/health")
 async def health_check():
     """Проверка здоровья API"""
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "database": await db.health_check(),
+        "archive": archiver.stats(),
+        "process": {
+            "pid": os.getpid(),
+            "workers": settings.api_workers,
+            "leader": leader_election.is_leader or settings.api_workers == 1,
+            "change_watcher": change_watcher.stats()
+        }
+    }
 
 
-@app.post("/api/messages/create")
-async def create_message(request: CreateMessageRequest) -> Dict[str, Any]:
-    """
-    Создать новое сообщение.
-    
-    Принимает имя, пол, настроение и текст сообщения.
-    Отправляет на модерацию в OpenAI и сохраняет в базу данных.
+@app.post(settings.telegram_webhook_path, include_in_schema=False)
+async def telegram_webhook(
+    request: Request,
+    secret_token: Optional[str] = Header(None, alias="X-Telegram-Bot-Api-Secret-Token")
+):
+    """Обновления Telegram-бота (TELEGRAM_MODE=webhook).
+
+    Обновление только передаётся диспетчеру, поэтому Telegram получает
+    ответ сразу, не дожидаясь модерации.
     """
-    previous_messages = await db.get_last_approved_messages(limit=3)
-    
-    # Проверяем сообщение через OpenAI
-    result = await openai_service.check_message(
-        name=request.name,
-        age=request.age,
-        gender=request.gender,
-        mood=request.mood,
-        previous_messages=previous_messages
+    if not telegram_bot.webhook_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not telegram_bot.check_webhook_secret(secret_token):
+        raise HTTPException(status_code=401, detail="Invalid secret token")
+    try:
+        payload = await request.json()
+        accepted = telegram_bot.feed_webhook_update(payload)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid update")
+    if not accepted:
+        # Telegram повторит доставку, когда очередь бота освободится
+        raise HTTPException(status_code=429, detail="Bot queue is full")
+    return {"ok": True}
+
+
+@app.get("/api/metrics")
+async def metrics() -> Response:
+    """Метрики в текстовом формате Prometheus"""
+    counts = await db.get_queue_counts()
+    QUEUE_DEPTH.set(counts["queue_depth"])
+    PENDING_MESSAGES.set(counts["pending"])
+    MODERATION_WORKER_QUEUE.set(moderation_workers.queue_size())
+    OPENAI_CONCURRENCY_LIMIT.set(openai_service.limiter.stats()["limit"])
+    OPENAI_CIRCUIT_OPEN.set(int(openai_service.breaker.state == "open"))
+    OPENAI_SPEND_RATE.set(token_budget.spend_rate())
+    OPENAI_BUDGET_MODE.set({CHEAP: 1, LOCAL: 2}.get(token_budget.mode(), 0))
+    return Response(
+        content=registry.render(),
+        media_type="text/plain; version=0.0.4"
     )
-    
-    # Сохраняем в базу данных
-    message_id = await db.add_message(
+
+
+@app.get("/api/moderation/stats")
+async def moderation_stats() -> Dict[str, Any]:
+    """Счётчики кэша модерации и локальных правил"""
+    cache = openai_service.cache
+    rules = openai_service.rules
+    return {
+        "cache": cache.stats() if cache is not None else None,
+        "rules": rules.stats() if rules is not None else None,
+        "latest_cache": db.latest.stats(),
+        "openai": openai_service.stats(),
+    }
+
+
+@app.get("/api/usage")
+async def token_usage(
+    hours: int = Query(24, ge=1, le=24 * 31, description="За сколько последних часов")
+) -> Dict[str, Any]:
+    """Токены и стоимость запросов к OpenAI по часам и моделям"""
+    # Сначала дописать накопленное в памяти этого процесса
+    await token_budget.flush()
+    since = hour_label(hour_start(time.time()) - (hours - 1) * 3600)
+    return {
+        "budget": token_budget.stats(),
+        "hours": await db.get_token_usage(since),
+    }
+
+
+async def _create_message(
+    request: CreateMessageRequest,
+    response: Response,
+    async_mode: bool
+) -> Dict[str, Any]:
+    result = await submit_message(
         name=request.name,
         age=request.age,
         gender=request.gender,
         mood=request.mood,
-        message_text=result.get('response', ''),
-        openai_response=json.dumps(result, ensure_ascii=False),
-        status=result['status']
+        async_mode=async_mode
     )
+    if result['status'] == 'pending':
+        response.status_code = 202
+    return result
+
+
+async def _replay_idempotent(
+    key: str,
+    record: Dict[str, Any],
+    fingerprint: str,
+    response: Response
+) -> Dict[str, Any]:
+    """Ответ на повтор запроса с уже использованным Idempotency-Key"""
+    if record['fingerprint'] != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key has already been used with a different request"
+        )
+    
+    # Первый запрос ещё выполняется — ждём, пока он создаст сообщение
+    message_id = record['message_id']
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.openai_deadline + 5
+    while message_id is None:
+        if loop.time() > deadline:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress"
+            )
+        await asyncio.sleep(0.05)
+        record = await db.get_idempotency_key(key)
+        if record is None:
+            # Первый запрос завершился ошибкой и освободил ключ
+            raise HTTPException(
+                status_code=409,
+                detail="The original request with this Idempotency-Key failed, retry it"
+            )
+        message_id = record['message_id']
     
+    message = await db.get_message(message_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    
+    response.headers["Idempotent-Replayed"] = "true"
+    if message['status'] == 'pending':
+        response.status_code = 202
     return {
-        "id": message_id,
-        "name": request.name,
-        "age": request.age,
-        "gender": request.gender,
-        "mood": request.mood,
-        "message_text": result.get('response', ''),
-        "status": result['status'],
-        "openai_response": result
+        "id": message['id'],
+        "name": message['name'],
+        "age": message['age'],
+        "gender": message['gender'],
+        "mood": message['mood'],
+        "message_text": message['message_text'],
+        "status": message['status'],
+        "openai_response": raw_json(message['openai_response'])
     }
 
 
+def _json_response(content: Any, response: Response) -> FastJSONResponse:
+    """FastJSONResponse с кодом и заголовками, выставленными в response.
+
+    Если эндпоинт возвращает Response сам, FastAPI не переносит их из
+    внедрённого параметра response.
+    """
+    return FastJSONResponse(
+        content,
+        status_code=response.status_code or 200,
+        headers=dict(response.headers)
+    )
+
+
+@app.post("/api/messages/create")
+async def create_message(
+    request: CreateMessageRequest,
+    response: Response,
+    async_mode: Optional[bool] = Query(None, alias="async"),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+) -> Dict[str, Any]:
+    """
+    Создать новое сообщение.
+    
+    Принимает имя, пол, настроение и текст сообщения.
+    Отправляет на модерацию в OpenAI и сохраняет в базу данных.
+    
+    С параметром `?async=true` сообщение сохраняется со статусом 'pending'
+    и сразу возвращается (202); результат модерации можно получить через
+    `GET /api/messages/{id}?wait=<секунды>`.
+    
+    Если OpenAI недоступен (исчерпаны повторы или разомкнут автомат
+    отключения), сообщение тоже сохраняется как 'pending' и ответ — 202:
+    модерация будет повторена в фоне.
+    
+    С заголовком `Idempotency-Key` повтор того же запроса (в течение
+    `IDEMPOTENCY_TTL`) возвращает ранее созданное сообщение вместо нового.
+    """
+    if async_mode is None:
+        async_mode = settings.moderation_async_default
+    
+    if not idempotency_key:
+        return _json_response(await _create_message(request, response, async_mode), response)
+    
+    fingerprint = hashlib.sha256(
+        json.dumps(request.model_dump(), ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    record = await db.reserve_idempotency_key(idempotency_key, fingerprint, settings.idempotency_ttl)
+    if record is not None:
+        return _json_response(
+            await _replay_idempotent(idempotency_key, record, fingerprint, response),
+            response
+        )
+    
+    try:
+        result = await _create_message(request, response, async_mode)
+    except BaseException:
+        await db.release_idempotency_key(idempotency_key)
+        raise
+    await db.complete_idempotency_key(idempotency_key, result["id"])
+    return _json_response(result, response)
+
+
 @app.get("/api/messages/all")
-async def get_all_messages() -> list[Dict[str, Any]]:
+async def get_all_messages(
+    limit: int = Query(200, ge=1, le=1000),
+    before_id: Optional[int] = Query(None, description="Вернуть сообщения с id меньше этого"),
+    since_id: Optional[int] = Query(None, description="Вернуть сообщения с id больше этого"),
+    updated_since: Optional[str] = Query(None, description="Вернуть сообщения, изменённые начиная с этого времени"),
+    after_id: Optional[int] = Query(None, description="Вместе с updated_since: курсор (updated_at, id)"),
+    include_response: bool = Query(True, description="Включать в ответ поле openai_response")
+) -> list[Dict[str, Any]]:
+    """
+    Получить сообщения для фронтенда.
+    
+    Без параметров — последние `limit` сообщений (новые первыми), следующая
+    страница запрашивается с `before_id` = наименьший полученный id.
+    С `since_id` и/или `updated_since` возвращаются только новые и изменённые
+    сообщения в порядке изменения; для следующего запроса используйте
+    наибольший полученный `updated_at`. Если страница заполнена целиком,
+    следующая запрашивается с `updated_since` и `after_id` последней строки:
+    иначе строки с одинаковым `updated_at` (сброс очереди) не дочитать.
+    С `include_response=false` тяжёлое поле `openai_response` не читается
+    из базы и не попадает в ответ.
+    """
+    columns = ALL_COLUMNS if include_response else LIST_COLUMNS
+    # JSON собирается в SQLite, event loop не создаёт словари строк
+    if since_id is not None or updated_since is not None:
+        return FastJSONResponse(await db.get_messages_changed_json(
+            since_id=since_id,
+            updated_since=updated_since,
+            limit=limit,
+            columns=columns,
+            after_id=after_id
+        ))
+    return FastJSONResponse(await db.get_messages_page_json(before_id=before_id, limit=limit, columns=columns))
+
+
+@app.get("/api/messages/export")
+async def export_messages(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="ndjson или csv"),
+    status: Optional[str] = Query(None, description="Выгрузить только сообщения с этим статусом"),
+    since_id: Optional[int] = Query(None, description="Выгрузить сообщения с id больше этого")
+) -> StreamingResponse:
+    """
+    Потоковая выгрузка всех сообщений (старые первыми).
+    
+    Сообщения читаются из базы порциями и сразу отправляются клиенту,
+    поэтому размер таблицы не влияет на память сервера. Сообщения,
+    перенесённые в архив, в выгрузку не попадают.
+    """
+    rows = db.iter_messages(status=status, since_id=since_id, chunk_size=settings.export_chunk_size)
+    
+    async def ndjson_stream():
+        async for chunk in rows:
+            yield b"".join(dumps(message.as_dict()) + b"\n" for message in chunk)
+    
+    async def csv_stream():
+        buffer = io.StringIO()
+        # MessageRow — кортеж в порядке MESSAGE_FIELDS, пишется как есть
+        writer = csv.writer(buffer)
+        writer.writerow(MESSAGE_FIELDS)
+        async for chunk in rows:
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            # Только заголовок: сообщений нет
+            yield buffer.getvalue()
+    
+    if format == "csv":
+        stream, media_type = csv_stream(), "text/csv"
+    else:
+        stream, media_type = ndjson_stream(), "application/x-ndjson"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="messages.{format}"'}
+    )
+
+
+def _sse_event(event_type: str, message: Dict[str, Any]) -> str:
+    """Событие в формате Server-Sent Events.
+
+    id проставляется только для новых сообщений: по нему клиент
+    возобновляет поток после переподключения (Last-Event-ID).
+    """
+    data = dumps_text(message)
+    event_id = f"id: {message['id']}\n" if event_type == "created" else ""
+    return f"{event_id}event: {event_type}\ndata: {data}\n\n"
+
+
+@app.get("/api/messages/stream")
+async def stream_messages(
+    request: Request,
+    last_id: Optional[int] = Query(None, description="Последний полученный id сообщения"),
+    status: Optional[str] = Query(None, description="Отдавать только сообщения с этим статусом"),
+    last_event_id: Optional[int] = Header(None)
+) -> StreamingResponse:
     """
-    Получить все сообщения для фронтенда.
+    Поток новых сообщений и изменений статусов (Server-Sent Events).
+    
+    События: `created` — новое сообщение, `updated` — изменился статус или
+    завершилась модерация, `resync` — изменений слишком много для потока,
+    их нужно дочитать через `/api/messages/all?updated_since=`.
+    При переподключении с `last_id` (или заголовком `Last-Event-ID`)
+    сначала отдаются пропущенные сообщения из базы.
     """
-    messages = await db.get_all_messages()
-    return messages
+    resume_from = last_id if last_id is not None else last_event_id
+    
+    async def event_stream():
+        # Подписываемся до чтения пропущенного, чтобы ничего не потерять
+        queue = event_hub.subscribe()
+        try:
+            max_sent_id = resume_from or 0
+            if resume_from is not None:
+                while True:
+                    missed = await db.get_messages_after(max_sent_id)
+                    for message in missed:
+                        if status is None or message.status == status:
+                            yield _sse_event("created", message.as_dict())
+                    if not missed:
+                        break
+                    max_sent_id = missed[-1].id
+            else:
+                yield ": connected\n\n"
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Комментарий не даёт прокси закрыть соединение
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    # Подписчик не успевал читать и был отключен
+                    break
+                if event["type"] == "resync":
+                    # Слишком много изменений сразу: клиент дочитывает их из базы
+                    yield "event: resync\ndata: {}\n\n"
+                    continue
+                message = event["message"]
+                if event["type"] == "created" and message['id'] <= max_sent_id:
+                    continue
+                if status is not None and message['status'] != status:
+                    continue
+                yield _sse_event(event["type"], message)
+        finally:
+            event_hub.unsubscribe(queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Отключаем буферизацию ответа в nginx
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@app.get("/api/messages/{message_id:int}")
+async def get_message(
+    message_id: int,
+    wait: float = Query(0, ge=0, le=30, description="Сколько секунд ждать завершения модерации")
+) -> Dict[str, Any]:
+    """
+    Получить сообщение по id.
+    
+    Если сообщение ещё на модерации и задан `wait`, запрос ждёт результата
+    (long-poll) не дольше указанного времени.
+    """
+    message = await db.get_message(message_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    
+    if message['status'] == 'pending' and wait > 0:
+        message = await moderation_workers.wait_for(message_id, wait) or message
+    
+    return FastJSONResponse(message.as_dict())
 
 
 @app.patch("/api/messages/{message_id}/status")
@@ -0,0 +1,129 @@
+"""Перенос старых сообщений в сжатый архив.
+
+Старые завершённые сообщения удаляются из таблицы messages и
+дописываются в помесячные файлы messages_ГГГГ-ММ.ndjson.gz (одна
+строка JSON на сообщение), чтобы рабочая таблица и её индексы
+оставались маленькими. Дописывание создаёт в файле новый поток gzip;
+такие файлы читаются gzip.open и `zcat` как один.
+"""
+import asyncio
+import gzip
+import json
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from database import Database, db
+from rows import MessageRow
+
+
+def partition_name(created_at: Optional[str]) -> str:
+    """Имя файла архива по дате создания сообщения"""
+    month = (created_at or "")[:7] or "unknown"
+    return f"messages_{month}.ndjson.gz"
+
+
+class MessageArchiver:
+    """Фоновый перенос сообщений старше after_days в архив"""
+
+    def __init__(
+        self,
+        database: Database,
+        archive_dir: str,
+        after_days: float = 0.0,
+        interval: float = 3600.0,
+        chunk_size: int = 500
+    ):
+        self.database = database
+        self.archive_dir = archive_dir
+        self.after_days = after_days
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self._task: Optional[asyncio.Task] = None
+        # Метрики
+        self.archived = 0
+        self.runs = 0
+        self.errors = 0
+
+    def _write(self, messages: List[MessageRow]):
+        """Дописать сообщения в файлы архива и сбросить их на диск"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        partitions: Dict[str, List[str]] = defaultdict(list)
+        for message in messages:
+            partitions[partition_name(message.created_at)].append(
+                json.dumps(message.as_dict(), ensure_ascii=False) + "\n"
+            )
+        for name, lines in partitions.items():
+            with open(os.path.join(self.archive_dir, name), "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="ab") as archive:
+                    archive.write("".join(lines).encode("utf-8"))
+                raw.flush()
+                # Строки удаляются из базы только после записи архива на диск
+                os.fsync(raw.fileno())
+
+    async def _sink(self, messages: List[MessageRow]):
+        await asyncio.to_thread(self._write, messages)
+
+    async def run_once(self, after_days: Optional[float] = None) -> int:
+        """Перенести все подходящие сообщения; возвращает их число"""
+        after_days = self.after_days if after_days is None else after_days
+        total = 0
+        while True:
+            moved = await self.database.archive_old_messages(after_days, self._sink, self.chunk_size)
+            total += moved
+            if moved < self.chunk_size:
+                break
+            # Между порциями даём пройти другим записям
+            await asyncio.sleep(0)
+        self.runs += 1
+        self.archived += total
+        if total:
+            print(f"[MessageArchiver] Archived {total} messages to {self.archive_dir}")
+        return total
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"[MessageArchiver] Archive run failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запустить периодический перенос (если задан after_days)"""
+        if self.after_days <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="message-archiver")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.after_days > 0,
+            "after_days": self.after_days,
+            "archived": self.archived,
+            "runs": self.runs,
+            "errors": self.errors,
+        }
+
+
+# Глобальный архиватор
+archiver = MessageArchiver(
+    db,
+    settings.archive_dir,
+    after_days=settings.archive_after_days,
+    interval=settings.archive_interval,
+    chunk_size=settings.export_chunk_size
+)
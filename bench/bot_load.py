@@ -0,0 +1,132 @@
+"""Всплеск сообщений Telegram-боту на локальных заглушках Bot API и OpenAI.
+
+Бот работает в этом же процессе (long polling к заглушке) на временной
+базе. Скрипт отправляет --messages сообщений от --users пользователей
+(часть — повторы), ждёт итоговых ответов и печатает задержку до
+вердикта, число отсеянных сообщений, наибольшую глубину очереди и
+наибольшее число задач asyncio — оно не должно расти со всплеском.
+
+    python bench/bot_load.py --messages 500 --users 200 --latency-ms 300
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+from common import save_results, summarize
+from mock_openai import MockOpenAI, start_mock as start_openai_mock
+from mock_telegram import MockTelegram, start_mock as start_telegram_mock
+
+NAMES = ["Анна", "Борис", "Вера", "Глеб", "Дарья", "Егор", "Жанна", "Зоя", "Иван", "Кира"]
+
+
+async def main_async(args) -> Dict[str, dict]:
+    temp_dir = tempfile.mkdtemp(prefix="bot-load-")
+    # Настройки читаются при импорте модулей приложения
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "DATABASE_PATH": os.path.join(temp_dir, "bench.db"),
+        "TELEGRAM_BOT_TOKEN": "1:bench",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.telegram_port}",
+        "TELEGRAM_WORKERS": str(args.workers),
+        "TELEGRAM_QUEUE_SIZE": str(args.queue_size),
+        "MODERATION_CACHE_TTL": "0",
+    })
+    import telegram_bot
+
+    openai_mock = MockOpenAI(args.latency_ms, args.jitter_ms, seed=args.seed)
+    telegram_mock = MockTelegram()
+    runners = [
+        await start_openai_mock(openai_mock, port=args.openai_port),
+        await start_telegram_mock(telegram_mock, port=args.telegram_port),
+    ]
+    bot_task = asyncio.create_task(telegram_bot.start_bot())
+    rng = random.Random(args.seed)
+    finals = (telegram_bot.APPROVED_TEXT, telegram_bot.RESTRICTED_TEXT)
+    max_queue = max_tasks = 0
+    try:
+        started = time.perf_counter()
+        for idx in range(args.messages):
+            user_id = 1000 + rng.randrange(args.users)
+            if rng.random() < args.duplicate_ratio:
+                name = NAMES[user_id % len(NAMES)]
+            else:
+                name = f"{rng.choice(NAMES)} {idx}"
+            telegram_mock.push_update(user_id, name)
+
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline:
+            max_queue = max(max_queue, telegram_bot.ingestion.queue_depth())
+            max_tasks = max(max_tasks, len(asyncio.all_tasks()))
+            pending = [m for m in telegram_mock.messages.values() if m["text"] == telegram_bot.PROCESSING_TEXT]
+            stats = telegram_bot.ingestion.stats()
+            handled = stats["accepted"] + stats["duplicates"] + stats["rate_limited"]
+            if handled >= args.messages and not pending and stats["processed"] >= stats["accepted"]:
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        latencies: List[float] = []
+        for message in telegram_mock.messages.values():
+            first_at = message["history"][0][0]
+            for at, text in message["history"]:
+                if text in finals:
+                    latencies.append(at - first_at)
+                    break
+        stats = telegram_bot.ingestion.stats()
+    finally:
+        await telegram_bot.stop_bot()
+        bot_task.cancel()
+        await asyncio.gather(bot_task, return_exceptions=True)
+        for runner in runners:
+            await runner.cleanup()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results = {
+        "verdict": summarize(latencies),
+        "ingestion": stats,
+        "max_queue_depth": max_queue,
+        "max_asyncio_tasks": max_tasks,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "telegram_calls": telegram_mock.calls,
+        "openai_requests": openai_mock.requests,
+    }
+    print(f"Вердиктов: {len(latencies)} за {elapsed:.1f} с ({results['throughput_rps']:.1f}/с)")
+    if latencies:
+        print(f"  до вердикта p50 {results['verdict']['p50_ms']:.0f} ms, p95 {results['verdict']['p95_ms']:.0f} ms")
+    print(f"  принято {stats['accepted']}, повторов {stats['duplicates']}, ограничено {stats['rate_limited']}")
+    print(f"  очередь до {max_queue} из {args.queue_size}, задач asyncio до {max_tasks}")
+    print(f"  вызовы Bot API: {telegram_mock.calls}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500, help="сообщений во всплеске")
+    parser.add_argument("--users", type=int, default=200, help="число разных пользователей")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="доля повторов одного и того же имени")
+    parser.add_argument("--workers", type=int, default=4, help="TELEGRAM_WORKERS")
+    parser.add_argument("--queue-size", type=int, default=100, help="TELEGRAM_QUEUE_SIZE")
+    parser.add_argument("--latency-ms", type=float, default=300, help="задержка заглушки OpenAI")
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--timeout", type=float, default=120, help="сколько ждать всех ответов, сек")
+    parser.add_argument("--openai-port", type=int, default=8765)
+    parser.add_argument("--telegram-port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="путь к JSON с результатами")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    path = save_results("bot", config, results, args.output)
+    print(f"\nРезультаты сохранены: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Сравнение двух файлов с результатами бенчмарков.
+
+    python bench/compare.py bench/results/load-old.json bench/results/load-new.json
+"""
+import argparse
+import json
+from typing import Dict, Iterator, Tuple
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+
+
+def flatten(document: dict) -> Iterator[Tuple[str, Dict[str, float]]]:
+    """Пары (название замера, метрики) для load- и db-результатов"""
+    results = document["results"]
+    if document["kind"] == "load":
+        for endpoint, stats in results["endpoints"].items():
+            yield endpoint, stats
+    else:
+        for size, cases in results.items():
+            for name, stats in cases.items():
+                if not name.startswith("_"):
+                    yield f"{size}: {name}", stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="порог регрессии в процентах (по умолчанию 10)")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    print(f"{baseline.get('revision')} -> {candidate.get('revision')}")
+    old = dict(flatten(baseline))
+    regressions = 0
+    for name, stats in flatten(candidate):
+        if name not in old:
+            continue
+        for metric in METRICS:
+            if metric not in stats or not old[name].get(metric):
+                continue
+            before, after = old[name][metric], stats[metric]
+            change = (after - before) / before * 100
+            # Для пропускной способности хуже — меньше
+            worse = -change if metric == "throughput_rps" else change
+            mark = "  РЕГРЕССИЯ" if worse > args.threshold else ""
+            regressions += bool(mark)
+            print(f"{name:<48} {metric:<15} {before:10.3f} -> {after:10.3f} ({change:+6.1f}%){mark}")
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Микробенчмарки методов Database на таблицах разного размера.
+
+Для каждого размера создаётся временная база со схемой из миграций,
+заполняется синтетическими строками (статусы и флаги распределены как в
+продакшене), после чего каждый метод вызывается --iterations раз.
+
+    python bench/db_bench.py --sizes 1000,10000,100000,1000000 --iterations 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List
+
+from common import save_results, summarize
+
+# Настройки читаются при импорте, ключ OpenAI бенчмарку не нужен
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from database import Database
+from events import EventHub
+
+NAMES = ["Анна", "Борис", "Вера", "Глеб", "Дарья", "Егор", "Жанна", "Зоя", "Иван", "Кира"]
+
+
+def fill(db_path: str, rows: int, seed: int = 0, pending_ratio: float = 0.001, unfetched_ratio: float = 0.01):
+    """Быстро заполнить таблицу messages напрямую через sqlite3"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    step = timedelta(days=365) / max(rows, 1)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous = OFF")
+
+    def generate():
+        for i in range(rows):
+            created = (start + step * i).strftime("%Y-%m-%d %H:%M:%f")[:23]
+            roll = rng.random()
+            if roll < pending_ratio:
+                status = "pending"
+            elif roll < 0.1:
+                status = "restricted"
+            else:
+                status = "ok"
+            # Незабранными остаются только самые свежие сообщения
+            is_fetched = 0 if i >= rows * (1 - unfetched_ratio) else 1
+            name = rng.choice(NAMES)
+            yield (
+                name, rng.randint(7, 80), rng.choice(["мужской", "женский", None]), None,
+                f"{name}, живи красиво, даже без повода. #{i}", '{"status": "ok"}', status,
+                created, is_fetched, created if is_fetched else None, created,
+            )
+
+    with conn:
+        conn.executemany("""
+            INSERT INTO messages
+            (name, age, gender, mood, message_text, openai_response, status,
+             created_at, is_fetched, fetched_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, generate())
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+async def measure(func: Callable[[], Awaitable], iterations: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await func()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+async def bench_size(rows: int, iterations: int, seed: int) -> Dict[str, dict]:
+    temp_dir = tempfile.mkdtemp(prefix="db-bench-")
+    db_path = os.path.join(temp_dir, "bench.db")
+
+    # Схема создаётся миграциями, затем таблица заполняется напрямую
+    database = Database(db_path, hub=EventHub())
+    await database.init_db()
+    await database.close()
+    fill_started = time.perf_counter()
+    fill(db_path, rows, seed)
+    fill_time = time.perf_counter() - fill_started
+
+    database = Database(db_path, hub=EventHub())
+    await database.init_db()
+    rng = random.Random(seed)
+    mid_id = max(rows // 2, 1)
+    recent = (datetime(2024, 1, 1) + timedelta(days=364)).strftime("%Y-%m-%d %H:%M:%S")
+
+    async def claim_ack():
+        claimed = await database.claim_messages("bench", limit=10)
+        await database.ack_messages("bench", [m["id"] for m in claimed])
+        if not claimed:
+            # Очередь исчерпана — возвращаем часть сообщений
+            async with database.pool.writer() as db:
+                await db.execute("UPDATE messages SET is_fetched = 0 WHERE id > ?", (rows - 100,))
+                await db.commit()
+
+    cases = {
+        "get_latest_messages": lambda: database.get_latest_messages(5),
+        "query_latest_messages (без кэша)": lambda: database._query_latest_messages(5),
+        "get_last_approved_messages": lambda: database.get_last_approved_messages(3),
+        "get_messages_page (первая)": lambda: database.get_messages_page(limit=200),
+        "get_messages_page (середина)": lambda: database.get_messages_page(before_id=mid_id, limit=200),
+        "get_messages_changed": lambda: database.get_messages_changed(updated_since=recent, limit=200),
+        "get_message": lambda: database.get_message(rng.randint(1, rows)),
+        "get_pending_message_ids": database.get_pending_message_ids,
+        "add_message": lambda: database.add_message(
+            "Бенч", 30, "женский", None, "Бенч, живи красиво.", None, "ok"
+        ),
+        "update_message_status": lambda: database.update_message_status(
+            rng.randint(1, rows), rng.choice(["ok", "restricted"])
+        ),
+        "claim_messages + ack_messages": claim_ack,
+    }
+
+    results: Dict[str, dict] = {"_fill_s": {"seconds": fill_time}}
+    try:
+        for name, func in cases.items():
+            results[name] = await measure(func, iterations)
+            print(f"  {name:<36} p50 {results[name]['p50_ms']:8.3f} ms  p95 {results[name]['p95_ms']:8.3f} ms")
+    finally:
+        await database.close()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(db_path + suffix)
+            except FileNotFoundError:
+                pass
+        os.rmdir(temp_dir)
+    return results
+
+
+async def main_async(args) -> Dict[str, dict]:
+    results = {}
+    for rows in args.sizes:
+        print(f"\n{rows} строк")
+        results[str(rows)] = await bench_size(rows, args.iterations, args.seed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[1000, 10000, 100000],
+                        help="размеры таблицы через запятую (по умолчанию 1000,10000,100000)")
+    parser.add_argument("--iterations", type=int, default=200, help="вызовов каждого метода")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="путь к JSON с результатами")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    path = save_results("db", config, results, args.output)
+    print(f"\nРезультаты сохранены: {path}")
+
+
+if __name__ == "__main__":
+    main()
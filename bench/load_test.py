@@ -0,0 +1,255 @@
+"""Нагрузочный тест API с локальной заглушкой OpenAI.
+
+Поднимает заглушку /v1/chat/completions и uvicorn с api:app на временной базе,
+затем гоняет смесь запросов (create, latest, all, patch) заданным числом
+параллельных клиентов. Печатает пропускную способность и p50/p95/p99 по каждому
+эндпоинту и сохраняет результат в bench/results/*.json.
+
+    python bench/load_test.py --duration 30 --concurrency 50 --latency-ms 800
+    python bench/load_test.py --mix create=1,latest=5,all=2,patch=1 --async-create
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from common import ROOT, save_results, summarize
+from mock_openai import MockOpenAI, start_mock
+
+DEFAULT_MIX = "create=2,latest=5,all=2,patch=1"
+
+NAMES = ["Анна", "Борис", "Вера", "Глеб", "Дарья", "Егор", "Жанна", "Зоя", "Иван", "Кира"]
+MOODS = ["радостное", "грустное", "спокойное", "злое", None]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        key, _, weight = part.partition("=")
+        mix[key.strip()] = float(weight or 1)
+    unknown = set(mix) - {"create", "latest", "all", "patch"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Неизвестные эндпоинты: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class LoadTest:
+    """Генератор нагрузки со статистикой по эндпоинтам"""
+
+    def __init__(self, base_url: str, mix: Dict[str, float], unique_ratio: float, async_create: bool, seed: int = None):
+        self.base_url = base_url
+        self.endpoints = list(mix)
+        self.weights = [mix[name] for name in self.endpoints]
+        self.unique_ratio = unique_ratio
+        self.async_create = async_create
+        self.random = random.Random(seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.failures: Dict[str, int] = defaultdict(int)
+        self.known_ids: List[int] = []
+        self.counter = 0
+
+    def _profile(self) -> dict:
+        name = self.random.choice(NAMES)
+        if self.random.random() < self.unique_ratio:
+            # Уникальное имя — промах мимо кэша модерации
+            self.counter += 1
+            name = f"{name}{self.counter}"
+        return {
+            "name": name,
+            "age": self.random.randint(7, 80),
+            "gender": self.random.choice(["мужской", "женский", None]),
+            "mood": self.random.choice(MOODS),
+        }
+
+    async def _call(self, session: aiohttp.ClientSession, endpoint: str):
+        if endpoint == "create":
+            params = {"async": "true"} if self.async_create else None
+            return session.post("/api/messages/create", json=self._profile(), params=params)
+        if endpoint == "latest":
+            return session.get("/api/messages")
+        if endpoint == "all":
+            return session.get("/api/messages/all", params={"limit": 200})
+        message_id = self.random.choice(self.known_ids) if self.known_ids else 1
+        status = self.random.choice(["ok", "restricted"])
+        return session.patch(f"/api/messages/{message_id}/status", json={"status": status})
+
+    async def _client(self, session: aiohttp.ClientSession, deadline: float):
+        while time.perf_counter() < deadline:
+            endpoint = self.random.choices(self.endpoints, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                async with await self._call(session, endpoint) as response:
+                    body = await response.read()
+                    elapsed = time.perf_counter() - started
+                    self.statuses[endpoint][response.status] += 1
+                    if response.status < 400:
+                        self.latencies[endpoint].append(elapsed)
+                        if endpoint == "create":
+                            self._remember(body)
+                    else:
+                        self.failures[endpoint] += 1
+            except Exception:
+                self.failures[endpoint] += 1
+
+    def _remember(self, body: bytes):
+        try:
+            message_id = json.loads(body).get("id")
+        except ValueError:
+            return
+        if message_id:
+            self.known_ids.append(message_id)
+            if len(self.known_ids) > 1000:
+                del self.known_ids[:500]
+
+    async def run(self, concurrency: int, duration: float) -> dict:
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        timeout = aiohttp.ClientTimeout(total=120)
+        async with aiohttp.ClientSession(self.base_url, connector=connector, timeout=timeout) as session:
+            started = time.perf_counter()
+            deadline = started + duration
+            await asyncio.gather(*(self._client(session, deadline) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        endpoints = {}
+        total = 0
+        for endpoint in self.endpoints:
+            stats = summarize(self.latencies[endpoint])
+            stats["throughput_rps"] = len(self.latencies[endpoint]) / elapsed
+            stats["failures"] = self.failures[endpoint]
+            stats["statuses"] = {str(code): count for code, count in sorted(self.statuses[endpoint].items())}
+            endpoints[endpoint] = stats
+            total += len(self.latencies[endpoint])
+        return {
+            "elapsed_s": elapsed,
+            "total_requests": total,
+            "throughput_rps": total / elapsed,
+            "endpoints": endpoints,
+        }
+
+
+async def wait_for_server(base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("uvicorn завершился при старте")
+            try:
+                async with session.get(f"{base_url}/api/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("API не поднялось за отведённое время")
+
+
+def start_api(args, mock_url: Optional[str], database_path: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["DATABASE_PATH"] = database_path
+    env.setdefault("OPENAI_API_KEY", "bench")
+    if mock_url:
+        env["OPENAI_BASE_URL"] = mock_url
+    env["API_WORKERS"] = str(args.workers)
+    command = [
+        sys.executable, "-m", "uvicorn", "api:app",
+        "--host", "127.0.0.1", "--port", str(args.api_port),
+        "--workers", str(args.workers),
+        "--log-level", "warning", "--no-access-log",
+    ]
+    output = None if args.verbose else subprocess.DEVNULL
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=output)
+
+
+async def main_async(args) -> dict:
+    mock_runner = None
+    mock = None
+    process = None
+    base_url = args.target or f"http://127.0.0.1:{args.api_port}"
+    temp_dir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        if not args.target:
+            mock_url = None
+            if not args.no_mock:
+                mock = MockOpenAI(args.latency_ms, args.jitter_ms, args.error_rate, seed=args.seed)
+                mock_runner = await start_mock(mock, port=args.mock_port)
+                mock_url = f"http://127.0.0.1:{args.mock_port}/v1"
+            process = start_api(args, mock_url, os.path.join(temp_dir, "bench.db"))
+            await wait_for_server(base_url, process)
+
+        test = LoadTest(base_url, args.mix, args.unique_ratio, args.async_create, seed=args.seed)
+        if args.warmup > 0:
+            await test.run(args.concurrency, args.warmup)
+            test = LoadTest(base_url, args.mix, args.unique_ratio, args.async_create, seed=args.seed)
+        results = await test.run(args.concurrency, args.duration)
+        if mock is not None:
+            results["mock"] = {"requests": mock.requests, "errors": mock.errors}
+        return results
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if mock_runner is not None:
+            await mock_runner.cleanup()
+
+
+def print_report(results: dict):
+    print(f"\nВсего: {results['total_requests']} запросов за {results['elapsed_s']:.1f} с "
+          f"({results['throughput_rps']:.1f} rps)")
+    print(f"{'endpoint':<8} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'fail':>6}")
+    for endpoint, stats in results["endpoints"].items():
+        if not stats["count"]:
+            print(f"{endpoint:<8} {'-':>8} {'-':>9} {'-':>9} {'-':>9} {stats['failures']:>6}")
+            continue
+        print(f"{endpoint:<8} {stats['throughput_rps']:>8.1f} {stats['p50_ms']:>9.1f} "
+              f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['failures']:>6}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20, help="длительность замера, с")
+    parser.add_argument("--warmup", type=float, default=2, help="прогрев перед замером, с")
+    parser.add_argument("--concurrency", type=int, default=20, help="число параллельных клиентов")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"веса эндпоинтов (по умолчанию {DEFAULT_MIX})")
+    parser.add_argument("--unique-ratio", type=float, default=0.8,
+                        help="доля уникальных имён (промахи кэша модерации)")
+    parser.add_argument("--async-create", action="store_true", help="создавать сообщения с ?async=true")
+    parser.add_argument("--latency-ms", type=float, default=500, help="задержка заглушки OpenAI")
+    parser.add_argument("--jitter-ms", type=float, default=200, help="разброс задержки заглушки")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ошибок заглушки")
+    parser.add_argument("--mock-port", type=int, default=8765)
+    parser.add_argument("--api-port", type=int, default=8766)
+    parser.add_argument("--no-mock", action="store_true", help="не поднимать заглушку (OPENAI_BASE_URL из окружения)")
+    parser.add_argument("--target", help="URL уже запущенного API вместо локального uvicorn")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="показывать вывод сервера")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов uvicorn (API_WORKERS)")
+    parser.add_argument("--output", help="путь к JSON с результатами")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    results = asyncio.run(main_async(args))
+    print_report(results)
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    path = save_results("load", config, results, args.output)
+    print(f"Результаты сохранены: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Локальная замена OpenAI /v1/chat/completions для нагрузочных тестов.
+
+Отвечает в формате chat/completions с JSON-результатом модерации.
+Задержка, разброс и доля ошибок настраиваются. Если схема ответа
+допускает статус "uncertain" (быстрая модель каскада), доля
+--uncertain-ratio ответов не уверена.
+
+    python bench/mock_openai.py --port 8765 --latency-ms 800 --jitter-ms 300 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+
+class MockOpenAI:
+    """Заглушка OpenAI с настраиваемой задержкой и ошибками"""
+
+    def __init__(
+        self,
+        latency_ms: float = 500,
+        jitter_ms: float = 200,
+        error_rate: float = 0.0,
+        seed: int = None,
+        uncertain_ratio: float = 0.0
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.uncertain_ratio = uncertain_ratio
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.uncertain = 0
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        payload = await request.json()
+        delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            status = self.random.choice([429, 500, 503])
+            headers = {"Retry-After": "1"} if status == 429 else {}
+            return web.json_response({"error": {"message": "mock error"}}, status=status, headers=headers)
+
+        user_content = payload["messages"][-1]["content"]
+        name = user_content.split("\n", 1)[0].split(":", 1)[-1].strip() or "Гость"
+        result = {"status": "ok", "response": f"{name}, живи красиво, даже без повода."}
+        schema = payload.get("response_format", {}).get("json_schema", {}).get("schema", {})
+        statuses = schema.get("properties", {}).get("status", {}).get("enum", [])
+        if "uncertain" in statuses and self.random.random() < self.uncertain_ratio:
+            self.uncertain += 1
+            result = {"status": "uncertain", "response": ""}
+        prompt_tokens = sum(len(m["content"]) for m in payload["messages"]) // 3
+        return web.json_response({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(result, ensure_ascii=False)},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 20,
+                "total_tokens": prompt_tokens + 20,
+            },
+        })
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        return app
+
+
+async def start_mock(mock: MockOpenAI, host: str = "127.0.0.1", port: int = 8765) -> web.AppRunner:
+    """Запустить заглушку в текущем event loop"""
+    runner = web.AppRunner(mock.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--uncertain-ratio", type=float, default=0.0, help="доля ответов 'uncertain' быстрой модели")
+    args = parser.parse_args()
+    mock = MockOpenAI(args.latency_ms, args.jitter_ms, args.error_rate, uncertain_ratio=args.uncertain_ratio)
+    web.run_app(mock.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Локальная замена Telegram Bot API для проверки бота без Telegram.
+
+Реализует методы, которыми пользуется бот: getMe, getUpdates (long
+polling), sendMessage, editMessageText, deleteMessage, setWebhook и
+deleteWebhook. Обновления добавляются через push_update() или
+POST /push {"user_id": ..., "text": ...}; отправленные ботом сообщения
+и их правки сохраняются для проверки.
+
+    python bench/mock_telegram.py --port 8766
+    TELEGRAM_API_URL=http://127.0.0.1:8766 TELEGRAM_BOT_TOKEN=1:mock python telegram_bot.py
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Прохор", "username": "prokhor_bot"}
+
+
+class MockTelegram:
+    """Заглушка Bot API с очередью обновлений и журналом ответов бота"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self._updates: List[Dict[str, Any]] = []
+        self._new_update = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        # message_id ответа бота → {"chat_id", "text", "history", "reply_to"}
+        self.messages: Dict[int, Dict[str, Any]] = {}
+        # (chat_id, message_id пользователя) → время отправки
+        self.pushed_at: Dict[tuple, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.webhook: Optional[Dict[str, Any]] = None
+
+    def _next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def make_update(self, user_id: int, text: str, message_id: Optional[int] = None) -> Dict[str, Any]:
+        """Обновление с текстовым сообщением пользователя"""
+        self._update_id += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+        return {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": message_id or self._next_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": user,
+                "text": text,
+            },
+        }
+
+    def push_update(self, user_id: int, text: str, message_id: Optional[int] = None) -> Dict[str, Any]:
+        """Поставить обновление в очередь getUpdates"""
+        update = self.make_update(user_id, text, message_id)
+        message = update["message"]
+        self.pushed_at.setdefault((user_id, message["message_id"]), time.perf_counter())
+        self._updates.append(update)
+        self._new_update.set()
+        return update
+
+    def replies(self, chat_id: int) -> List[Dict[str, Any]]:
+        """Ответы бота в чат (в порядке отправки)"""
+        return [m for _, m in sorted(self.messages.items()) if m["chat_id"] == chat_id]
+
+    def _bot_message(self, message_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def _get_updates(self, params: Dict[str, Any]) -> Any:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # offset подтверждает все обновления до него
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _send_message(self, params: Dict[str, Any]) -> Any:
+        chat_id = int(params["chat_id"])
+        message_id = self._next_message_id()
+        self.messages[message_id] = {
+            "chat_id": chat_id,
+            "text": params["text"],
+            "history": [(time.perf_counter(), params["text"])],
+        }
+        return self._bot_message(message_id, chat_id, params["text"])
+
+    def _edit_message_text(self, params: Dict[str, Any]) -> Any:
+        message_id = int(params["message_id"])
+        message = self.messages.get(message_id)
+        if message is None:
+            raise web.HTTPBadRequest(text="message to edit not found")
+        message["text"] = params["text"]
+        message["history"].append((time.perf_counter(), params["text"]))
+        return self._bot_message(message_id, message["chat_id"], params["text"])
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post())
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        try:
+            if method == "getMe":
+                result = BOT_USER
+            elif method == "getUpdates":
+                result = await self._get_updates(params)
+            elif method == "sendMessage":
+                result = self._send_message(params)
+            elif method == "editMessageText":
+                result = self._edit_message_text(params)
+            elif method == "deleteMessage":
+                self.messages.pop(int(params["message_id"]), None)
+                result = True
+            elif method == "setWebhook":
+                self.webhook = params
+                result = True
+            elif method == "deleteWebhook":
+                self.webhook = None
+                result = True
+            else:
+                return web.json_response(
+                    {"ok": False, "error_code": 404, "description": f"Not Found: method {method}"}, status=404
+                )
+        except web.HTTPBadRequest as e:
+            return web.json_response({"ok": False, "error_code": 400, "description": e.text}, status=400)
+        return web.json_response({"ok": True, "result": result})
+
+    async def push(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        update = self.push_update(int(payload["user_id"]), payload["text"])
+        return web.json_response(update)
+
+    async def dump(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=json.dumps({"calls": self.calls, "messages": self.messages}, ensure_ascii=False, default=str),
+            content_type="application/json"
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_post("/push", self.push)
+        app.router.add_get("/messages", self.dump)
+        return app
+
+
+async def start_mock(mock: MockTelegram, host: str = "127.0.0.1", port: int = 8766) -> web.AppRunner:
+    """Запустить заглушку в текущем event loop"""
+    runner = web.AppRunner(mock.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(MockTelegram(args.latency_ms).app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Чтение большого числа строк messages: словари против MessageRow.
+
+Сравниваются три способа получить --rows строк одним запросом:
+словарь на строку в event loop (как было до MessageRow), MessageRow
+через row_factory в потоке соединения и MessageRow без колонки
+openai_response. Для каждого замеряются общее время, процессорное
+время event loop и память на строку (tracemalloc).
+
+    python bench/rows_bench.py --rows 100000 --iterations 5
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+from common import save_results
+from db_bench import fill
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from database import Database
+from events import EventHub
+from rows import ALL_COLUMNS, LIST_COLUMNS, MESSAGE_FIELDS, message_row
+
+
+def row_to_dict(row) -> Dict[str, Any]:
+    """Прежнее преобразование: словарь из 12 ключей на каждую строку"""
+    message = dict(zip(MESSAGE_FIELDS, row))
+    message['is_fetched'] = bool(message['is_fetched'])
+    return message
+
+
+async def main_async(args) -> Dict[str, dict]:
+    temp_dir = tempfile.mkdtemp(prefix="rows-bench-")
+    db_path = os.path.join(temp_dir, "bench.db")
+    database = Database(db_path, hub=EventHub())
+    await database.init_db()
+    await database.close()
+    fill(db_path, args.rows)
+    database = Database(db_path, hub=EventHub())
+    await database.init_db()
+
+    async def fetch(columns_sql: str, factory) -> List[Any]:
+        async with database.pool.reader() as db:
+            cursor = await db.execute("SELECT " + columns_sql + " FROM messages ORDER BY id LIMIT ?", (args.rows,))
+            cursor.row_factory = factory
+            rows = await cursor.fetchall()
+            await cursor.close()
+        return rows
+
+    async def dicts():
+        return [row_to_dict(row) for row in await fetch(ALL_COLUMNS.sql, None)]
+
+    async def message_rows():
+        return await fetch(ALL_COLUMNS.sql, message_row)
+
+    async def message_rows_list():
+        return await fetch(LIST_COLUMNS.sql, message_row)
+
+    cases = {
+        "dict на строку": dicts,
+        "MessageRow": message_rows,
+        "MessageRow без openai_response": message_rows_list,
+    }
+    results: Dict[str, dict] = {}
+    try:
+        for name, func in cases.items():
+            await func()  # прогрев кэша страниц SQLite
+            wall, loop_cpu = [], []
+            for _ in range(args.iterations):
+                wall_started, cpu_started = time.perf_counter(), time.thread_time()
+                await func()
+                wall.append(time.perf_counter() - wall_started)
+                loop_cpu.append(time.thread_time() - cpu_started)
+            tracemalloc.start()
+            rows = await func()
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del rows
+            results[name] = {
+                "p50_ms": sorted(wall)[len(wall) // 2] * 1000,
+                "loop_cpu_ms": sorted(loop_cpu)[len(loop_cpu) // 2] * 1000,
+                "bytes_per_row": memory / args.rows,
+            }
+            print(f"  {name:<32} {results[name]['p50_ms']:9.1f} ms  loop {results[name]['loop_cpu_ms']:9.1f} ms"
+                  f"  {results[name]['bytes_per_row']:7.0f} Б/строку")
+    finally:
+        await database.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return {str(args.rows): results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="сколько строк читать")
+    parser.add_argument("--iterations", type=int, default=5, help="повторов каждого способа")
+    parser.add_argument("--output", help="путь к JSON с результатами")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    path = save_results("db", config, results, args.output)
+    print(f"\nРезультаты сохранены: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Масштабирование API по числу процессов uvicorn.
+
+Запускает load_test.py с одинаковой нагрузкой для каждого значения
+--workers-list и печатает пропускную способность и p95 относительно
+одного процесса. Остальные параметры — как у load_test.py.
+
+    python bench/scaling.py --workers-list 1,2,4 --duration 20 --concurrency 64
+    python bench/scaling.py --workers-list 1,4 --mix latest=5,all=3,create=1 --async-create
+"""
+import asyncio
+import os
+import sys
+
+from common import save_results
+from load_test import build_parser, main_async
+
+
+def main():
+    parser = build_parser()
+    parser.description = __doc__
+    parser.add_argument("--workers-list", default="1,2,4", help="число процессов через запятую")
+    args = parser.parse_args()
+    workers_list = [int(value) for value in args.workers_list.split(",")]
+
+    results = {}
+    for workers in workers_list:
+        args.workers = workers
+        print(f"\n=== {workers} worker(s) ===")
+        run = asyncio.run(main_async(args))
+        results[f"workers={workers}"] = {
+            "total": {
+                "throughput_rps": run["throughput_rps"],
+                "count": run["total_requests"],
+            },
+            **run["endpoints"],
+        }
+        print(f"{run['throughput_rps']:.1f} rps")
+
+    base = results[f"workers={workers_list[0]}"]["total"]["throughput_rps"] or 1
+    print(f"\n{'workers':>8} {'rps':>9} {'speedup':>8}  p95 ms по эндпоинтам")
+    for workers in workers_list:
+        cases = results[f"workers={workers}"]
+        rps = cases["total"]["throughput_rps"]
+        p95 = ", ".join(
+            f"{name}={stats['p95_ms']:.0f}" for name, stats in cases.items()
+            if name != "total" and stats.get("count")
+        )
+        print(f"{workers:>8} {rps:>9.1f} {rps / base:>7.2f}x  {p95}")
+    print(f"\nЯдер CPU: {os.cpu_count()}; прирост ограничен их числом")
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "workers")}
+    path = save_results("scaling", config, results, args.output)
+    print(f"Результаты сохранены: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Время event loop на сериализацию ответов: старый и быстрый путь.
+
+Для каждого сценария замеряется процессорное время основного потока
+(time.thread_time) — ровно то время, на которое запрос занимает event
+loop. Чтение SQLite идёт в потоке aiosqlite и сюда не попадает.
+
+    python bench/serialization_bench.py --rows 100000 --iterations 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from common import save_results, summarize
+from db_bench import fill
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from fastapi.encoders import jsonable_encoder
+
+from database import Database
+from events import EventHub
+from serialization import FastJSONResponse, dumps_text, raw_json
+
+OPENAI_RESULT = {
+    "response": "Иван, живи красиво, даже без повода. Как говорил Фёдор Иванович, главное — петь.",
+    "status": "ok",
+}
+
+
+async def loop_time(func: Callable[[], Awaitable], iterations: int) -> Dict[str, float]:
+    """Сводка по процессорному времени основного потока на один вызов"""
+    samples: List[float] = []
+    for _ in range(iterations):
+        started = time.thread_time()
+        await func()
+        samples.append(time.thread_time() - started)
+    return summarize(samples)
+
+
+def render_default(content) -> bytes:
+    """Путь FastAPI по умолчанию: jsonable_encoder + JSONResponse"""
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+async def main_async(args) -> Dict[str, dict]:
+    temp_dir = tempfile.mkdtemp(prefix="serialization-bench-")
+    db_path = os.path.join(temp_dir, "bench.db")
+    database = Database(db_path, hub=EventHub())
+    await database.init_db()
+    await database.close()
+    fill(db_path, args.rows)
+    database = Database(db_path, hub=EventHub())
+    await database.init_db()
+
+    async def all_old():
+        render_default(await database.get_messages_page(limit=args.limit))
+
+    async def all_new():
+        FastJSONResponse(await database.get_messages_page_json(limit=args.limit))
+
+    async def create_old():
+        stored = json.dumps(OPENAI_RESULT, ensure_ascii=False)
+        render_default({"id": 1, "status": "ok", "openai_response": json.loads(stored)})
+
+    async def create_new():
+        stored = dumps_text(OPENAI_RESULT)
+        FastJSONResponse({"id": 1, "status": "ok", "openai_response": raw_json(stored)})
+
+    cases = {
+        f"/api/messages/all limit={args.limit} (dict + jsonable_encoder)": all_old,
+        f"/api/messages/all limit={args.limit} (json_object + orjson)": all_new,
+        "/api/messages/create ответ (json + jsonable_encoder)": create_old,
+        "/api/messages/create ответ (orjson, сырой openai_response)": create_new,
+    }
+    results: Dict[str, dict] = {}
+    try:
+        for name, func in cases.items():
+            results[name] = await loop_time(func, args.iterations)
+            print(f"  {name:<64} p50 {results[name]['p50_ms']:8.3f} ms  p95 {results[name]['p95_ms']:8.3f} ms")
+    finally:
+        await database.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return {str(args.rows): results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="размер таблицы messages")
+    parser.add_argument("--limit", type=int, default=1000, help="размер страницы /api/messages/all")
+    parser.add_argument("--iterations", type=int, default=200, help="вызовов каждого сценария")
+    parser.add_argument("--output", help="путь к JSON с результатами")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    path = save_results("db", config, results, args.output)
+    print(f"\nРезультаты сохранены: {path}")
+
+
+if __name__ == "__main__":
+    main()
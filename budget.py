@@ -0,0 +1,249 @@
+"""Учёт токенов и стоимости запросов к OpenAI, ограничение расходов.
+
+Каждый ответ OpenAI учитывается по полю usage. Стоимость считается
+по ценам модели и копится по часам и моделям; накопленное периодически
+дописывается в таблицу token_usage, откуда процессы API читают общие
+расходы. Скорость расходов — траты за последний час (текущий час плюс
+непрошедшая доля предыдущего). Когда она приближается к OPENAI_HOURLY_BUDGET,
+модерация переходит на дешёвую модель, а при превышении — на локальные
+правила и готовые фразы без запросов к OpenAI.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from config import settings
+from database import Database, db
+from metrics import OPENAI_COST, OPENAI_TOKENS
+
+# Режимы модерации по расходам
+FULL = "full"  # основная модель
+CHEAP = "cheap"  # дешёвая модель
+LOCAL = "local"  # только локальные правила и готовые фразы
+
+# USD за 1M токенов: (prompt, completion, cached prompt)
+DEFAULT_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+}
+
+
+def parse_prices(text: str) -> Dict[str, Tuple[float, float, float]]:
+    """Цены из строки вида "gpt-4o=2.5/10/1.25,my-model=0/0".
+
+    Цена кэшированных токенов необязательна (по умолчанию как prompt).
+    Заданные модели дополняют и переопределяют DEFAULT_PRICES.
+    """
+    prices = dict(DEFAULT_PRICES)
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        model, _, values = item.partition("=")
+        parts = [float(value) for value in values.split("/")]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Invalid price for {model}: {values!r}")
+        prices[model.strip()] = (parts[0], parts[1], parts[2] if len(parts) == 3 else parts[0])
+    return prices
+
+
+def combine_usage(
+    first: Optional[Dict[str, Any]],
+    second: Optional[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """Сумма токенов и стоимости двух вызовов (каскад моделей); модель — последняя"""
+    if first is None or second is None:
+        return second if first is None else first
+    combined = {key: first[key] + second[key] for key in ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'cost')}
+    combined['model'] = second['model']
+    return combined
+
+
+def hour_start(timestamp: float) -> int:
+    """Начало часа (unix time)"""
+    return int(timestamp // 3600 * 3600)
+
+
+def hour_label(hour: int) -> str:
+    """Час в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(hour))
+
+
+class TokenBudget:
+    """Счётчики токенов по часам и моделям и выбор режима модерации"""
+
+    def __init__(
+        self,
+        database: Database,
+        hourly_budget: float = 0.0,
+        cheap_model: str = "gpt-4o-mini",
+        cheap_at: float = 0.8,
+        prices: Optional[Dict[str, Tuple[float, float, float]]] = None,
+        flush_interval: float = 10.0
+    ):
+        self.database = database
+        # Предел расходов в час, USD; 0 — без ограничения
+        self.hourly_budget = hourly_budget
+        self.cheap_model = cheap_model
+        # Доля бюджета, после которой включается дешёвая модель
+        self.cheap_at = cheap_at
+        self.prices = prices if prices is not None else dict(DEFAULT_PRICES)
+        self.flush_interval = flush_interval
+        # (час, модель) → [вызовы, prompt, completion, cached, стоимость], ещё не в базе
+        self._pending: Dict[Tuple[int, str], list] = {}
+        # Час → расходы всех процессов по данным базы
+        self._synced: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._mode = FULL
+        # Метрики
+        self.calls = 0
+        self.unpriced = 0
+        self.mode_changes = 0
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """Стоимость вызова, USD; модель без цены — 0"""
+        price = self.prices.get(model)
+        if price is None:
+            return 0.0
+        prompt_price, completion_price, cached_price = price
+        return (
+            (prompt_tokens - cached_tokens) * prompt_price
+            + cached_tokens * cached_price
+            + completion_tokens * completion_price
+        ) / 1_000_000
+
+    def usage(self, model: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Токены и стоимость из ответа chat/completions"""
+        usage = data.get('usage') or {}
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        return {
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cached_tokens': cached_tokens,
+            'cost': self.cost(model, prompt_tokens, completion_tokens, cached_tokens),
+        }
+
+    def record(self, model: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Учесть ответ OpenAI, вернуть его токены и стоимость"""
+        usage = self.usage(model, data)
+        entry = self._pending.setdefault((hour_start(time.time()), model), [0, 0, 0, 0, 0.0])
+        entry[0] += 1
+        entry[1] += usage['prompt_tokens']
+        entry[2] += usage['completion_tokens']
+        entry[3] += usage['cached_tokens']
+        entry[4] += usage['cost']
+        self.calls += 1
+        if model not in self.prices:
+            self.unpriced += 1
+        OPENAI_TOKENS.inc(usage['prompt_tokens'], model=model, type="prompt")
+        OPENAI_TOKENS.inc(usage['completion_tokens'], model=model, type="completion")
+        # Токены статического префикса, взятые из кэша промптов OpenAI
+        OPENAI_TOKENS.inc(usage['cached_tokens'], model=model, type="cached_prompt")
+        OPENAI_COST.inc(usage['cost'], model=model)
+        return usage
+
+    def spent(self, hour: int) -> float:
+        """Расходы за час: общие из базы плюс ещё не записанные"""
+        pending = sum(entry[4] for (entry_hour, _), entry in self._pending.items() if entry_hour == hour)
+        return self._synced.get(hour, 0.0) + pending
+
+    def spend_rate(self, now: Optional[float] = None) -> float:
+        """Расходы за последний час, USD.
+
+        Предыдущий час учитывается долей, которая ещё входит в окно.
+        """
+        now = time.time() if now is None else now
+        current = hour_start(now)
+        elapsed = (now - current) / 3600
+        return self.spent(current) + self.spent(current - 3600) * (1 - elapsed)
+
+    def mode(self) -> str:
+        """Режим модерации при текущей скорости расходов"""
+        if self.hourly_budget <= 0:
+            return FULL
+        rate = self.spend_rate()
+        if rate >= self.hourly_budget:
+            mode = LOCAL
+        elif rate >= self.hourly_budget * self.cheap_at:
+            mode = CHEAP
+        else:
+            mode = FULL
+        if mode != self._mode:
+            self.mode_changes += 1
+            print(f"[TokenBudget] Mode {self._mode} -> {mode}: ${rate:.4f}/h of ${self.hourly_budget:.2f}/h")
+            self._mode = mode
+        return mode
+
+    async def flush(self):
+        """Записать накопленное в базу и обновить общие расходы"""
+        pending, self._pending = self._pending, {}
+        if pending:
+            try:
+                await self.database.add_token_usage([
+                    (hour_label(hour), model, *entry) for (hour, model), entry in pending.items()
+                ])
+            except Exception:
+                # Вернуть несохранённое, чтобы записать при следующей попытке
+                for key, entry in pending.items():
+                    current = self._pending.setdefault(key, [0, 0, 0, 0, 0.0])
+                    for idx, value in enumerate(entry):
+                        current[idx] += value
+                raise
+        current = hour_start(time.time())
+        spent = await self.database.get_hourly_spend(hour_label(current - 3600))
+        self._synced = {
+            hour: spent.get(hour_label(hour), 0.0) for hour in (current - 3600, current)
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[TokenBudget] Flush failed: {e}")
+
+    async def start(self):
+        """Загрузить расходы за последний час и запустить запись счётчиков"""
+        await self.flush()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="token-budget-flush")
+
+    async def stop(self):
+        """Остановить фоновую запись и дописать накопленное"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[TokenBudget] Final flush failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode(),
+            "hourly_budget": self.hourly_budget,
+            "spend_rate": self.spend_rate(),
+            "cheap_model": self.cheap_model,
+            "calls": self.calls,
+            "unpriced_calls": self.unpriced,
+            "mode_changes": self.mode_changes,
+        }
+
+
+# Глобальный учёт расходов
+token_budget = TokenBudget(
+    db,
+    hourly_budget=settings.openai_hourly_budget,
+    cheap_model=settings.openai_cheap_model,
+    cheap_at=settings.openai_cheap_at,
+    prices=parse_prices(settings.openai_prices),
+    flush_interval=settings.openai_usage_flush_interval
+)
@@ -7,13 +7,94 @@ class Settings(BaseSettings):
     """Настройки приложения"""
     # OpenAI
     openai_api_key: str
+    openai_base_url: str = "https://api.openai.com/v1"
+    openai_max_concurrency: int = 10  # Параллельные запросы и размер пула соединений
+    openai_timeout: float = 60.0  # Общий таймаут запроса, сек
+    openai_connect_timeout: float = 5.0
+    openai_read_timeout: float = 30.0
+    openai_deadline: float = 45.0  # Бюджет на одну проверку вместе с повторами, сек
+    openai_max_attempts: int = 3  # Попыток на 429, 5xx и ошибки соединения
+    openai_retry_base_delay: float = 0.5  # Пауза перед повтором: случайная до base * 2^n
+    openai_retry_max_delay: float = 8.0
+    openai_breaker_threshold: int = 5  # Ошибок подряд до размыкания
+    openai_breaker_reset: float = 30.0  # Сколько секунд отказывать сразу
+    openai_min_concurrency: int = 1  # Нижняя граница адаптивного лимита
+    openai_latency_target: float = 15.0  # Ответ дольше — сигнал перегрузки, сек
+    openai_model: str = "gpt-4o"  # Основная модель модерации и генерации фраз
+    
+    # Каскад моделей: сначала быстрая модель, основная — только при сомнении
+    moderation_fast_model: str = ""  # Например gpt-4o-mini; пусто — каскад выключен
+    moderation_fast_base_url: str = ""  # OpenAI-совместимый API (локальная модель); пусто — OPENAI_BASE_URL
+    moderation_fast_api_key: str = ""  # Пусто — OPENAI_API_KEY для OpenAI, без ключа для своего адреса
+    moderation_fast_timeout: float = 5.0  # Таймаут быстрой модели, сек; не успела — основная
+    moderation_fast_escalate_restricted: bool = True  # Отклонения быстрой модели перепроверяет основная
+    
+    # Расходы на OpenAI
+    openai_hourly_budget: float = 0.0  # Предел расходов, USD в час; 0 — без ограничения
+    openai_cheap_model: str = "gpt-4o-mini"  # Модель при расходах выше OPENAI_CHEAP_AT от бюджета
+    openai_cheap_at: float = 0.8  # Доля бюджета; при превышении всего бюджета — только локальные правила
+    openai_prices: str = ""  # Доп. цены, USD за 1M токенов: "model=prompt/completion[/cached],..."
+    openai_usage_flush_interval: float = 10.0  # Как часто записывать счётчики токенов в базу, сек
     
     # Database
     database_path: str = "./data/messages.db"
+    db_pool_size: int = 4  # Количество соединений для чтения
+    db_busy_timeout_ms: int = 5000
+    db_synchronous: str = "NORMAL"  # OFF / NORMAL / FULL — долговечность коммитов
+    db_write_batch_size: int = 64  # Максимум новых сообщений в одной транзакции
+    db_write_batch_delay_ms: float = 0.0  # Доп. ожидание следующих вставок перед коммитом
+    latest_cache_size: int = 20  # Сколько последних одобренных сообщений держать в памяти
+    
+    # Кэш вердиктов модерации
+    moderation_cache_size: int = 5000
+    moderation_cache_ttl: float = 3600.0  # Секунды, 0 — кэш отключен
+    moderation_cache_persistent: bool = False  # Дублировать кэш в SQLite
+    
+    # Локальные правила предмодерации
+    moderation_rules_path: str = "./moderation_rules.json"
+    moderation_rules_reload_interval: float = 2.0  # Как часто проверять изменения файла, сек
+    
+    # Фоновая модерация
+    moderation_workers: int = 4  # Количество параллельных обработчиков
+    moderation_async_default: bool = False  # Режим по умолчанию для POST /api/messages/create
+    moderation_retry_delay: float = 30.0  # Пауза перед повторной модерацией после сбоя, сек
+    moderation_lease_timeout: float = 120.0  # Сообщение на модерации не берут другие процессы, сек
+    idempotency_ttl: float = 86400.0  # Сколько помнить Idempotency-Key, сек
+    
+    # Пул готовых фраз Прохора
+    phrase_pool_enabled: bool = False  # Брать текст из пула, OpenAI проверяет только имя
+    phrase_pool_name_check: str = "openai"  # openai — проверка имени моделью, rules — только локальные правила
+    phrase_pool_low_watermark: int = 10  # Меньше свежих фраз в группе — догенерировать
+    phrase_pool_batch_size: int = 10  # Фраз за один запрос генерации
+    phrase_pool_max_size: int = 200  # Предел фраз в одной группе (пол × настроение)
+    phrase_pool_reuse_after: float = 3600.0  # Через сколько секунд фразу можно показать снова
+    phrase_pool_refill_interval: float = 30.0  # Период фонового пополнения, сек
+    
+    # Выгрузка и архив сообщений
+    export_chunk_size: int = 500  # Строк в одной порции выгрузки
+    archive_dir: str = "./data/archive"  # Сжатые помесячные архивы сообщений
+    archive_after_days: float = 0.0  # Переносить в архив сообщения старше N дней, 0 — не переносить
+    archive_interval: float = 3600.0  # Период фонового переноса, сек
+    
+    # Telegram бот
+    telegram_bot_token: str = ""
+    telegram_api_url: str = ""  # Свой сервер Bot API (или локальная заглушка); пусто — api.telegram.org
+    telegram_workers: int = 4  # Сколько сообщений бота модерируется параллельно
+    telegram_queue_size: int = 100  # Очередь между диспетчером и модерацией; полная — приём приостанавливается
+    telegram_user_rate: float = 6.0  # Сообщений в минуту от одного пользователя
+    telegram_user_burst: int = 3  # Сколько сообщений подряд пропускается без ограничения
+    telegram_dedup_window: float = 60.0  # Повтор того же имени от пользователя в течение N секунд игнорируется
+    telegram_mode: str = "polling"  # polling — отдельный процесс telegram_bot.py, webhook — маршрут в API
+    telegram_webhook_url: str = ""  # Публичный адрес API для Telegram, например https://example.com
+    telegram_webhook_path: str = "/api/telegram/webhook"
+    telegram_webhook_secret: str = ""  # Заголовок X-Telegram-Bot-Api-Secret-Token; пусто — выводится из токена
     
     # API Server
     api_host: str = "0.0.0.0"
     api_port: int = 8000
+    api_workers: int = 1  # Процессы uvicorn; больше 1 — общий лимит OpenAI и процесс-лидер
+    change_poll_interval: float = 0.5  # Как часто проверять записи других процессов, сек
+    leader_retry_interval: float = 5.0  # Как часто процессы пробуют стать лидером, сек
     
     class Config:
         env_file = ".env"
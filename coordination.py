@@ -0,0 +1,313 @@
+"""Согласование нескольких процессов API (API_WORKERS > 1).
+
+- SharedSlots — общий для всех процессов лимит параллельных запросов
+  (слоты — файлы с блокировкой flock; блокировка снимается ОС, если
+  процесс упал, поэтому слоты не «утекают»);
+- LeaderElection — процесс-лидер, который выполняет фоновые задачи;
+- ChangeWatcher — узнаёт о записях других процессов по PRAGMA
+  data_version, сбрасывает кэши в памяти и пересылает события в SSE.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: доступен только режим с одним процессом
+    fcntl = None
+
+from config import settings
+from database import Database, db
+from resilience import DeadlineExceeded
+
+
+def _open_lock_file(path: str) -> int:
+    if fcntl is None:
+        raise RuntimeError("File locks (fcntl) are not available on this platform")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+
+def _try_lock(fd: int) -> bool:
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+class SharedSlots:
+    """Межпроцессный семафор на файловых блокировках.
+
+    Каждый слот — отдельный файл; занять слот значит взять на него
+    эксклюзивный flock без ожидания. Если свободных слотов нет, попытки
+    повторяются с растущей паузой до timeout.
+    """
+
+    def __init__(self, prefix: str, slots: int, poll_interval: float = 0.005, max_poll_interval: float = 0.05):
+        self.prefix = prefix
+        self.slots = max(1, slots)
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._fds: List[int] = []
+        # flock одного дескриптора повторно не блокирует, поэтому занятые
+        # этим процессом слоты учитываются отдельно
+        self._held: set = set()
+        self.waits = 0
+
+    def _open(self):
+        if not self._fds:
+            self._fds = [_open_lock_file(f"{self.prefix}.{idx}.lock") for idx in range(self.slots)]
+
+    def try_acquire(self) -> Optional[int]:
+        """Занять свободный слот без ожидания; None, если все заняты"""
+        self._open()
+        free = [idx for idx in range(self.slots) if idx not in self._held]
+        random.shuffle(free)
+        for idx in free:
+            if _try_lock(self._fds[idx]):
+                self._held.add(idx)
+                return idx
+        return None
+
+    async def acquire(self, timeout: Optional[float] = None) -> int:
+        """Занять слот; DeadlineExceeded, если не дождались за timeout"""
+        slot = self.try_acquire()
+        if slot is not None:
+            return slot
+        self.waits += 1
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = self.poll_interval
+        while True:
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise DeadlineExceeded("Timed out waiting for a shared concurrency slot")
+            await asyncio.sleep(delay)
+            slot = self.try_acquire()
+            if slot is not None:
+                return slot
+            delay = min(self.max_poll_interval, delay * 2)
+
+    def release(self, slot: int):
+        if slot in self._held:
+            fcntl.flock(self._fds[slot], fcntl.LOCK_UN)
+            self._held.discard(slot)
+
+    def close(self):
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+        self._held.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"slots": self.slots, "held": len(self._held), "waits": self.waits}
+
+
+class LeaderElection:
+    """Выбор процесса-лидера через flock на файле.
+
+    Лидер держит блокировку до остановки; остальные процессы пробуют
+    взять её каждые retry_interval секунд, поэтому после падения лидера
+    его задачи подхватывает другой процесс.
+    """
+
+    def __init__(self, path: str, retry_interval: float = 5.0):
+        self.path = path
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._fd: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        if self._fd is None:
+            self._fd = _open_lock_file(self.path)
+        if _try_lock(self._fd):
+            self.is_leader = True
+            os.ftruncate(self._fd, 0)
+            os.write(self._fd, str(os.getpid()).encode())
+        return self.is_leader
+
+    async def start(self, on_elected: Callable[[], Awaitable[None]]):
+        """Стать лидером сейчас или ждать своей очереди в фоне"""
+        if self.try_acquire():
+            await on_elected()
+            return
+
+        async def campaign():
+            while not self.try_acquire():
+                await asyncio.sleep(self.retry_interval)
+            print(f"[LeaderElection] Process {os.getpid()} became the leader")
+            await on_elected()
+
+        self._task = asyncio.create_task(campaign(), name="leader-election")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._fd is not None:
+            # Закрытие дескриптора снимает блокировку
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
+
+
+class ChangeWatcher:
+    """Обнаружение записей других процессов в общую базу.
+
+    PRAGMA data_version на соединении-писателе меняется только после
+    коммитов других соединений, то есть других процессов. При изменении
+    сбрасывается кэш последних сообщений, а сообщения, изменённые другими
+    процессами, публикуются в EventHub этого процесса (SSE, long-poll).
+    Больше burst_limit изменений за одну проверку (reset_queue в другом
+    процессе) подписчики SSE получают одним событием resync, а не по
+    одному на строку: иначе их очереди переполняются.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        interval: float = 0.5,
+        seen_size: int = 4096,
+        page_size: int = 500,
+        burst_limit: int = 100
+    ):
+        self.database = database
+        self.interval = interval
+        self.seen_size = seen_size
+        self.page_size = page_size
+        self.burst_limit = burst_limit
+        self._version: Optional[int] = None
+        # Курсор (updated_at, id) последнего обработанного изменения
+        self._watermark: Optional[str] = None
+        self._watermark_id = 0
+        self._last_id = 0
+        # (id, updated_at) уже опубликованных событий
+        self._seen: "OrderedDict[tuple, None]" = OrderedDict()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.changes = 0
+        self.relayed = 0
+        self.resyncs = 0
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """Вызывать для каждого сообщения, изменённого другим процессом"""
+        self._listeners.append(listener)
+
+    def _remember(self, message: Dict[str, Any]) -> bool:
+        """Запомнить изменение; False, если оно уже было опубликовано"""
+        key = (message['id'], message['updated_at'])
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self.seen_size:
+            self._seen.popitem(last=False)
+        return True
+
+    def local_change(self, event_type: str, message: Dict[str, Any]):
+        """Учесть событие, опубликованное этим процессом"""
+        self._remember(message)
+
+    def local_touch(self, keys: List[tuple]):
+        """Учесть строки, которые этот процесс изменил без события (состояние очереди)"""
+        for message_id, updated_at in keys:
+            self._remember({'id': message_id, 'updated_at': updated_at})
+
+    async def _relay(self):
+        # Страницы по курсору (updated_at, id): тысячи строк с одним
+        # updated_at (reset_queue) читаются до конца, а не упираются в границу
+        bulk = False
+        while True:
+            messages = await self.database.get_messages_changed(
+                since_id=self._last_id,
+                updated_since=self._watermark,
+                after_id=self._watermark_id,
+                limit=self.page_size
+            )
+            if len(messages) > self.burst_limit:
+                bulk = True
+            for message in messages:
+                position = (message['updated_at'], message['id'])
+                if message['updated_at'] and (
+                    self._watermark is None or position > (self._watermark, self._watermark_id)
+                ):
+                    self._watermark, self._watermark_id = position
+                event_type = "created" if message['id'] > self._last_id else "updated"
+                self._last_id = max(self._last_id, message['id'])
+                if not self._remember(message):
+                    continue
+                self.relayed += 1
+                if bulk:
+                    # Наблюдатели (бот) получают каждое изменение, подписчики — resync
+                    self.database.hub.notify(event_type, message.as_dict())
+                else:
+                    self.database.hub.publish(event_type, message.as_dict())
+                for listener in self._listeners:
+                    listener(message)
+            # Каждая строка страницы продвигает курсор или _last_id,
+            # поэтому неполная страница означает, что изменений больше нет
+            if len(messages) < self.page_size:
+                break
+        if bulk:
+            self.resyncs += 1
+            self.database.hub.resync()
+
+    async def check(self):
+        """Проверить data_version и обработать чужие изменения"""
+        version = await self.database.data_version()
+        if version == self._version:
+            return
+        self._version = version
+        self.changes += 1
+        self.database.latest.invalidate()
+        await self._relay()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ChangeWatcher] Check failed: {e}")
+
+    async def start(self):
+        self._version = await self.database.data_version()
+        self._watermark, self._watermark_id, self._last_id = await self.database.get_change_watermark()
+        self.database.hub.add_observer(self.local_change)
+        self.database.add_touch_observer(self.local_touch)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="change-watcher")
+
+    async def stop(self):
+        self.database.hub.remove_observer(self.local_change)
+        self.database.remove_touch_observer(self.local_touch)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"changes": self.changes, "relayed": self.relayed, "resyncs": self.resyncs}
+
+
+# Процесс-лидер и отслеживание чужих записей (используются при API_WORKERS > 1)
+leader_election = LeaderElection(
+    settings.database_path + ".leader.lock",
+    retry_interval=settings.leader_retry_interval
+)
+change_watcher = ChangeWatcher(db, interval=settings.change_poll_interval)
@@ -1,151 +1,543 @@
 """Работа с базой данных"""
-import aiosqlite
+import asyncio
+import functools
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Awaitable, Callable
+
+import aiosqlite
+
 from config import settings
+from events import EventHub, event_hub
+from latest_cache import LatestApprovedCache
+from metrics import DB_CALL_SECONDS, DB_POOL_WAIT_SECONDS, DB_ROWS, DB_WRITE_BATCH_SIZE
+from migrations import migrate
+from rows import ALL_COLUMNS, LIST_COLUMNS, MessageColumns, MessageRow, message_row
+from serialization import dumps, json_array
+
+
+def _row_count(result: Any) -> int:
+    """Число строк в результате метода Database (для метрик)"""
+    if result is None:
+        return 0
+    if isinstance(result, bool):
+        return int(result)
+    if isinstance(result, int):
+        return result
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if isinstance(result, (dict, str)):
+        return 1
+    return 0
+
+
+def _timed(method=None, *, single_row: bool = False):
+    """Записать время выполнения и число строк метода Database.
+
+    Целый результат считается числом затронутых строк; для методов,
+    возвращающих id (single_row=True), учитывается одна строка.
+    """
+    if method is None:
+        return functools.partial(_timed, single_row=single_row)
+    name = method.__name__
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = await method(*args, **kwargs)
+        except BaseException:
+            DB_CALL_SECONDS.observe(time.perf_counter() - started, method=name, outcome="error")
+            raise
+        DB_CALL_SECONDS.observe(time.perf_counter() - started, method=name, outcome="ok")
+        DB_ROWS.inc(1 if single_row else _row_count(result), method=name)
+        return result
+
+    return wrapper
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite.
+
+    Держит ограниченный набор соединений только для чтения и отдельное
+    единственное соединение для записи. WAL позволяет читателям работать
+    параллельно с писателем, а запись сериализуется через блокировку.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 4,
+        busy_timeout_ms: int = 5000,
+        health_check_interval: float = 30.0,
+        synchronous: str = "NORMAL"
+    ):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.busy_timeout_ms = busy_timeout_ms
+        # Долговечность коммитов: FULL — fsync на каждый коммит,
+        # NORMAL — при WAL возможна потеря последних коммитов при сбое питания
+        if synchronous.upper() not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+            raise ValueError(f"Invalid synchronous mode: {synchronous}")
+        self.synchronous = synchronous.upper()
+        # Соединение, простаивавшее дольше этого интервала, проверяется перед выдачей
+        self.health_check_interval = health_check_interval
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._last_used: Dict[int, float] = {}
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._closed = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, readonly: bool) -> aiosqlite.Connection:
+        """Открыть соединение и применить настройки"""
+        conn = await aiosqlite.connect(self.db_path)
+        pragmas = [
+            f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}",
+            f"PRAGMA synchronous = {self.synchronous}",
+            "PRAGMA temp_store = MEMORY",
+            "PRAGMA cache_size = -8000",
+            "PRAGMA mmap_size = 67108864",
+        ]
+        if readonly:
+            pragmas.append("PRAGMA query_only = 1")
+        else:
+            # После контрольной точки WAL усекается до 64 МБ, а не остаётся
+            # максимального размера (важно, когда пишут несколько процессов)
+            pragmas.append("PRAGMA journal_size_limit = 67108864")
+        for pragma in pragmas:
+            # Курсор нужно закрыть, иначе незавершённый оператор держит блокировку
+            async with conn.execute(pragma) as cursor:
+                await cursor.fetchall()
+        return conn
+
+    async def open(self):
+        """Открыть пул (повторный вызов ничего не делает)"""
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            writer = await self._connect(readonly=False)
+            # WAL сохраняется в файле БД, достаточно включить один раз
+            async with writer.execute("PRAGMA journal_mode = WAL") as cursor:
+                await cursor.fetchall()
+            self._writer = writer
+
+            self._readers = asyncio.Queue(maxsize=self.size)
+            self._all_readers = []
+            for _ in range(self.size):
+                conn = await self._connect(readonly=True)
+                self._all_readers.append(conn)
+                self._last_used[id(conn)] = time.monotonic()
+                self._readers.put_nowait(conn)
+            self._closed = False
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        async with self._open_lock:
+            if self._writer is None:
+                return
+            self._closed = True
+            # Дожидаемся завершения текущей записи
+            async with self._write_lock:
+                try:
+                    await self._writer.close()
+                finally:
+                    self._writer = None
+            for conn in self._all_readers:
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+            self._all_readers = []
+            self._last_used.clear()
+            self._readers = None
+
+    async def _ensure_open(self):
+        if self._writer is None:
+            await self.open()
+
+    async def _checked(self, conn: aiosqlite.Connection, readonly: bool) -> aiosqlite.Connection:
+        """Проверить соединение после долгого простоя и при необходимости переоткрыть"""
+        if time.monotonic() - self._last_used.get(id(conn), 0) < self.health_check_interval:
+            return conn
+        try:
+            await conn.execute("SELECT 1")
+            return conn
+        except Exception as e:
+            print(f"[Database] Reconnecting broken connection: {e}")
+            try:
+                await conn.close()
+            except Exception:
+                pass
+            self._last_used.pop(id(conn), None)
+            if readonly:
+                self._all_readers.remove(conn)
+            new_conn = await self._connect(readonly=readonly)
+            if readonly:
+                self._all_readers.append(new_conn)
+            return new_conn
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Взять соединение для чтения из пула"""
+        await self._ensure_open()
+        started = time.perf_counter()
+        conn = await self._readers.get()
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started, mode="reader")
+        try:
+            if conn is None:
+                # Слот освободился после неудачного переподключения
+                conn = await self._connect(readonly=True)
+                self._all_readers.append(conn)
+            else:
+                conn = await self._checked(conn, readonly=True)
+        except BaseException:
+            # Сломанное соединение в пул не возвращается, следующий читатель откроет новое
+            if self._readers is not None and not self._closed:
+                self._readers.put_nowait(None)
+            raise
+        try:
+            yield conn
+        finally:
+            self._last_used[id(conn)] = time.monotonic()
+            if self._readers is not None and not self._closed:
+                self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Получить единственное соединение для записи.
+
+        Незакоммиченная при выходе транзакция откатывается.
+        """
+        await self._ensure_open()
+        started = time.perf_counter()
+        async with self._write_lock:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started, mode="writer")
+            self._writer = await self._checked(self._writer, readonly=False)
+            try:
+                yield self._writer
+            except BaseException:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                raise
+            else:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+            finally:
+                self._last_used[id(self._writer)] = time.monotonic()
+
+    async def health_check(self) -> Dict[str, Any]:
+        """Проверить доступность БД через писателя и одного читателя"""
+        try:
+            async with self.writer() as conn:
+                cursor = await conn.execute("PRAGMA journal_mode")
+                journal_mode = (await cursor.fetchone())[0]
+            async with self.reader() as conn:
+                await conn.execute("SELECT 1")
+            return {
+                "status": "ok",
+                "journal_mode": journal_mode,
+                "readers": self.size,
+                "idle_readers": self._readers.qsize() if self._readers else 0,
+            }
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+
+# Полный набор колонок сообщения в порядке, который ожидает message_row
+MESSAGE_COLUMNS = ALL_COLUMNS.sql
+
+# Текущее время с миллисекундами, для updated_at
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Горячие запросы; под каждый есть индекс (см. migrations.py и
+# scripts/check_query_plans.py)
+LATEST_APPROVED_SQL = "SELECT " + MESSAGE_COLUMNS + """
+    FROM messages
+    WHERE status = 'ok'
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?"""
+
+LAST_APPROVED_TEXTS_SQL = """
+    SELECT message_text
+    FROM messages
+    WHERE status = 'ok'
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?"""
+
+# Сообщения, готовые к выдаче на экран: не забраны и не арендованы
+# (или аренда истекла). Параметр — максимальное количество.
+CLAIMABLE_IDS_SQL = """
+    SELECT id
+    FROM messages
+    WHERE is_fetched = 0 AND status = 'ok'
+      AND (lease_expires_at IS NULL OR lease_expires_at < """ + NOW_SQL + """)
+    ORDER BY created_at ASC, id ASC
+    LIMIT ?"""
+
+PENDING_IDS_SQL = """
+    SELECT id
+    FROM messages
+    WHERE status = 'pending'
+    ORDER BY created_at ASC, id ASC"""
+
+# Счётчики для метрик; оба читают только частичные индексы
+QUEUE_DEPTH_SQL = """
+    SELECT COUNT(*)
+    FROM messages
+    WHERE is_fetched = 0 AND status = 'ok'"""
+
+PENDING_COUNT_SQL = """
+    SELECT COUNT(*)
+    FROM messages
+    WHERE status = 'pending'"""
+
+# Имя → (SQL, параметры для проверки плана)
+HOT_QUERIES = {
+    "latest_approved": (LATEST_APPROVED_SQL, (5,)),
+    "last_approved_texts": (LAST_APPROVED_TEXTS_SQL, (3,)),
+    "claimable_ids": (CLAIMABLE_IDS_SQL, (10,)),
+    "pending_ids": (PENDING_IDS_SQL, ()),
+    "queue_depth": (QUEUE_DEPTH_SQL, ()),
+    "pending_count": (PENDING_COUNT_SQL, ()),
+}
+
+
+def _usage_params(usage: Optional[Dict[str, Any]]) -> tuple:
+    """Колонки model, prompt_tokens, completion_tokens, cost сообщения"""
+    if not usage:
+        return (None, None, None, None)
+    return (usage['model'], usage['prompt_tokens'], usage['completion_tokens'], usage['cost'])
+
+
+class WriteBatcher:
+    """Групповая запись новых сообщений.
+
+    Вставки копятся в очереди и записываются одной транзакцией, когда
+    набирается max_batch строк или проходит max_delay_ms с первой из них.
+    Каждый вызывающий получает результат своей строки. Один коммит на
+    пачку вместо коммита (и fsync) на каждое сообщение.
+
+    При max_delay_ms = 0 одиночная вставка пишется сразу, а всё, что
+    пришло за время текущего коммита, уходит следующей пачкой.
+    """
+
+    INSERT_SQL = """
+        INSERT INTO messages 
+        (name, age, gender, mood, message_text, openai_response, status,
+         model, prompt_tokens, completion_tokens, cost, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, """ + NOW_SQL + """)
+        RETURNING id, created_at, updated_at
+    """
+
+    def __init__(self, pool: ConnectionPool, max_batch: int = 64, max_delay_ms: float = 0.0):
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0.0, max_delay_ms) / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Метрики
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_seen = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    async def insert(self, params: tuple) -> tuple:
+        """Поставить строку в очередь и дождаться (id, created_at, updated_at)"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run(), name="db-write-batcher")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((params, future))
+        return await future
+
+    async def close(self):
+        """Дописать накопленное и остановить фоновую задачу"""
+        if self._task is None:
+            return
+        if not self._task.done():
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
+        self._queue = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        item = self._queue.get_nowait()
+                    else:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        started = time.perf_counter()
+        try:
+            async with self.pool.writer() as db:
+                results = []
+                for params, _ in batch:
+                    cursor = await db.execute(self.INSERT_SQL, params)
+                    results.append(await cursor.fetchone())
+                    await cursor.close()
+                await db.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # Одна ошибочная строка не должна ронять всю пачку: пишем по одной
+            for item in batch:
+                await self._flush([item])
+            return
+
+        elapsed = time.perf_counter() - started
+        self.batches += 1
+        self.rows += len(batch)
+        DB_WRITE_BATCH_SIZE.observe(len(batch))
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        self.flush_seconds_total += elapsed
+        self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(tuple(result))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_delay_ms": self.max_delay * 1000,
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_size": self.rows / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "avg_flush_ms": self.flush_seconds_total / self.batches * 1000 if self.batches else 0.0,
+            "max_flush_ms": self.flush_seconds_max * 1000,
+        }
 
 
 class Database:
     """Класс для работы с базой данных"""
     
-    def __init__(self, db_path: str):
+    def __init__(
+        self,
+        db_path: str,
+        pool_size: int = 4,
+        busy_timeout_ms: int = 5000,
+        hub: EventHub = event_hub,
+        latest_cache_size: int = 20,
+        synchronous: str = "NORMAL",
+        write_batch_size: int = 64,
+        write_batch_delay_ms: float = 0.0
+    ):
         self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path,
+            size=pool_size,
+            busy_timeout_ms=busy_timeout_ms,
+            synchronous=synchronous
+        )
+        self.writes = WriteBatcher(
+            self.pool,
+            max_batch=write_batch_size,
+            max_delay_ms=write_batch_delay_ms
+        )
+        # Сюда публикуются добавления и изменения статусов сообщений
+        self.hub = hub
+        # Последние одобренные сообщения в памяти
+        self.latest = LatestApprovedCache(latest_cache_size)
+        # Получают (id, updated_at) строк, изменённых без события (состояние очереди)
+        self._touch_observers: List[Callable[[List[tuple]], None]] = []
+    
+    def _message_changed(self, event_type: str, message: Dict[str, Any]):
+        """Обновить кэш и разослать событие после записи"""
+        self.latest.upsert(message)
+        self.hub.publish(event_type, message)
+    
+    def add_touch_observer(self, observer: Callable[[List[tuple]], None]):
+        """Сообщать observer о строках, у которых этот процесс сдвинул updated_at без события"""
+        self._touch_observers.append(observer)
+    
+    def remove_touch_observer(self, observer: Callable[[List[tuple]], None]):
+        if observer in self._touch_observers:
+            self._touch_observers.remove(observer)
+    
+    def _rows_touched(self, keys: List[tuple]):
+        for observer in self._touch_observers:
+            observer(keys)
+    
+    async def warm_latest_cache(self):
+        """Заполнить кэш последних одобренных сообщений из базы"""
+        messages = await self._query_latest_messages(self.latest.capacity)
+        self.latest.load(messages)
+    
+    @staticmethod
+    async def _fetch_messages(db: aiosqlite.Connection, sql: str, params: tuple = ()) -> List[MessageRow]:
+        """Выполнить запрос с колонками MessageColumns.sql.
+
+        Строки собирает message_row в потоке соединения, event loop
+        получает готовые MessageRow.
+        """
+        cursor = await db.execute(sql, params)
+        cursor.row_factory = message_row
+        rows = await cursor.fetchall()
+        await cursor.close()
+        return rows
+    
+    async def close(self):
+        """Закрыть соединения с базой данных"""
+        await self.writes.close()
+        if self.pool.is_open:
+            # Обновить статистику планировщика, если она устарела
+            try:
+                async with self.pool.writer() as db:
+                    await db.execute("PRAGMA optimize")
+            except Exception as e:
+                print(f"[Database] PRAGMA optimize failed: {e}")
+        await self.pool.close()
+    
+    async def health_check(self) -> Dict[str, Any]:
+        """Проверка состояния соединений с базой данных"""
+        health = await self.pool.health_check()
+        health["write_batcher"] = self.writes.stats()
+        return health
     
     async def init_db(self):
-        """Инициализация базы данных"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем существование таблицы и её структуру
-            cursor = await db.execute("""
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='messages'
-            """)
-            table_exists = await cursor.fetchone()
-            
-            if table_exists:
-                # Таблица существует - проверяем структуру и мигрируем
-                cursor = await db.execute("PRAGMA table_info(messages)")
-                columns = await cursor.fetchall()
-                column_names = [col[1] for col in columns]
-                
-                # Если есть старые колонки, создаем новую таблицу и мигрируем данные
-                if 'user_id' in column_names and 'name' not in column_names:
-                    # Создаем временную таблицу с новой структурой
-                    await db.execute("""
-                        CREATE TABLE IF NOT EXISTS messages_new (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            name TEXT NOT NULL,
-                            age INTEGER,
-                            gender TEXT,
-                            mood TEXT,
-                            message_text TEXT NOT NULL,
-                            openai_response TEXT,
-                            status TEXT NOT NULL,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            is_fetched BOOLEAN DEFAULT 0,
-                            fetched_at TIMESTAMP
-                        )
-                    """)
-                    
-                    # Мигрируем данные (используем username как name, если есть)
-                    await db.execute("""
-                        INSERT INTO messages_new 
-                        (id, name, age, gender, mood, message_text, openai_response, status, created_at, is_fetched, fetched_at)
-                        SELECT 
-                            id,
-                            COALESCE(username, 'Пользователь ' || user_id) as name,
-                            NULL as age,
-                            NULL as gender,
-                            NULL as mood,
-                            message_text,
-                            openai_response,
-                            status,
-                            created_at,
-                            is_fetched,
-                            fetched_at
-                        FROM messages
-                    """)
-                    
-                    # Удаляем старую таблицу и переименовываем новую
-                    await db.execute("DROP TABLE messages")
-                    await db.execute("ALTER TABLE messages_new RENAME TO messages")
-                elif 'name' not in column_names:
-                    # Добавляем новые колонки если их нет
-                    await db.execute("ALTER TABLE messages ADD COLUMN name TEXT")
-                    await db.execute("ALTER TABLE messages ADD COLUMN age INTEGER")
-                    await db.execute("ALTER TABLE messages ADD COLUMN gender TEXT")
-                    await db.execute("ALTER TABLE messages ADD COLUMN mood TEXT")
-                    
-                    # Заполняем name для существующих записей
-                    await db.execute("""
-                        UPDATE messages 
-                        SET name = COALESCE(username, 'Пользователь ' || user_id)
-                        WHERE name IS NULL
-                    """)
-                    
-                    # Удаляем старые колонки если они есть
-                    if 'user_id' in column_names:
-                        # SQLite не поддерживает DROP COLUMN напрямую, нужно пересоздать таблицу
-                        await db.execute("""
-                            CREATE TABLE IF NOT EXISTS messages_temp (
-                                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                name TEXT NOT NULL,
-                                age INTEGER,
-                                gender TEXT,
-                                mood TEXT,
-                                message_text TEXT NOT NULL,
-                                openai_response TEXT,
-                                status TEXT NOT NULL,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                is_fetched BOOLEAN DEFAULT 0,
-                                fetched_at TIMESTAMP
-                            )
-                        """)
-                        await db.execute("""
-                            INSERT INTO messages_temp 
-                            (id, name, age, gender, mood, message_text, openai_response, status, created_at, is_fetched, fetched_at)
-                            SELECT 
-                                id,
-                                COALESCE(name, username, 'Пользователь ' || COALESCE(user_id, 0)) as name,
-                                NULL as age,
-                                gender,
-                                mood,
-                                message_text,
-                                openai_response,
-                                status,
-                                created_at,
-                                is_fetched,
-                                fetched_at
-                            FROM messages
-                        """)
-                        await db.execute("DROP TABLE messages")
-                        await db.execute("ALTER TABLE messages_temp RENAME TO messages")
-                else:
-                    if 'age' not in column_names:
-                        await db.execute("ALTER TABLE messages ADD COLUMN age INTEGER")
-            else:
-                # Таблица не существует - создаем новую
-                await db.execute("""
-                    CREATE TABLE messages (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        age INTEGER,
-                        gender TEXT,
-                        mood TEXT,
-                        message_text TEXT NOT NULL,
-                        openai_response TEXT,
-                        status TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        is_fetched BOOLEAN DEFAULT 0,
-                        fetched_at TIMESTAMP
-                    )
-                """)
-            
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_is_fetched 
-                ON messages(is_fetched, created_at)
-            """)
+        """Инициализация базы данных: применение миграций и прогрев кэша"""
+        await self.pool.open()
+        async with self.pool.writer() as db:
+            await migrate(db)
+            await db.execute(
+                "DELETE FROM moderation_cache WHERE expires_at <= ?", (time.time(),)
+            )
+            await db.execute(
+                "DELETE FROM idempotency_keys WHERE expires_at <= ?", (time.time(),)
+            )
             await db.commit()
+        
+        await self.warm_latest_cache()
     
+    @_timed(single_row=True)
     async def add_message(
         self,
         name: str,
@@ -153,180 +545,775 @@ class Database:
         gender: Optional[str],
         mood: Optional[str],
         message_text: str,
-        openai_response: str,
-        status: str
+        openai_response: Optional[str],
+        status: str,
+        usage: Optional[Dict[str, Any]] = None
     ) -> int:
-        """Добавить сообщение в базу данных"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """Добавить сообщение в базу данных (через групповую запись).
+
+        usage — токены и стоимость проверки (TokenBudget.usage).
+        """
+        message_id, created_at, updated_at = await self.writes.insert(
+            (name, age, gender, mood, message_text, openai_response, status) + _usage_params(usage)
+        )
+        
+        self._message_changed("created", {
+            'id': message_id,
+            'name': name,
+            'age': age,
+            'gender': gender,
+            'mood': mood,
+            'message_text': message_text,
+            'openai_response': openai_response,
+            'status': status,
+            'created_at': created_at,
+            'is_fetched': False,
+            'fetched_at': None,
+            'updated_at': updated_at
+        })
+        return message_id
+    
+    @_timed
+    async def get_next_unfetched_message(self) -> Optional[MessageRow]:
+        """Получить следующее незабранное сообщение и сразу пометить его забранным.
+
+        Выбор и пометка выполняются одним UPDATE ... RETURNING. Для
+        нескольких экранов удобнее claim_messages с подтверждением.
+        """
+        fetched_at = datetime.now().isoformat()
+        async with self.pool.writer() as db:
+            rows = await self._fetch_messages(db, """
+                UPDATE messages
+                SET is_fetched = 1, fetched_at = ?, lease_owner = NULL, lease_expires_at = NULL,
+                    updated_at = """ + NOW_SQL + """
+                WHERE id IN (""" + CLAIMABLE_IDS_SQL + """)
+                RETURNING """ + MESSAGE_COLUMNS, (fetched_at, 1))
+            await db.commit()
+        
+        if not rows:
+            return None
+        self.latest.update_fields(rows[0].id, is_fetched=True, fetched_at=fetched_at)
+        self._rows_touched([(rows[0].id, rows[0].updated_at)])
+        return rows[0]
+    
+    @_timed
+    async def claim_messages(
+        self,
+        consumer: str,
+        limit: int = 10,
+        visibility_timeout: float = 30.0
+    ) -> List[Dict[str, Any]]:
+        """Атомарно арендовать до limit сообщений для потребителя.
+
+        Арендованные сообщения не выдаются другим, пока аренда не истечёт.
+        Подтверждённые (ack_messages) помечаются забранными, отпущенные
+        (nack_messages) или просроченные выдаются повторно.
+        """
+        async with self.pool.writer() as db:
             cursor = await db.execute("""
-                INSERT INTO messages 
-                (name, age, gender, mood, message_text, openai_response, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (name, age, gender, mood, message_text, openai_response, status))
+                UPDATE messages
+                SET lease_owner = ?,
+                    lease_expires_at = strftime('%Y-%m-%d %H:%M:%f', 'now', ?),
+                    delivery_count = delivery_count + 1
+                WHERE id IN (""" + CLAIMABLE_IDS_SQL + """)
+                RETURNING """ + MESSAGE_COLUMNS + """, lease_expires_at, delivery_count
+            """, (consumer, f"+{float(visibility_timeout)} seconds", limit))
+            rows = await cursor.fetchall()
             await db.commit()
-            return cursor.lastrowid
+        
+        messages = []
+        for row in rows:
+            message = message_row(None, row).as_dict()
+            message['lease_expires_at'] = row[-2]
+            message['delivery_count'] = row[-1]
+            messages.append(message)
+        # RETURNING не гарантирует порядок
+        messages.sort(key=lambda m: (m['created_at'] or '', m['id']))
+        return messages
     
-    async def get_next_unfetched_message(self) -> Optional[Dict[str, Any]]:
-        """Получить следующее незабранное сообщение (с блокировкой)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Используем BEGIN IMMEDIATE для блокировки записи
-            await db.execute("BEGIN IMMEDIATE")
-            try:
-                # Выбираем сообщение
-                cursor = await db.execute("""
-                    SELECT id, name, age, gender, mood, message_text, openai_response, 
-                           status, created_at
-                    FROM messages
-                    WHERE is_fetched = 0 AND status = 'ok'
-                    ORDER BY created_at ASC
-                    LIMIT 1
-                """)
-                row = await cursor.fetchone()
-                
-                if not row:
-                    await db.rollback()
-                    return None
-                
-                message = {
-                    'id': row[0],
-                    'name': row[1],
-                    'age': row[2],
-                    'gender': row[3],
-                    'mood': row[4],
-                    'message_text': row[5],
-                    'openai_response': row[6],
-                    'status': row[7],
-                    'created_at': row[8]
-                }
-                
-                # Помечаем как забранное в той же транзакции
-                await db.execute("""
-                    UPDATE messages
-                    SET is_fetched = 1, fetched_at = ?
-                    WHERE id = ?
-                """, (datetime.now().isoformat(), message['id']))
-                
-                await db.commit()
-                return message
-            except Exception as e:
-                await db.rollback()
-                raise
+    @_timed
+    async def ack_messages(self, consumer: str, message_ids: List[int]) -> int:
+        """Подтвердить получение: сообщения помечаются забранными"""
+        if not message_ids:
+            return 0
+        fetched_at = datetime.now().isoformat()
+        placeholders = ", ".join("?" for _ in message_ids)
+        async with self.pool.writer() as db:
+            cursor = await db.execute("""
+                UPDATE messages
+                SET is_fetched = 1, fetched_at = ?, lease_owner = NULL, lease_expires_at = NULL,
+                    updated_at = """ + NOW_SQL + """
+                WHERE lease_owner = ? AND is_fetched = 0 AND id IN (""" + placeholders + """)
+                RETURNING id, updated_at
+            """, (fetched_at, consumer, *message_ids))
+            touched = [tuple(row) for row in await cursor.fetchall()]
+            await db.commit()
+        
+        acked = [message_id for message_id, _ in touched]
+        for message_id in acked:
+            self.latest.update_fields(message_id, is_fetched=True, fetched_at=fetched_at)
+        self._rows_touched(touched)
+        return len(acked)
+    
+    @_timed
+    async def nack_messages(self, consumer: str, message_ids: Optional[List[int]] = None) -> int:
+        """Отпустить аренду, чтобы сообщения были выданы снова.
+
+        Без message_ids отпускаются все аренды потребителя.
+        """
+        params: List[Any] = [consumer]
+        condition = ""
+        if message_ids is not None:
+            if not message_ids:
+                return 0
+            condition = " AND id IN (" + ", ".join("?" for _ in message_ids) + ")"
+            params.extend(message_ids)
+        async with self.pool.writer() as db:
+            cursor = await db.execute("""
+                UPDATE messages
+                SET lease_owner = NULL, lease_expires_at = NULL
+                WHERE lease_owner = ? AND is_fetched = 0""" + condition, params)
+            await db.commit()
+            return cursor.rowcount
     
+    @_timed
     async def get_latest_messages(self, limit: int = 5) -> list[Dict[str, Any]]:
         """Получить последние N сообщений со статусом 'ok' (без пометки как забранные)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
-                SELECT id, name, age, gender, mood, message_text, openai_response, 
-                       status, created_at, is_fetched, fetched_at
-                FROM messages
-                WHERE status = 'ok'
-                ORDER BY created_at DESC
-                LIMIT ?
-            """, (limit,))
-            rows = await cursor.fetchall()
-            
-            messages = []
-            for row in rows:
-                messages.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'age': row[2],
-                    'gender': row[3],
-                    'mood': row[4],
-                    'message_text': row[5],
-                    'openai_response': row[6],
-                    'status': row[7],
-                    'created_at': row[8],
-                    'is_fetched': bool(row[9]),
-                    'fetched_at': row[10]
-                })
-            
-            return messages
+        if self.latest.can_serve(limit):
+            return self.latest.latest(limit)
+        return await self._refill_latest(limit)
+    
+    @_timed
+    async def get_latest_messages_json(self, limit: int = 5) -> bytes:
+        """То же, что get_latest_messages, но сразу в виде JSON"""
+        if self.latest.can_serve(limit):
+            return self.latest.latest_json(limit)
+        return dumps(await self._refill_latest(limit))
+    
+    async def _refill_latest(self, limit: int) -> List[Dict[str, Any]]:
+        """Прочитать последние одобренные сообщения из базы и по возможности заполнить кэш"""
+        if limit > self.latest.capacity:
+            return await self._query_latest_messages(limit)
+        generation = self.latest.generation
+        messages = await self._query_latest_messages(self.latest.capacity)
+        self.latest.load(messages, generation=generation)
+        return messages[:limit]
+    
+    async def _query_latest_messages(self, limit: int) -> List[Dict[str, Any]]:
+        # Словари: кэш последних сообщений обновляет их на месте
+        async with self.pool.reader() as db:
+            rows = await self._fetch_messages(db, LATEST_APPROVED_SQL, (limit,))
+        return [row.as_dict() for row in rows]
     
+    @_timed
     async def reset_queue(self) -> int:
-        """Сбросить очередь - пометить все сообщения как незабранные"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """Сбросить очередь - пометить все сообщения как незабранные.
+
+        Переписывает все забранные строки; для повторной выдачи отдельным
+        потребителям используйте nack_messages или истечение аренды.
+        """
+        async with self.pool.writer() as db:
             cursor = await db.execute("""
                 UPDATE messages
-                SET is_fetched = 0, fetched_at = NULL
+                SET is_fetched = 0, fetched_at = NULL, updated_at = """ + NOW_SQL + """
                 WHERE is_fetched = 1
+                RETURNING id, updated_at
             """)
+            touched = [tuple(row) for row in await cursor.fetchall()]
             await db.commit()
-            return cursor.rowcount
+        
+        self.latest.update_fields(is_fetched=False, fetched_at=None)
+        self._rows_touched(touched)
+        return len(touched)
     
+    @_timed
     async def get_last_approved_message(self) -> Optional[str]:
         """Получить текст последнего одобренного сообщения"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
-                SELECT message_text
-                FROM messages
-                WHERE status = 'ok'
-                ORDER BY created_at DESC
-                LIMIT 1
-            """)
+        if self.latest.can_serve(1):
+            texts = self.latest.texts(1)
+            return texts[0] if texts else None
+        async with self.pool.reader() as db:
+            cursor = await db.execute(LAST_APPROVED_TEXTS_SQL, (1,))
             row = await cursor.fetchone()
             if row:
                 return row[0]
             return None
     
+    @_timed
     async def get_last_approved_messages(self, limit: int = 3) -> List[str]:
         """Получить тексты последних N одобренных сообщений"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
-                SELECT message_text
-                FROM messages
-                WHERE status = 'ok'
-                ORDER BY created_at DESC
-                LIMIT ?
-            """, (limit,))
+        if self.latest.can_serve(limit):
+            return self.latest.texts(limit)
+        if limit <= self.latest.capacity:
+            messages = await self._refill_latest(limit)
+            return [m['message_text'] for m in messages if m['message_text']]
+        async with self.pool.reader() as db:
+            cursor = await db.execute(LAST_APPROVED_TEXTS_SQL, (limit,))
             rows = await cursor.fetchall()
             return [row[0] for row in rows if row and row[0]]
     
     
-    async def get_all_messages(self) -> list[Dict[str, Any]]:
-        """Получить все сообщения"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
-                SELECT id, name, age, gender, mood, message_text, openai_response, 
-                       status, created_at, is_fetched, fetched_at
+    @_timed
+    async def get_all_messages(self, columns: MessageColumns = LIST_COLUMNS) -> List[MessageRow]:
+        """Получить все сообщения (по умолчанию без openai_response)"""
+        async with self.pool.reader() as db:
+            return await self._fetch_messages(db, "SELECT " + columns.sql + """
                 FROM messages
                 ORDER BY created_at DESC
             """)
+    
+    @_timed
+    async def get_messages_page(
+        self,
+        before_id: Optional[int] = None,
+        limit: int = 100,
+        columns: MessageColumns = ALL_COLUMNS
+    ) -> List[MessageRow]:
+        """Страница сообщений, новые первыми (keyset-пагинация по id)"""
+        return await self._select_page(columns.sql, before_id, limit, message_row)
+    
+    @_timed
+    async def get_messages_page_json(
+        self,
+        before_id: Optional[int] = None,
+        limit: int = 100,
+        columns: MessageColumns = ALL_COLUMNS
+    ) -> bytes:
+        """То же, что get_messages_page, но сразу JSON-массивом.
+
+        Объекты собирает SQLite (json_object) в потоке соединения, event
+        loop только склеивает готовые строки.
+        """
+        rows = await self._select_page(columns.json_sql, before_id, limit)
+        return json_array([row[0] for row in rows])
+    
+    async def _select_page(
+        self,
+        columns_sql: str,
+        before_id: Optional[int],
+        limit: int,
+        row_factory: Optional[Callable] = None
+    ) -> list:
+        async with self.pool.reader() as db:
+            if before_id is None:
+                cursor = await db.execute(
+                    "SELECT " + columns_sql + """
+                    FROM messages
+                    ORDER BY id DESC
+                    LIMIT ?
+                """, (limit,))
+            else:
+                cursor = await db.execute(
+                    "SELECT " + columns_sql + """
+                    FROM messages
+                    WHERE id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                """, (before_id, limit))
+            cursor.row_factory = row_factory
+            rows = await cursor.fetchall()
+            await cursor.close()
+            return rows
+    
+    @_timed
+    async def get_messages_changed(
+        self,
+        since_id: Optional[int] = None,
+        updated_since: Optional[str] = None,
+        limit: int = 100,
+        columns: MessageColumns = ALL_COLUMNS,
+        after_id: Optional[int] = None
+    ) -> List[MessageRow]:
+        """Сообщения, добавленные после since_id или изменённые начиная с updated_since.
+
+        Порядок — по времени изменения, поэтому клиент продолжает с
+        наибольшего полученного updated_at. Границы включительные: повторы
+        нужно отбрасывать по id. after_id превращает границу в курсор
+        (updated_at, id): из строк с updated_at, равным updated_since,
+        выдаются только строки с id больше after_id.
+        """
+        if since_id is None and updated_since is None:
+            return await self.get_messages_page(limit=limit, columns=columns)
+        return await self._select_changed(columns.sql, since_id, updated_since, limit, message_row, after_id)
+    
+    @_timed
+    async def get_messages_changed_json(
+        self,
+        since_id: Optional[int] = None,
+        updated_since: Optional[str] = None,
+        limit: int = 100,
+        columns: MessageColumns = ALL_COLUMNS,
+        after_id: Optional[int] = None
+    ) -> bytes:
+        """То же, что get_messages_changed, но сразу JSON-массивом"""
+        if since_id is None and updated_since is None:
+            return await self.get_messages_page_json(limit=limit, columns=columns)
+        # updated_at и id нужны в выборке для ORDER BY составного запроса
+        rows = await self._select_changed(
+            columns.json_sql + ", updated_at, id", since_id, updated_since, limit, after_id=after_id
+        )
+        return json_array([row[0] for row in rows])
+    
+    async def _select_changed(
+        self,
+        columns_sql: str,
+        since_id: Optional[int],
+        updated_since: Optional[str],
+        limit: int,
+        row_factory: Optional[Callable] = None,
+        after_id: Optional[int] = None
+    ) -> list:
+        # Каждое условие — отдельный SELECT, чтобы оба использовали индекс
+        # (с OR планировщик сканирует всю таблицу)
+        selects = []
+        params: List[Any] = []
+        if since_id is not None:
+            selects.append("SELECT " + columns_sql + " FROM messages WHERE id > ?")
+            params.append(since_id)
+        if updated_since is not None and after_id is not None:
+            # Диапазон по индексу updated_at, остаток курсора — фильтром
+            selects.append(
+                "SELECT " + columns_sql + " FROM messages"
+                " WHERE updated_at >= ? AND (updated_at > ? OR id > ?)"
+            )
+            params.extend((updated_since, updated_since, after_id))
+        elif updated_since is not None:
+            selects.append("SELECT " + columns_sql + " FROM messages WHERE updated_at >= ?")
+            params.append(updated_since)
+        
+        async with self.pool.reader() as db:
+            cursor = await db.execute(
+                " UNION ".join(selects) + """
+                ORDER BY updated_at ASC, id ASC
+                LIMIT ?
+            """, (*params, limit))
+            cursor.row_factory = row_factory
             rows = await cursor.fetchall()
-            
-            messages = []
-            for row in rows:
-                messages.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'age': row[2],
-                    'gender': row[3],
-                    'mood': row[4],
-                    'message_text': row[5],
-                    'openai_response': row[6],
-                    'status': row[7],
-                    'created_at': row[8],
-                    'is_fetched': bool(row[9]),
-                    'fetched_at': row[10]
-                })
-            
-            return messages
+            await cursor.close()
+            return rows
     
+    @_timed
     async def update_message_status(self, message_id: int, status: str) -> bool:
         """Обновить статус сообщения"""
         if status not in ['ok', 'restricted']:
             raise ValueError(f"Invalid status: {status}")
         
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
+        async with self.pool.writer() as db:
+            rows = await self._fetch_messages(db, """
                 UPDATE messages
-                SET status = ?
+                SET status = ?, updated_at = """ + NOW_SQL + """,
+                    -- Аренда модерации не мешает выдаче на экран
+                    lease_owner = CASE WHEN status = 'pending' THEN NULL ELSE lease_owner END,
+                    lease_expires_at = CASE WHEN status = 'pending' THEN NULL ELSE lease_expires_at END
                 WHERE id = ?
-            """, (status, message_id))
+                RETURNING """ + MESSAGE_COLUMNS, (status, message_id))
+            await db.commit()
+        
+        if not rows:
+            return False
+        self._message_changed("updated", rows[0].as_dict())
+        return True
+    
+    @_timed
+    async def get_message(self, message_id: int) -> Optional[MessageRow]:
+        """Получить сообщение по id"""
+        async with self.pool.reader() as db:
+            rows = await self._fetch_messages(db, "SELECT " + MESSAGE_COLUMNS + """
+                FROM messages
+                WHERE id = ?
+            """, (message_id,))
+        return rows[0] if rows else None
+    
+    @_timed
+    async def get_pending_message_ids(self) -> List[int]:
+        """Получить id сообщений, ожидающих модерации (старые первыми)"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute(PENDING_IDS_SQL)
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+    
+    @_timed
+    async def get_queue_counts(self) -> Dict[str, int]:
+        """Размер очереди на экран и число сообщений на модерации"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute(QUEUE_DEPTH_SQL)
+            queue_depth = (await cursor.fetchone())[0]
+            cursor = await db.execute(PENDING_COUNT_SQL)
+            pending = (await cursor.fetchone())[0]
+        return {"queue_depth": queue_depth, "pending": pending}
+    
+    @_timed
+    async def claim_moderation(self, message_id: int, owner: str, lease_timeout: float = 120.0) -> bool:
+        """Взять сообщение в статусе 'pending' на модерацию.
+
+        Пока аренда owner не истекла, другие процессы сообщение не
+        модерируют, поэтому одно сообщение не проверяется дважды.
+        """
+        async with self.pool.writer() as db:
+            cursor = await db.execute("""
+                UPDATE messages
+                SET lease_owner = ?,
+                    lease_expires_at = strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+                WHERE id = ? AND status = 'pending'
+                  AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires_at < """ + NOW_SQL + """)
+            """, (owner, f"+{float(lease_timeout)} seconds", message_id, owner))
             await db.commit()
             return cursor.rowcount > 0
+    
+    @_timed
+    async def complete_moderation(
+        self,
+        message_id: int,
+        message_text: str,
+        openai_response: str,
+        status: str,
+        usage: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Записать результат фоновой модерации.
+
+        Обновляется только сообщение в статусе 'pending', поэтому ручное
+        изменение статуса, сделанное раньше, не перезаписывается.
+        """
+        async with self.pool.writer() as db:
+            rows = await self._fetch_messages(db, """
+                UPDATE messages
+                SET message_text = ?, openai_response = ?, status = ?,
+                    model = ?, prompt_tokens = ?, completion_tokens = ?, cost = ?,
+                    lease_owner = NULL, lease_expires_at = NULL,
+                    updated_at = """ + NOW_SQL + """
+                WHERE id = ? AND status = 'pending'
+                RETURNING """ + MESSAGE_COLUMNS,
+                (message_text, openai_response, status) + _usage_params(usage) + (message_id,))
+            await db.commit()
+        
+        if not rows:
+            return False
+        self._message_changed("updated", rows[0].as_dict())
+        return True
+    
+    @_timed
+    async def get_messages_after(self, last_id: int, limit: int = 500) -> List[MessageRow]:
+        """Получить сообщения с id больше last_id (старые первыми)"""
+        async with self.pool.reader() as db:
+            return await self._fetch_messages(db, "SELECT " + MESSAGE_COLUMNS + """
+                FROM messages
+                WHERE id > ?
+                ORDER BY id ASC
+                LIMIT ?
+            """, (last_id, limit))
+    
+    async def iter_messages(
+        self,
+        status: Optional[str] = None,
+        since_id: Optional[int] = None,
+        chunk_size: int = 500
+    ) -> AsyncIterator[List[MessageRow]]:
+        """Все сообщения (старые первыми) порциями по chunk_size.
+
+        Каждая порция читается отдельным запросом от последнего id, поэтому
+        долгая выгрузка не держит соединение пула и снимок базы, а память
+        не зависит от размера таблицы.
+        """
+        last_id = since_id or 0
+        while True:
+            chunk = await self._export_chunk(last_id, status, chunk_size)
+            if chunk:
+                yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last_id = chunk[-1].id
+    
+    @_timed
+    async def _export_chunk(self, last_id: int, status: Optional[str], limit: int) -> List[MessageRow]:
+        async with self.pool.reader() as db:
+            if status is None:
+                return await self._fetch_messages(db, "SELECT " + MESSAGE_COLUMNS + """
+                    FROM messages
+                    WHERE id > ?
+                    ORDER BY id ASC
+                    LIMIT ?
+                """, (last_id, limit))
+            return await self._fetch_messages(db, "SELECT " + MESSAGE_COLUMNS + """
+                FROM messages
+                WHERE id > ? AND status = ?
+                ORDER BY id ASC
+                LIMIT ?
+            """, (last_id, status, limit))
+    
+    @_timed
+    async def archive_old_messages(
+        self,
+        older_than_days: float,
+        sink: Callable[[List[MessageRow]], Awaitable[None]],
+        limit: int = 500
+    ) -> int:
+        """Перенести до limit старых завершённых сообщений из таблицы в архив.
+
+        Переносятся сообщения старше older_than_days, кроме ожидающих
+        модерации и одобренных, но ещё не показанных. Строки удаляются и
+        передаются в sink в одной транзакции: если запись архива не
+        удалась, удаление откатывается. Возвращает число перенесённых строк.
+        """
+        async with self.pool.writer() as db:
+            rows = await self._fetch_messages(db, """
+                DELETE FROM messages
+                WHERE id IN (
+                    SELECT id
+                    FROM messages
+                    WHERE created_at < datetime('now', ?)
+                      AND status != 'pending'
+                      AND (status != 'ok' OR is_fetched = 1)
+                    ORDER BY id ASC
+                    LIMIT ?
+                )
+                RETURNING """ + MESSAGE_COLUMNS, (f"-{older_than_days} days", limit))
+            if not rows:
+                return 0
+            messages = sorted(rows)
+            await sink(messages)
+            await db.commit()
+        
+        if any(m.status == 'ok' for m in messages):
+            # Одобренные могли лежать в кэше последних сообщений
+            self.latest.invalidate()
+        return len(messages)
+    
+    @_timed
+    async def backup(self, target_path: str):
+        """Согласованная копия базы через SQLite backup API.
+
+        Копия снимается с соединения для чтения, поэтому запись не
+        блокируется; в отличие от копирования файла учитывается WAL.
+        """
+        async with aiosqlite.connect(target_path) as target:
+            async with self.pool.reader() as db:
+                await db.backup(target)
+    
+    async def data_version(self) -> int:
+        """PRAGMA data_version писателя: меняется только после коммитов других процессов"""
+        async with self.pool.writer() as db:
+            cursor = await db.execute("PRAGMA data_version")
+            row = await cursor.fetchone()
+            await cursor.close()
+        return row[0]
+    
+    @_timed
+    async def get_change_watermark(self) -> tuple:
+        """(updated_at, id) последнего изменения и наибольший id — с них
+        начинается отслеживание изменений"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute("""
+                SELECT updated_at, id, (SELECT MAX(id) FROM messages)
+                FROM messages
+                ORDER BY updated_at DESC, id DESC
+                LIMIT 1
+            """)
+            row = await cursor.fetchone()
+        if row is None:
+            return None, 0, 0
+        return row[0], row[1], row[2]
+    
+    @_timed
+    async def get_cached_verdict(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Получить непросроченный вердикт модерации из кэша"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute("""
+                SELECT status, response, expires_at
+                FROM moderation_cache
+                WHERE cache_key = ? AND expires_at > ?
+            """, (cache_key, time.time()))
+            row = await cursor.fetchone()
+            if row:
+                return {'status': row[0], 'response': row[1], 'expires_at': row[2]}
+            return None
+    
+    @_timed
+    async def put_cached_verdict(self, cache_key: str, status: str, response: str, expires_at: float):
+        """Сохранить вердикт модерации в кэш"""
+        async with self.pool.writer() as db:
+            await db.execute("""
+                INSERT OR REPLACE INTO moderation_cache (cache_key, status, response, expires_at)
+                VALUES (?, ?, ?, ?)
+            """, (cache_key, status, response, expires_at))
+            await db.commit()
+    
+    @_timed
+    async def reserve_idempotency_key(
+        self,
+        key: str,
+        fingerprint: str,
+        ttl: float
+    ) -> Optional[Dict[str, Any]]:
+        """Занять ключ идемпотентности.
+
+        Возвращает None, если ключ свободен и теперь занят этим запросом,
+        иначе существующую запись {'fingerprint', 'message_id'} (message_id
+        пустой, пока первый запрос ещё выполняется). Просроченный ключ
+        считается свободным.
+        """
+        now = time.time()
+        async with self.pool.writer() as db:
+            await db.execute(
+                "DELETE FROM idempotency_keys WHERE idempotency_key = ? AND expires_at <= ?",
+                (key, now)
+            )
+            cursor = await db.execute("""
+                INSERT OR IGNORE INTO idempotency_keys (idempotency_key, fingerprint, expires_at)
+                VALUES (?, ?, ?)
+            """, (key, fingerprint, now + ttl))
+            reserved = cursor.rowcount == 1
+            existing = None
+            if not reserved:
+                cursor = await db.execute("""
+                    SELECT fingerprint, message_id
+                    FROM idempotency_keys
+                    WHERE idempotency_key = ?
+                """, (key,))
+                row = await cursor.fetchone()
+                existing = {'fingerprint': row[0], 'message_id': row[1]}
+            await db.commit()
+        return existing
+    
+    @_timed
+    async def get_idempotency_key(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получить непросроченную запись ключа идемпотентности"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute("""
+                SELECT fingerprint, message_id
+                FROM idempotency_keys
+                WHERE idempotency_key = ? AND expires_at > ?
+            """, (key, time.time()))
+            row = await cursor.fetchone()
+            return {'fingerprint': row[0], 'message_id': row[1]} if row else None
+    
+    @_timed
+    async def complete_idempotency_key(self, key: str, message_id: int):
+        """Привязать созданное сообщение к ключу"""
+        async with self.pool.writer() as db:
+            await db.execute(
+                "UPDATE idempotency_keys SET message_id = ? WHERE idempotency_key = ?",
+                (message_id, key)
+            )
+            await db.commit()
+    
+    @_timed
+    async def release_idempotency_key(self, key: str):
+        """Освободить ключ, если запрос завершился ошибкой до создания сообщения"""
+        async with self.pool.writer() as db:
+            await db.execute(
+                "DELETE FROM idempotency_keys WHERE idempotency_key = ? AND message_id IS NULL",
+                (key,)
+            )
+            await db.commit()
+    
+    @_timed
+    async def get_phrases(self) -> List[Dict[str, Any]]:
+        """Все фразы пула (для загрузки в память)"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute("""
+                SELECT id, gender, mood, template, last_used_at
+                FROM phrase_pool
+            """)
+            rows = await cursor.fetchall()
+            return [
+                {'id': row[0], 'gender': row[1], 'mood': row[2], 'template': row[3], 'last_used_at': row[4]}
+                for row in rows
+            ]
+    
+    @_timed
+    async def add_phrases(self, gender: str, mood: str, templates: List[str], source: str) -> List[Dict[str, Any]]:
+        """Добавить фразы в пул, вернуть только новые (дубликаты пропускаются)"""
+        added = []
+        async with self.pool.writer() as db:
+            for template in templates:
+                cursor = await db.execute("""
+                    INSERT OR IGNORE INTO phrase_pool (gender, mood, template, source)
+                    VALUES (?, ?, ?, ?)
+                    RETURNING id
+                """, (gender, mood, template, source))
+                row = await cursor.fetchone()
+                await cursor.close()
+                if row is not None:
+                    added.append({
+                        'id': row[0], 'gender': gender, 'mood': mood,
+                        'template': template, 'last_used_at': None
+                    })
+            await db.commit()
+        return added
+    
+    @_timed
+    async def mark_phrases_used(self, uses: List[tuple]) -> int:
+        """Записать использования фраз: список (id, время, число показов)"""
+        if not uses:
+            return 0
+        async with self.pool.writer() as db:
+            await db.executemany("""
+                UPDATE phrase_pool
+                SET last_used_at = MAX(COALESCE(last_used_at, 0), ?), use_count = use_count + ?
+                WHERE id = ?
+            """, [(used_at, count, phrase_id) for phrase_id, used_at, count in uses])
+            await db.commit()
+        return len(uses)
+    
+    @_timed
+    async def add_token_usage(self, rows: List[tuple]):
+        """Добавить к почасовым счётчикам: (час, модель, вызовы, prompt, completion, cached, стоимость)"""
+        if not rows:
+            return
+        async with self.pool.writer() as db:
+            await db.executemany("""
+                INSERT INTO token_usage
+                (hour, model, calls, prompt_tokens, completion_tokens, cached_tokens, cost)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (hour, model) DO UPDATE SET
+                    calls = calls + excluded.calls,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    cached_tokens = cached_tokens + excluded.cached_tokens,
+                    cost = cost + excluded.cost
+            """, rows)
+            await db.commit()
+    
+    @_timed
+    async def get_hourly_spend(self, since_hour: str) -> Dict[str, float]:
+        """Расходы всех моделей по часам начиная с since_hour"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute("""
+                SELECT hour, SUM(cost) FROM token_usage
+                WHERE hour >= ?
+                GROUP BY hour
+            """, (since_hour,))
+            rows = await cursor.fetchall()
+        return {row[0]: row[1] for row in rows}
+    
+    @_timed
+    async def get_token_usage(self, since_hour: str) -> List[Dict[str, Any]]:
+        """Почасовые счётчики токенов по моделям (новые первыми)"""
+        async with self.pool.reader() as db:
+            cursor = await db.execute("""
+                SELECT hour, model, calls, prompt_tokens, completion_tokens, cached_tokens, cost
+                FROM token_usage
+                WHERE hour >= ?
+                ORDER BY hour DESC, model
+            """, (since_hour,))
+            rows = await cursor.fetchall()
+        return [
+            {
+                'hour': row[0], 'model': row[1], 'calls': row[2], 'prompt_tokens': row[3],
+                'completion_tokens': row[4], 'cached_tokens': row[5], 'cost': row[6]
+            }
+            for row in rows
+        ]
 
 
 # Глобальный экземпляр базы данных
-db = Database(settings.database_path)
+db = Database(
+    settings.database_path,
+    pool_size=settings.db_pool_size,
+    busy_timeout_ms=settings.db_busy_timeout_ms,
+    latest_cache_size=settings.latest_cache_size,
+    synchronous=settings.db_synchronous,
+    write_batch_size=settings.db_write_batch_size,
+    write_batch_delay_ms=settings.db_write_batch_delay_ms
+)
 
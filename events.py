@@ -0,0 +1,86 @@
+"""Внутрипроцессная рассылка событий о сообщениях"""
+import asyncio
+from typing import Any, Callable, Dict, List, Set
+
+
+class EventHub:
+    """Pub/sub для событий о сообщениях.
+
+    У каждого подписчика своя ограниченная очередь. Если подписчик не
+    успевает читать и очередь переполнена, он отключается (получает None)
+    и должен переподключиться, дочитав пропущенное из базы.
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+        # Синхронные обработчики каждого события (например, ChangeWatcher)
+        self._observers: List[Callable[[str, Dict[str, Any]], None]] = []
+        self.published = 0
+        self.resyncs = 0
+        self.dropped_subscribers = 0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Подписаться на события"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        """Отписаться от событий"""
+        self._subscribers.discard(queue)
+
+    def add_observer(self, observer: Callable[[str, Dict[str, Any]], None]):
+        """Вызывать observer(event_type, message) при каждой публикации"""
+        self._observers.append(observer)
+
+    def remove_observer(self, observer: Callable[[str, Dict[str, Any]], None]):
+        if observer in self._observers:
+            self._observers.remove(observer)
+
+    def publish(self, event_type: str, message: Dict[str, Any]):
+        """Разослать событие всем подписчикам, не блокируясь"""
+        self.published += 1
+        self.notify(event_type, message)
+        self._broadcast({"type": event_type, "message": message})
+
+    def notify(self, event_type: str, message: Dict[str, Any]):
+        """Передать событие только наблюдателям, без подписчиков"""
+        for observer in self._observers:
+            observer(event_type, message)
+
+    def resync(self):
+        """Одно событие вместо множества изменений: подписчики дочитывают их из базы"""
+        self.resyncs += 1
+        self._broadcast({"type": "resync", "message": None})
+
+    def _broadcast(self, event: Dict[str, Any]):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def _drop(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        self.dropped_subscribers += 1
+        # Освобождаем место под маркер отключения
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": self.subscribers,
+            "published": self.published,
+            "resyncs": self.resyncs,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+# Глобальный экземпляр
+event_hub = EventHub()
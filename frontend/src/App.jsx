@@ -1,7 +1,25 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { CheckCircleIcon, XCircleIcon, ClockIcon } from '@heroicons/react/20/solid'
 
 const API_URL = import.meta.env.VITE_API_URL || (import.meta.env.DEV ? 'http://localhost:8000' : '')
+const PAGE_SIZE = 200
+const CHANGES_PAGE_SIZE = 1000
+
+// Объединить загруженные сообщения с новыми/изменёнными, новые первыми
+function mergeMessages(prev, incoming) {
+  const byId = new Map(prev.map(msg => [msg.id, msg]))
+  for (const msg of incoming) {
+    byId.set(msg.id, { ...byId.get(msg.id), ...msg })
+  }
+  return [...byId.values()].sort((a, b) => b.id - a.id)
+}
+
+function maxUpdatedAt(messages, current) {
+  return messages.reduce(
+    (max, msg) => (msg.updated_at && (!max || msg.updated_at > max) ? msg.updated_at : max),
+    current
+  )
+}
 
 function formatDate(dateString) {
   if (!dateString) return '-'
@@ -31,13 +49,44 @@ export default function App() {
   const [loading, setLoading] = useState(true)
   const [updating, setUpdating] = useState(new Set())
 
+  const [hasMore, setHasMore] = useState(false)
+  // Наибольший полученный updated_at: с него запрашиваются изменения
+  const syncCursor = useRef(null)
+
+  const applyMessages = (incoming) => {
+    syncCursor.current = maxUpdatedAt(incoming, syncCursor.current)
+    setMessages(prev => mergeMessages(prev, incoming))
+  }
+
+  const fetchPage = async (query) => {
+    const response = await fetch(`${API_URL}/api/messages/all?${query}`)
+    if (!response.ok) throw new Error('Failed to fetch messages')
+    return response.json()
+  }
+
+  // Изменения постранично по курсору (updated_at, id), пока не придёт неполная страница
+  const fetchChanges = async () => {
+    let query = `updated_since=${encodeURIComponent(syncCursor.current)}&limit=${CHANGES_PAGE_SIZE}`
+    for (;;) {
+      const data = await fetchPage(query)
+      applyMessages(data)
+      if (data.length < CHANGES_PAGE_SIZE) return
+      const last = data[data.length - 1]
+      query = `updated_since=${encodeURIComponent(last.updated_at)}&after_id=${last.id}&limit=${CHANGES_PAGE_SIZE}`
+    }
+  }
+
   const fetchMessages = async () => {
     try {
       setLoading(true)
-      const response = await fetch(`${API_URL}/api/messages/all`)
-      if (!response.ok) throw new Error('Failed to fetch messages')
-      const data = await response.json()
-      setMessages(data)
+      // Первая загрузка — последняя страница, дальше только изменения
+      if (syncCursor.current) {
+        await fetchChanges()
+      } else {
+        const data = await fetchPage(`limit=${PAGE_SIZE}`)
+        setHasMore(data.length === PAGE_SIZE)
+        applyMessages(data)
+      }
     } catch (error) {
       console.error('Error fetching messages:', error)
     } finally {
@@ -45,6 +94,20 @@ export default function App() {
     }
   }
 
+  const loadMore = async () => {
+    if (messages.length === 0) return
+    try {
+      const beforeId = messages[messages.length - 1].id
+      const response = await fetch(`${API_URL}/api/messages/all?limit=${PAGE_SIZE}&before_id=${beforeId}`)
+      if (!response.ok) throw new Error('Failed to fetch messages')
+      const data = await response.json()
+      setHasMore(data.length === PAGE_SIZE)
+      setMessages(prev => mergeMessages(prev, data))
+    } catch (error) {
+      console.error('Error fetching messages:', error)
+    }
+  }
+
   const updateStatus = async (messageId, newStatus) => {
     try {
       setUpdating(prev => new Set(prev).add(messageId))
@@ -76,9 +139,19 @@ export default function App() {
 
   useEffect(() => {
     fetchMessages()
-    // Обновляем каждые 5 секунд
-    const interval = setInterval(fetchMessages, 5000)
-    return () => clearInterval(interval)
+    // Новые сообщения и изменения статусов приходят через Server-Sent Events,
+    // после обрыва EventSource переподключается сам и дочитывает пропущенное
+    const source = new EventSource(`${API_URL}/api/messages/stream`)
+    const upsert = (event) => applyMessages([JSON.parse(event.data)])
+    source.addEventListener('created', upsert)
+    source.addEventListener('updated', upsert)
+    // Массовое изменение (сброс очереди) приходит одним событием
+    source.addEventListener('resync', () => fetchMessages())
+    // После переподключения дочитываем изменения статусов старых сообщений
+    source.addEventListener('open', () => {
+      if (syncCursor.current) fetchMessages()
+    })
+    return () => source.close()
   }, [])
 
   const okCount = messages.filter(m => m.status === 'ok').length
@@ -130,6 +203,8 @@ export default function App() {
             {messages.map((message) => {
               const openAIResponse = parseOpenAIResponse(message.openai_response)
               const isOk = message.status === 'ok'
+              const isPending = message.status === 'pending'
+              const isRestricted = !isOk && !isPending
               const isUpdating = updating.has(message.id)
 
               return (
@@ -143,10 +218,12 @@ export default function App() {
                           className={`inline-flex shrink-0 items-center rounded-full px-2 py-0.5 text-xs font-medium ${
                             isOk
                               ? 'bg-green-50 text-green-700 ring-1 ring-inset ring-green-600/20'
-                              : 'bg-red-50 text-red-700 ring-1 ring-inset ring-red-600/20'
+                              : isPending
+                                ? 'bg-yellow-50 text-yellow-800 ring-1 ring-inset ring-yellow-600/20'
+                                : 'bg-red-50 text-red-700 ring-1 ring-inset ring-red-600/20'
                           }`}
                         >
-                          {isOk ? 'Принято' : 'Отклонено'}
+                          {isOk ? 'Принято' : isPending ? 'На модерации' : 'Отклонено'}
                         </span>
                         {message.is_fetched && (
                           <span className="inline-flex items-center rounded-full bg-indigo-50 px-2 py-0.5 text-xs font-medium text-indigo-700 ring-1 ring-inset ring-indigo-600/20">
@@ -193,16 +270,16 @@ export default function App() {
                         <button
                           type="button"
                           onClick={() => updateStatus(message.id, 'restricted')}
-                          disabled={isUpdating || !isOk}
+                          disabled={isUpdating || isRestricted}
                           className={`relative inline-flex w-0 flex-1 items-center justify-center gap-x-3 rounded-br-lg border border-gray-200 py-4 text-sm font-semibold text-gray-900 ${
-                            !isOk
+                            isRestricted
                               ? 'bg-red-50 text-red-700 cursor-default'
                               : 'bg-white hover:bg-gray-50'
                           } ${isUpdating ? 'opacity-50 cursor-not-allowed' : ''}`}
                         >
                           <XCircleIcon
                             aria-hidden="true"
-                            className={`size-5 ${!isOk ? 'text-red-600' : 'text-gray-400'}`}
+                            className={`size-5 ${isRestricted ? 'text-red-600' : 'text-gray-400'}`}
                           />
                           Отклонить
                         </button>
@@ -214,6 +291,18 @@ export default function App() {
             })}
           </ul>
         )}
+
+        {hasMore && (
+          <div className="mt-8 text-center">
+            <button
+              type="button"
+              onClick={loadMore}
+              className="inline-flex items-center rounded-md bg-white px-3 py-2 text-sm font-semibold text-gray-900 shadow-sm ring-1 ring-inset ring-gray-300 hover:bg-gray-50"
+            >
+              Показать ещё
+            </button>
+          </div>
+        )}
       </div>
     </div>
   )
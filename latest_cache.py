@@ -0,0 +1,118 @@
+"""Кэш последних одобренных сообщений"""
+from typing import Any, Dict, List, Optional
+
+from serialization import dumps
+
+
+class LatestApprovedCache:
+    """Кольцевой буфер последних N сообщений со статусом 'ok'.
+
+    Заполняется из базы при старте и обновляется при каждой записи
+    (write-through), поэтому самые частые чтения — `GET /api/messages`
+    и контекст для модерации — не обращаются к SQLite. Для
+    `GET /api/messages` хранится готовый JSON, который сбрасывается
+    при любом изменении буфера.
+    """
+
+    def __init__(self, capacity: int = 20):
+        self.capacity = max(1, capacity)
+        # Отсортированы по (created_at, id), новые первыми
+        self._messages: List[Dict[str, Any]] = []
+        # True, если в буфере все одобренные сообщения из базы
+        self._complete = False
+        self._warm = False
+        self._json: Dict[int, bytes] = {}
+        # Увеличивается при каждом изменении, чтобы не загрузить устаревшие данные
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(message: Dict[str, Any]):
+        return (message['created_at'] or '', message['id'])
+
+    def load(self, messages: List[Dict[str, Any]], generation: Optional[int] = None):
+        """Заполнить буфер сообщениями из базы (новые первыми).
+
+        Если передан generation и буфер с тех пор менялся, загрузка
+        пропускается: данные могли устареть во время запроса.
+        """
+        if generation is not None and generation != self.generation:
+            return
+        self.generation += 1
+        self._messages = [dict(m) for m in messages[:self.capacity]]
+        self._complete = len(messages) < self.capacity
+        self._warm = True
+        self._json.clear()
+
+    def invalidate(self):
+        """Сбросить буфер; до следующей загрузки чтения идут в базу"""
+        self.generation += 1
+        self._messages = []
+        self._warm = False
+        self._json.clear()
+
+    def can_serve(self, limit: int) -> bool:
+        """Хватает ли буфера, чтобы ответить без запроса к базе"""
+        served = self._warm and (len(self._messages) >= limit or self._complete)
+        if served:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return served
+
+    def latest(self, limit: int) -> List[Dict[str, Any]]:
+        return [dict(m) for m in self._messages[:limit]]
+
+    def texts(self, limit: int) -> List[str]:
+        return [m['message_text'] for m in self._messages[:limit] if m['message_text']]
+
+    def latest_json(self, limit: int) -> bytes:
+        """Сериализованный ответ для `GET /api/messages`"""
+        body = self._json.get(limit)
+        if body is None:
+            body = dumps(self._messages[:limit])
+            self._json[limit] = body
+        return body
+
+    def upsert(self, message: Dict[str, Any]):
+        """Учесть новое или изменённое сообщение"""
+        if not self._warm:
+            return
+        self.generation += 1
+        self._remove(message['id'])
+        if message['status'] == 'ok':
+            key = self._key(message)
+            idx = 0
+            while idx < len(self._messages) and self._key(self._messages[idx]) > key:
+                idx += 1
+            # За концом неполного буфера могут быть сообщения из базы
+            if idx < len(self._messages) or self._complete:
+                self._messages.insert(idx, dict(message))
+                if len(self._messages) > self.capacity:
+                    self._messages.pop()
+                    self._complete = False
+        self._json.clear()
+
+    def update_fields(self, message_id: Optional[int] = None, **fields):
+        """Обновить поля одного сообщения (или всех, если id не задан)"""
+        self.generation += 1
+        for message in self._messages:
+            if message_id is None or message['id'] == message_id:
+                message.update(fields)
+        self._json.clear()
+
+    def _remove(self, message_id: int):
+        for idx, message in enumerate(self._messages):
+            if message['id'] == message_id:
+                del self._messages[idx]
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._messages),
+            "capacity": self.capacity,
+            "warm": self._warm,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
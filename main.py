@@ -7,9 +7,11 @@ from api import app
 if __name__ == "__main__":
     # Запускаем FastAPI сервер
     uvicorn.run(
-        app,
+        # Несколько процессов uvicorn запускает только по строке импорта
+        "api:app" if settings.api_workers > 1 else app,
         host=settings.api_host,
         port=settings.api_port,
+        workers=settings.api_workers,
         log_level="info"
     )
 
@@ -0,0 +1,115 @@
+"""Приём нового сообщения: модерация и сохранение.
+
+Общий путь для POST /api/messages/create и Telegram-бота.
+"""
+from typing import Any, Dict, Optional
+
+from config import settings
+from database import db
+from moderation_worker import moderation_workers
+from openai_service import openai_service
+from serialization import dumps_text, raw_json
+
+
+def _created_message(
+    message_id: int,
+    name: str,
+    age: Optional[int],
+    gender: Optional[str],
+    mood: Optional[str],
+    status: str,
+    message_text: str = '',
+    openai_response: Optional[str] = None
+) -> Dict[str, Any]:
+    """Созданное сообщение; openai_response — сохранённый JSON"""
+    return {
+        "id": message_id,
+        "name": name,
+        "age": age,
+        "gender": gender,
+        "mood": mood,
+        "message_text": message_text,
+        "status": status,
+        "openai_response": raw_json(openai_response)
+    }
+
+
+async def _add_pending_message(
+    name: str,
+    age: Optional[int],
+    gender: Optional[str],
+    mood: Optional[str],
+    retry_delay: Optional[float] = None
+) -> Dict[str, Any]:
+    """Сохранить сообщение со статусом 'pending' и передать фоновой модерации"""
+    message_id = await db.add_message(
+        name=name,
+        age=age,
+        gender=gender,
+        mood=mood,
+        message_text='',
+        openai_response=None,
+        status='pending'
+    )
+    if retry_delay is None:
+        moderation_workers.submit(message_id)
+    else:
+        moderation_workers.submit_later(message_id, retry_delay)
+    return _created_message(message_id, name, age, gender, mood, 'pending')
+
+
+async def submit_message(
+    name: str,
+    age: Optional[int] = None,
+    gender: Optional[str] = None,
+    mood: Optional[str] = None,
+    async_mode: bool = False
+) -> Dict[str, Any]:
+    """Проверить и сохранить новое сообщение.
+
+    В async_mode, а также если проверка не удалась (OpenAI недоступен),
+    сообщение сохраняется со статусом 'pending' и модерируется в фоне.
+    """
+    if async_mode:
+        return await _add_pending_message(name, age, gender, mood)
+
+    previous_messages = await db.get_last_approved_messages(limit=3)
+
+    # Проверяем сообщение через OpenAI
+    result = await openai_service.check_message(
+        name=name,
+        age=age,
+        gender=gender,
+        mood=mood,
+        previous_messages=previous_messages
+    )
+
+    if result['status'] == 'error':
+        # Проверка не удалась — не отклоняем, а откладываем на повтор
+        return await _add_pending_message(
+            name, age, gender, mood,
+            retry_delay=max(settings.moderation_retry_delay, openai_service.breaker.retry_in())
+        )
+
+    # Токены и стоимость хранятся в отдельных колонках, не в openai_response
+    usage = result.pop('usage', None)
+    # Сохраняем в базу данных; в ответ уходит тот же JSON без повторной сериализации
+    openai_response = dumps_text(result)
+    message_id = await db.add_message(
+        name=name,
+        age=age,
+        gender=gender,
+        mood=mood,
+        message_text=result.get('response', ''),
+        openai_response=openai_response,
+        status=result['status'],
+        usage=usage
+    )
+
+    return _created_message(
+        message_id,
+        name, age, gender, mood,
+        result['status'],
+        message_text=result.get('response', ''),
+        openai_response=openai_response
+    )
@@ -0,0 +1,360 @@
+"""Метрики в формате Prometheus (text exposition) без внешних зависимостей.
+
+Все метрики объявлены здесь и отдаются эндпоинтом /api/metrics.
+"""
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Границы по умолчанию: от долей миллисекунды (SQLite) до минуты (OpenAI)
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание и значения по наборам меток"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """Увеличить на время выполнения блока"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (накопительно, как в Prometheus)"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Счётчики по корзинам (последняя — +Inf), сумма, количество
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замерить длительность блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> Iterator[str]:
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр
+registry = MetricsRegistry()
+
+# HTTP API
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_PROGRESS = registry.gauge(
+    "http_requests_in_progress", "HTTP-запросы в обработке"
+)
+
+# База данных
+DB_CALL_SECONDS = registry.histogram(
+    "db_call_duration_seconds", "Время выполнения метода Database", ("method", "outcome")
+)
+DB_ROWS = registry.counter(
+    "db_rows_total", "Строк прочитано или изменено методом Database", ("method",)
+)
+DB_POOL_WAIT_SECONDS = registry.histogram(
+    "db_pool_wait_seconds", "Ожидание соединения из пула", ("mode",)
+)
+DB_WRITE_BATCH_SIZE = registry.histogram(
+    "db_write_batch_size", "Число вставок в одной групповой транзакции",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+QUEUE_DEPTH = registry.gauge(
+    "queue_depth", "Одобренные сообщения, ещё не забранные экранами"
+)
+PENDING_MESSAGES = registry.gauge(
+    "pending_messages", "Сообщения в статусе 'pending'"
+)
+
+# OpenAI
+OPENAI_REQUEST_SECONDS = registry.histogram(
+    "openai_request_duration_seconds", "Время HTTP-запроса к OpenAI", ("model", "status")
+)
+OPENAI_REQUESTS = registry.counter(
+    "openai_requests_total", "Запросы к OpenAI по коду ответа ('error' — ошибка соединения)", ("model", "status")
+)
+OPENAI_TOKENS = registry.counter(
+    "openai_tokens_total", "Токены из поля usage ответа OpenAI", ("model", "type")
+)
+OPENAI_COST = registry.counter(
+    "openai_cost_usd_total", "Стоимость запросов к OpenAI по ценам модели, USD", ("model",)
+)
+OPENAI_SPEND_RATE = registry.gauge(
+    "openai_spend_rate_usd", "Расходы на OpenAI за последний час, USD"
+)
+OPENAI_BUDGET_MODE = registry.gauge(
+    "openai_budget_mode", "Режим модерации по расходам: 0 — основная модель, 1 — дешёвая, 2 — локальные правила"
+)
+OPENAI_RETRIES = registry.counter(
+    "openai_retries_total", "Повторные запросы к OpenAI", ("model",)
+)
+OPENAI_SEMAPHORE_WAIT_SECONDS = registry.histogram(
+    "openai_semaphore_wait_seconds", "Ожидание слота ограничителя параллельных запросов к OpenAI"
+)
+OPENAI_IN_FLIGHT = registry.gauge(
+    "openai_in_flight", "Запросы к OpenAI в процессе выполнения"
+)
+OPENAI_CONCURRENCY_LIMIT = registry.gauge(
+    "openai_concurrency_limit", "Текущий адаптивный лимит параллельных запросов к OpenAI"
+)
+OPENAI_CIRCUIT_OPEN = registry.gauge(
+    "openai_circuit_open", "Автомат отключения OpenAI разомкнут (1) или замкнут (0)"
+)
+MODERATION_VERDICTS = registry.counter(
+    "moderation_verdicts_total", "Вердикты модерации по источнику", ("source", "status")
+)
+MODERATION_TIER_SECONDS = registry.histogram(
+    "moderation_tier_duration_seconds", "Время ответа уровня каскада моделей", ("tier", "outcome")
+)
+MODERATION_TIER_COST = registry.counter(
+    "moderation_tier_cost_usd_total", "Стоимость запросов уровня каскада моделей, USD", ("tier",)
+)
+MODERATION_ESCALATIONS = registry.counter(
+    "moderation_escalations_total", "Проверки, переданные быстрой моделью основной", ("reason",)
+)
+MODERATION_COALESCED = registry.counter(
+    "moderation_coalesced_total", "Проверки, присоединённые к такой же выполняющейся"
+)
+MODERATION_WORKER_QUEUE = registry.gauge(
+    "moderation_worker_queue", "Сообщения в очереди фоновой модерации"
+)
+
+# Telegram-бот
+TELEGRAM_UPDATES = registry.counter(
+    "telegram_updates_total", "Сообщения боту по результату приёма", ("outcome",)
+)
+TELEGRAM_QUEUE = registry.gauge(
+    "telegram_queue", "Сообщения бота в очереди на модерацию"
+)
+TELEGRAM_PROCESS_SECONDS = registry.histogram(
+    "telegram_process_seconds", "Время от получения сообщения бота до ответа с вердиктом"
+)
+
+# Event loop
+EVENT_LOOP_LAG_SECONDS = registry.histogram(
+    "event_loop_lag_seconds", "Задержка срабатывания таймера event loop",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время обработки запросов по шаблону маршрута.
+
+    Метка route — шаблон пути (/api/messages/{message_id}), а не сам путь,
+    чтобы число рядов не росло с числом сообщений.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status_code
+            )
+
+
+class EventLoopMonitor:
+    """Фоновая задача, измеряющая опоздание таймера event loop.
+
+    Большая задержка означает, что цикл занят синхронной работой
+    (сериализация, разбор JSON, блокирующие вызовы).
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Глобальный монитор event loop
+loop_monitor = EventLoopMonitor()
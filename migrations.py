@@ -0,0 +1,311 @@
+"""Миграции схемы базы данных.
+
+Версия схемы хранится в PRAGMA user_version. Каждая миграция
+выполняется в отдельной транзакции вместе с повышением версии, поэтому
+прерванная миграция повторится при следующем запуске. Новые миграции
+добавляются в конец MIGRATIONS с очередным номером.
+"""
+from typing import Awaitable, Callable, List, Tuple
+
+import aiosqlite
+
+
+async def _columns(db: aiosqlite.Connection, table: str) -> List[str]:
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return [col[1] for col in await cursor.fetchall()]
+
+
+async def _baseline(db: aiosqlite.Connection):
+    """Таблица messages; старые схемы (user_id/username) приводятся к текущей"""
+    # Проверяем существование таблицы и её структуру
+    cursor = await db.execute("""
+        SELECT name FROM sqlite_master 
+        WHERE type='table' AND name='messages'
+    """)
+    table_exists = await cursor.fetchone()
+    
+    if table_exists:
+        # Таблица существует - проверяем структуру и мигрируем
+        cursor = await db.execute("PRAGMA table_info(messages)")
+        columns = await cursor.fetchall()
+        column_names = [col[1] for col in columns]
+        
+        # Если есть старые колонки, создаем новую таблицу и мигрируем данные
+        if 'user_id' in column_names and 'name' not in column_names:
+            # Создаем временную таблицу с новой структурой
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS messages_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    age INTEGER,
+                    gender TEXT,
+                    mood TEXT,
+                    message_text TEXT NOT NULL,
+                    openai_response TEXT,
+                    status TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    is_fetched BOOLEAN DEFAULT 0,
+                    fetched_at TIMESTAMP
+                )
+            """)
+            
+            # Мигрируем данные (используем username как name, если есть)
+            await db.execute("""
+                INSERT INTO messages_new 
+                (id, name, age, gender, mood, message_text, openai_response, status, created_at, is_fetched, fetched_at)
+                SELECT 
+                    id,
+                    COALESCE(username, 'Пользователь ' || user_id) as name,
+                    NULL as age,
+                    NULL as gender,
+                    NULL as mood,
+                    message_text,
+                    openai_response,
+                    status,
+                    created_at,
+                    is_fetched,
+                    fetched_at
+                FROM messages
+            """)
+            
+            # Удаляем старую таблицу и переименовываем новую
+            await db.execute("DROP TABLE messages")
+            await db.execute("ALTER TABLE messages_new RENAME TO messages")
+        elif 'name' not in column_names:
+            # Добавляем новые колонки если их нет
+            await db.execute("ALTER TABLE messages ADD COLUMN name TEXT")
+            await db.execute("ALTER TABLE messages ADD COLUMN age INTEGER")
+            await db.execute("ALTER TABLE messages ADD COLUMN gender TEXT")
+            await db.execute("ALTER TABLE messages ADD COLUMN mood TEXT")
+            
+            # Заполняем name для существующих записей
+            await db.execute("""
+                UPDATE messages 
+                SET name = COALESCE(username, 'Пользователь ' || user_id)
+                WHERE name IS NULL
+            """)
+            
+            # Удаляем старые колонки если они есть
+            if 'user_id' in column_names:
+                # SQLite не поддерживает DROP COLUMN напрямую, нужно пересоздать таблицу
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS messages_temp (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT NOT NULL,
+                        age INTEGER,
+                        gender TEXT,
+                        mood TEXT,
+                        message_text TEXT NOT NULL,
+                        openai_response TEXT,
+                        status TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        is_fetched BOOLEAN DEFAULT 0,
+                        fetched_at TIMESTAMP
+                    )
+                """)
+                await db.execute("""
+                    INSERT INTO messages_temp 
+                    (id, name, age, gender, mood, message_text, openai_response, status, created_at, is_fetched, fetched_at)
+                    SELECT 
+                        id,
+                        COALESCE(name, username, 'Пользователь ' || COALESCE(user_id, 0)) as name,
+                        NULL as age,
+                        gender,
+                        mood,
+                        message_text,
+                        openai_response,
+                        status,
+                        created_at,
+                        is_fetched,
+                        fetched_at
+                    FROM messages
+                """)
+                await db.execute("DROP TABLE messages")
+                await db.execute("ALTER TABLE messages_temp RENAME TO messages")
+        else:
+            if 'age' not in column_names:
+                await db.execute("ALTER TABLE messages ADD COLUMN age INTEGER")
+    else:
+        # Таблица не существует - создаем новую
+        await db.execute("""
+            CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                age INTEGER,
+                gender TEXT,
+                mood TEXT,
+                message_text TEXT NOT NULL,
+                openai_response TEXT,
+                status TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_fetched BOOLEAN DEFAULT 0,
+                fetched_at TIMESTAMP
+            )
+        """)
+
+
+async def _updated_at(db: aiosqlite.Connection):
+    """Время последнего изменения для инкрементальной синхронизации"""
+    if 'updated_at' not in await _columns(db, 'messages'):
+        await db.execute("ALTER TABLE messages ADD COLUMN updated_at TIMESTAMP")
+        await db.execute("UPDATE messages SET updated_at = created_at")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_updated_at
+        ON messages(updated_at)
+    """)
+
+
+async def _moderation_cache(db: aiosqlite.Connection):
+    """Постоянный уровень кэша вердиктов модерации"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS moderation_cache (
+            cache_key TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            response TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+
+async def _hot_indexes(db: aiosqlite.Connection):
+    """Частичные индексы под горячие запросы вместо idx_is_fetched"""
+    # Последние одобренные: WHERE status = 'ok' ORDER BY created_at DESC, id DESC
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_ok_created
+        ON messages(created_at) WHERE status = 'ok'
+    """)
+    # Очередь на экран: WHERE is_fetched = 0 AND status = 'ok' ORDER BY created_at
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_unfetched
+        ON messages(created_at) WHERE status = 'ok' AND is_fetched = 0
+    """)
+    # Фоновая модерация: WHERE status = 'pending' ORDER BY created_at, id
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_pending
+        ON messages(created_at) WHERE status = 'pending'
+    """)
+    # (is_fetched, created_at) не подходил ни одному запросу
+    await db.execute("DROP INDEX IF EXISTS idx_is_fetched")
+    await db.execute("ANALYZE")
+
+
+async def _queue_leases(db: aiosqlite.Connection):
+    """Аренда сообщений потребителями очереди"""
+    columns = await _columns(db, 'messages')
+    if 'lease_owner' not in columns:
+        await db.execute("ALTER TABLE messages ADD COLUMN lease_owner TEXT")
+    if 'lease_expires_at' not in columns:
+        await db.execute("ALTER TABLE messages ADD COLUMN lease_expires_at TIMESTAMP")
+    if 'delivery_count' not in columns:
+        await db.execute("ALTER TABLE messages ADD COLUMN delivery_count INTEGER NOT NULL DEFAULT 0")
+    # Аренды конкретного потребителя (nack всех его сообщений)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_lease_owner
+        ON messages(lease_owner) WHERE lease_owner IS NOT NULL
+    """)
+
+
+async def _idempotency_keys(db: aiosqlite.Connection):
+    """Ключи идемпотентности POST /api/messages/create.
+
+    message_id пустой, пока первый запрос с этим ключом ещё выполняется.
+    """
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            idempotency_key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            message_id INTEGER,
+            expires_at REAL NOT NULL
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires
+        ON idempotency_keys(expires_at)
+    """)
+
+
+async def _phrase_pool(db: aiosqlite.Connection):
+    """Пул заранее сгенерированных фраз Прохора с плейсхолдером [Имя]"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS phrase_pool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            gender TEXT NOT NULL,
+            mood TEXT NOT NULL,
+            template TEXT NOT NULL,
+            source TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at REAL,
+            use_count INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (gender, mood, template)
+        )
+    """)
+
+
+async def _token_usage(db: aiosqlite.Connection):
+    """Токены и стоимость модерации: по сообщениям и по часам"""
+    columns = await _columns(db, 'messages')
+    for column, column_type in (
+        ('model', 'TEXT'),
+        ('prompt_tokens', 'INTEGER'),
+        ('completion_tokens', 'INTEGER'),
+        ('cost', 'REAL'),
+    ):
+        if column not in columns:
+            await db.execute(f"ALTER TABLE messages ADD COLUMN {column} {column_type}")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS token_usage (
+            hour TIMESTAMP NOT NULL,
+            model TEXT NOT NULL,
+            calls INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cached_tokens INTEGER NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, model)
+        )
+    """)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[aiosqlite.Connection], Awaitable[None]]]] = [
+    (1, "baseline messages schema", _baseline),
+    (2, "messages.updated_at", _updated_at),
+    (3, "moderation_cache table", _moderation_cache),
+    (4, "partial indexes for hot queries", _hot_indexes),
+    (5, "queue leases", _queue_leases),
+    (6, "idempotency keys", _idempotency_keys),
+    (7, "phrase pool", _phrase_pool),
+    (8, "token usage", _token_usage),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("PRAGMA user_version")
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row[0]
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Применить недостающие миграции, вернуть итоговую версию схемы"""
+    version = await get_schema_version(db)
+    for number, description, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            # Другой процесс мог применить миграцию, пока мы ждали блокировку
+            if await get_schema_version(db) >= number:
+                await db.rollback()
+                version = number
+                continue
+            await apply(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        print(f"[Database] Applied migration {number}: {description}")
+        version = number
+    return version
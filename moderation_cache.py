@@ -0,0 +1,98 @@
+"""Кэш результатов модерации"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import settings
+from database import Database, db
+
+
+class ModerationCache:
+    """LRU-кэш вердиктов модерации с TTL.
+
+    Ключ строится из нормализованных данных, которые уже вычисляет
+    check_message, и версии промпта. Опционально записи дублируются
+    в SQLite, чтобы кэш переживал перезапуск.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 5000,
+        ttl: float = 3600.0,
+        store: Optional[Database] = None
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(version: str, name: str, gender_value: str, age_value: str, mood_value: str) -> str:
+        """Ключ кэша: версия промпта и нормализованные поля"""
+        name_normalized = " ".join(name.split()).casefold()
+        return "\x1f".join((version, name_normalized, gender_value, age_value, mood_value))
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получить вердикт (копию) или None"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(result)
+            del self._entries[key]
+
+        if self.store is not None:
+            result = await self.store.get_cached_verdict(key)
+            if result is not None:
+                self.persistent_hits += 1
+                self._remember(key, result, result.pop('expires_at'))
+                return dict(result)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, result: Dict[str, Any]):
+        """Сохранить вердикт"""
+        value = {'status': result['status'], 'response': result['response']}
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self.store is not None:
+            await self.store.put_cached_verdict(key, value['status'], value['response'], expires_at)
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Очистить кэш в памяти"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики попаданий и промахов"""
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "persistent": self.store is not None,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+        }
+
+
+# Глобальный экземпляр кэша
+moderation_cache = ModerationCache(
+    max_size=settings.moderation_cache_size,
+    ttl=settings.moderation_cache_ttl,
+    store=db if settings.moderation_cache_persistent else None
+)
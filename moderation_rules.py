@@ -0,0 +1,279 @@
+"""Локальная предмодерация по списку запрещённых слов.
+
+Детерминированные правила из системного промпта (страны, регионы, война,
+лозунги, мат) проверяются до обращения к OpenAI. Текст нормализуется:
+регистр, «ё», латинские двойники кириллических букв, транслитерация,
+разделители внутри слов. Повтор буквы в шаблоне совпадает с любым
+числом таких букв в тексте, сами шаблоны не сокращаются: «росси» не
+превращается в «роси». Названия, фамилии и лозунги ищутся с начала
+слова, подстрокой — только однозначный мат. Слабые правила не отклоняют
+сообщение, а передают его модели.
+"""
+import json
+import os
+import re
+import time
+from typing import AbstractSet, Any, Dict, Iterable, List, Optional, Tuple
+
+from config import settings
+
+
+# Латинские буквы и цифры, похожие на кириллические
+HOMOGLYPHS = str.maketrans({
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м",
+    "o": "о", "p": "р", "t": "т", "x": "х", "y": "у", "u": "и",
+    "0": "о", "3": "з", "4": "ч", "6": "б", "@": "а",
+})
+
+# Транслитерация латиницы в кириллицу, сначала многобуквенные сочетания
+TRANSLIT = [
+    ("shch", "щ"), ("sch", "щ"), ("zh", "ж"), ("kh", "х"), ("ch", "ч"),
+    ("sh", "ш"), ("ts", "ц"), ("yu", "ю"), ("ya", "я"), ("yo", "е"),
+    ("ye", "е"), ("a", "а"), ("b", "б"), ("c", "к"), ("d", "д"),
+    ("e", "е"), ("f", "ф"), ("g", "г"), ("h", "х"), ("i", "и"),
+    ("j", "й"), ("k", "к"), ("l", "л"), ("m", "м"), ("n", "н"),
+    ("o", "о"), ("p", "п"), ("q", "к"), ("r", "р"), ("s", "с"),
+    ("t", "т"), ("u", "у"), ("v", "в"), ("w", "в"), ("x", "кс"),
+    ("y", "ы"), ("z", "з"),
+]
+_TRANSLIT_RE = re.compile("|".join(src for src, _ in TRANSLIT))
+_TRANSLIT_MAP = dict(TRANSLIT)
+
+_NON_LETTERS_RE = re.compile(r"[\W_]+")
+# Слово, разбитое на отдельные буквы: «к р ы м»
+_SPELLED_RE = re.compile(r"(?<!\S)\w(?: \w)+(?!\S)")
+
+
+def _base(text: str) -> str:
+    return text.casefold().replace("ё", "е")
+
+
+def _spaced(text: str) -> str:
+    """Слова через один пробел, без знаков; слово по буквам собирается обратно"""
+    text = _NON_LETTERS_RE.sub(" ", text).strip()
+    return _SPELLED_RE.sub(lambda m: m.group(0).replace(" ", ""), text)
+
+
+def _translit(text: str) -> str:
+    return _TRANSLIT_RE.sub(lambda m: _TRANSLIT_MAP[m.group(0)], text)
+
+
+def _is_allowed(word: str, allow: AbstractSet[str]) -> bool:
+    """Слово из списка разрешённых в любом из вариантов написания"""
+    for form in (word, word.translate(HOMOGLYPHS), _translit(word).translate(HOMOGLYPHS)):
+        if _NON_LETTERS_RE.sub("", form) in allow:
+            return True
+    return False
+
+
+def normalize_variants(text: str, allow: AbstractSet[str] = frozenset()) -> List[str]:
+    """Варианты нормализованного текста: как есть, со сведёнными двойниками и транслитом.
+
+    Разрешённые слова (фамилии, совпадающие с основами правил) выбрасываются.
+    """
+    base = _base(text)
+    if allow:
+        base = " ".join(word for word in base.split() if not _is_allowed(word, allow))
+    # После транслита остаются только цифры-двойники: «r0ssiya»
+    variants = [base, base.translate(HOMOGLYPHS), _translit(base).translate(HOMOGLYPHS)]
+    result = []
+    for variant in variants:
+        spaced = _spaced(variant)
+        if spaced and spaced not in result:
+            result.append(spaced)
+    return result
+
+
+def normalize_pattern(pattern: str) -> str:
+    """Шаблон нормализуется так же, как проверяемый текст, но без сборки по буквам"""
+    return _NON_LETTERS_RE.sub(" ", _base(pattern)).strip()
+
+
+def _pattern_regex(pattern: str) -> str:
+    # Каждая буква шаблона совпадает с одной или несколькими такими же: «крыыым»
+    return "".join(" " if ch == " " else re.escape(ch) + "+" for ch in pattern)
+
+
+class RuleMatch:
+    """Сработавшее правило; слабое совпадение проверяет модель"""
+
+    __slots__ = ("rule_id", "pattern", "weak")
+
+    def __init__(self, rule_id: str, pattern: str, weak: bool = False):
+        self.rule_id = rule_id
+        self.pattern = pattern
+        self.weak = weak
+
+    def __repr__(self) -> str:
+        return f"RuleMatch({self.rule_id!r}, {self.pattern!r}, weak={self.weak!r})"
+
+
+class ModerationRules:
+    """Движок локальных правил с горячей перезагрузкой из JSON-файла.
+
+    Формат файла::
+
+        {"version": 2, "allow": ["крымов"], "must_pass": ["Valentino Rossi"],
+         "rules": [
+            {"id": "regions", "prefixes": ["крым"], "words": ["днр"]},
+            {"id": "war_symbols", "weak": true, "words": ["z"]}
+        ]}
+
+    ``prefixes`` ищутся с начала слова, ``words`` — только как отдельные
+    слова, ``substrings`` — в тексте без пробелов и разделителей (только
+    однозначный мат). Совпадение правила с ``weak`` не отклоняет сообщение,
+    а передаёт его модели. Слова из ``allow`` правила не проверяют.
+    ``must_pass`` — имена, которые не должны отклоняться: файл, в котором
+    одно из них отклоняется, не загружается.
+    """
+
+    # Виды сопоставления: шаблон выражения для альтернативы и проверка текста без пробелов
+    KINDS = (
+        ("words", r"(?<!\S)(?:{})(?!\S)", False),
+        ("prefixes", r"(?<!\S)(?:{})", False),
+        ("substrings", r"(?:{})", True),
+    )
+
+    def __init__(self, path: str, reload_interval: float = 2.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.version: Any = None
+        self.rule_ids: List[str] = []
+        self.hits: Dict[str, int] = {}
+        self.checks = 0
+        # (выражение, без пробелов, слабое), сильные правила первыми
+        self._patterns: List[Tuple[re.Pattern, bool, bool]] = []
+        self._group_rules: Dict[str, str] = {}
+        self._allow: AbstractSet[str] = frozenset()
+        self._mtime: Optional[float] = None
+        self._last_stat = 0.0
+        self.reload()
+
+    @staticmethod
+    def _alternation(patterns: Iterable[str]) -> str:
+        # Длинные шаблоны первыми, чтобы в отчёте был наиболее точный
+        unique = sorted(set(patterns), key=lambda p: (-len(p), p))
+        return "|".join(_pattern_regex(p) for p in unique)
+
+    def load(self, data: Dict[str, Any]):
+        """Скомпилировать правила из словаря"""
+        # (вид, слабое) → части выражения; одно имя группы нельзя
+        # использовать дважды в выражении, поэтому выражений несколько
+        parts: Dict[Tuple[str, bool], List[str]] = {}
+        group_rules = {}
+        rule_ids = []
+        for idx, rule in enumerate(data.get("rules", [])):
+            rule_id = rule["id"]
+            rule_ids.append(rule_id)
+            group = f"r{idx}"
+            group_rules[group] = rule_id
+            weak = bool(rule.get("weak", False))
+            for kind, _, stripped in self.KINDS:
+                patterns = [normalize_pattern(p) for p in rule.get(kind, [])]
+                patterns = [p.replace(" ", "") if stripped else p for p in patterns if p]
+                if patterns:
+                    parts.setdefault((kind, weak), []).append(f"(?P<{group}>{self._alternation(patterns)})")
+
+        compiled = []
+        for weak in (False, True):
+            for kind, template, stripped in self.KINDS:
+                if (kind, weak) in parts:
+                    regex = re.compile(template.format("|".join(parts[kind, weak])))
+                    compiled.append((regex, stripped, weak))
+        allow = frozenset(_NON_LETTERS_RE.sub("", _base(word)) for word in data.get("allow", []))
+
+        for text in data.get("must_pass", []):
+            found = self._find(text, compiled, group_rules, allow)
+            if found is not None and not found.weak:
+                raise ValueError(f"{text!r} is rejected by rule {found.rule_id!r} ({found.pattern!r})")
+
+        self._patterns = compiled
+        self._group_rules = group_rules
+        self._allow = allow
+        self.rule_ids = rule_ids
+        self.version = data.get("version")
+        for rule_id in rule_ids:
+            self.hits.setdefault(rule_id, 0)
+
+    def reload(self):
+        """Перечитать файл правил; при ошибке остаются прежние правила"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.load(data)
+            self._mtime = mtime
+            print(f"[ModerationRules] Loaded {len(self.rule_ids)} rules from {self.path}")
+        except FileNotFoundError:
+            if self._mtime is None:
+                print(f"[ModerationRules] Rules file not found: {self.path}")
+        except Exception as e:
+            print(f"[ModerationRules] Failed to load rules from {self.path}: {e}")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_stat < self.reload_interval:
+            return
+        self._last_stat = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def match(self, *texts: Optional[str]) -> Optional[RuleMatch]:
+        """Проверить тексты, вернуть сработавшее правило или None.
+
+        Сильное совпадение важнее слабого.
+        """
+        self._maybe_reload()
+        self.checks += 1
+        result = None
+        for text in texts:
+            if not text:
+                continue
+            found = self._find(text, self._patterns, self._group_rules, self._allow)
+            if found is not None and (result is None or not found.weak):
+                result = found
+            if result is not None and not result.weak:
+                break
+        if result is not None:
+            self.hits[result.rule_id] = self.hits.get(result.rule_id, 0) + 1
+        return result
+
+    @staticmethod
+    def _find(
+        text: str,
+        patterns: List[Tuple[re.Pattern, bool, bool]],
+        group_rules: Dict[str, str],
+        allow: AbstractSet[str]
+    ) -> Optional[RuleMatch]:
+        weak_match = None
+        for variant in normalize_variants(text, allow):
+            for regex, stripped, weak in patterns:
+                if weak and weak_match is not None:
+                    continue
+                m = regex.search(variant.replace(" ", "") if stripped else variant)
+                if m:
+                    found = RuleMatch(group_rules[m.lastgroup], m.group(m.lastgroup), weak)
+                    if not weak:
+                        return found
+                    weak_match = found
+        return weak_match
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики срабатываний по правилам"""
+        return {
+            "version": self.version,
+            "path": self.path,
+            "checks": self.checks,
+            "hits": dict(self.hits),
+        }
+
+
+# Глобальный экземпляр правил
+moderation_rules = ModerationRules(
+    settings.moderation_rules_path,
+    reload_interval=settings.moderation_rules_reload_interval
+)
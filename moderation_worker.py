@@ -0,0 +1,189 @@
+"""Фоновая модерация сообщений"""
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+
+from config import settings
+from database import Database, db
+from openai_service import OpenAIService, openai_service
+from rows import MessageRow
+from serialization import dumps_text
+
+
+class ModerationWorkerPool:
+    """Пул фоновых обработчиков сообщений в статусе 'pending'.
+
+    Очередь хранится в таблице messages: при запуске все ожидающие
+    сообщения заново ставятся в очередь, поэтому задачи переживают
+    перезапуск. Параллельность ограничена числом обработчиков.
+    Перед проверкой сообщение арендуется в базе, поэтому пулы разных
+    процессов не модерируют (и не оплачивают) одно сообщение дважды.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        service: OpenAIService,
+        workers: int = 4,
+        retry_delay: float = 30.0,
+        lease_timeout: float = 120.0
+    ):
+        self.database = database
+        self.service = service
+        self.workers = max(1, workers)
+        self.retry_delay = retry_delay
+        self.lease_timeout = lease_timeout
+        self.owner = f"moderation:{os.getpid()}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: set = set()
+        self._tasks: List[asyncio.Task] = []
+        # id сообщения → события ожидающих wait_for, у каждого своё
+        self._events: Dict[int, Set[asyncio.Event]] = {}
+        self._retries: Dict[int, asyncio.TimerHandle] = {}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self, resume: bool = True):
+        """Запустить обработчики и поставить в очередь незавершённые задачи.
+
+        При нескольких процессах API незавершённые задачи ставит в очередь
+        только лидер (resume=False и затем resume_pending).
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._queued.clear()
+        if resume:
+            await self.resume_pending()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"moderation-worker-{idx}")
+            for idx in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Остановить обработчики; незавершённые сообщения остаются 'pending'"""
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queue = None
+        self._queued.clear()
+
+    async def resume_pending(self):
+        """Поставить в очередь все сообщения в статусе 'pending'"""
+        for message_id in await self.database.get_pending_message_ids():
+            self.submit(message_id)
+        if self._queued:
+            print(f"[ModerationWorkerPool] Resuming {len(self._queued)} pending messages")
+
+    def submit(self, message_id: int):
+        """Поставить сообщение в очередь модерации"""
+        if self._queue is None or message_id in self._queued:
+            return
+        self._queued.add(message_id)
+        self._queue.put_nowait(message_id)
+
+    def submit_later(self, message_id: int, delay: float):
+        """Поставить сообщение в очередь через delay секунд (после сбоя модерации)"""
+        if self._queue is None or message_id in self._retries:
+            return
+        
+        def resubmit():
+            self._retries.pop(message_id, None)
+            self.submit(message_id)
+        
+        self._retries[message_id] = asyncio.get_running_loop().call_later(delay, resubmit)
+
+    async def wait_for(self, message_id: int, timeout: float) -> Optional[MessageRow]:
+        """Дождаться завершения модерации сообщения (не дольше timeout секунд).
+
+        Возвращает сообщение, прочитанное после ожидания; по таймауту оно
+        может быть ещё 'pending'. Ожидание регистрируется до чтения статуса,
+        поэтому завершение модерации между чтением и ожиданием не теряется.
+        """
+        event = asyncio.Event()
+        waiters = self._events.setdefault(message_id, set())
+        waiters.add(event)
+        try:
+            message = await self.database.get_message(message_id)
+            if message is None or message['status'] != 'pending':
+                return message
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return await self.database.get_message(message_id)
+        finally:
+            waiters.discard(event)
+            if not waiters and self._events.get(message_id) is waiters:
+                del self._events[message_id]
+
+    def notify(self, message_id: int):
+        """Разбудить ожидающих wait_for (в том числе после модерации в другом процессе)"""
+        for event in self._events.pop(message_id, ()):
+            event.set()
+
+    async def _worker(self):
+        while True:
+            message_id = await self._queue.get()
+            self._queued.discard(message_id)
+            try:
+                await self._process(message_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ModerationWorkerPool] Failed to process message {message_id}: {e}")
+            finally:
+                self.notify(message_id)
+                self._queue.task_done()
+
+    async def _process(self, message_id: int):
+        message = await self.database.get_message(message_id)
+        if message is None or message['status'] != 'pending':
+            return
+        if not await self.database.claim_moderation(message_id, self.owner, self.lease_timeout):
+            # Сообщение модерирует другой процесс
+            return
+
+        previous_messages = await self.database.get_last_approved_messages(limit=3)
+        result = await self.service.check_message(
+            name=message['name'],
+            age=message['age'],
+            gender=message['gender'],
+            mood=message['mood'],
+            previous_messages=previous_messages
+        )
+        if result['status'] == 'error':
+            # Сообщение остаётся 'pending'; пока OpenAI недоступен, не чаще
+            # одной попытки за retry_delay
+            delay = max(self.retry_delay, self.service.breaker.retry_in())
+            print(f"[ModerationWorkerPool] Message {message_id} will be retried in {delay:.0f}s")
+            self.submit_later(message_id, delay)
+            return
+        # Токены и стоимость хранятся в отдельных колонках, не в openai_response
+        usage = result.pop('usage', None)
+        await self.database.complete_moderation(
+            message_id,
+            message_text=result.get('response', ''),
+            openai_response=dumps_text(result),
+            status=result['status'],
+            usage=usage
+        )
+
+
+# Глобальный пул обработчиков
+moderation_workers = ModerationWorkerPool(
+    db,
+    openai_service,
+    workers=settings.moderation_workers,
+    retry_delay=settings.moderation_retry_delay,
+    lease_timeout=settings.moderation_lease_timeout
+)
@@ -1,19 +1,419 @@
 """Сервис для работы с OpenAI"""
 import json
 import asyncio
+import random
+import time
 import aiohttp
-from typing import Dict, Any, Optional, List
+from typing import Awaitable, Callable, Dict, Any, Optional, List, Tuple
+from budget import CHEAP, FULL, LOCAL, TokenBudget, combine_usage, token_budget
 from config import settings
+from coordination import SharedSlots
+from metrics import (
+    MODERATION_COALESCED,
+    MODERATION_ESCALATIONS,
+    MODERATION_VERDICTS,
+    OPENAI_IN_FLIGHT,
+    OPENAI_REQUEST_SECONDS,
+    OPENAI_REQUESTS,
+    OPENAI_RETRIES,
+    OPENAI_SEMAPHORE_WAIT_SECONDS,
+)
+from moderation_cache import ModerationCache, moderation_cache
+from moderation_rules import ModerationRules, RuleMatch, moderation_rules
+from phrase_pool import PhrasePool, phrase_pool, render_phrase
+from prompts import (
+    PROKHOR_TEMPLATE_BUCKETS,
+    PromptTemplate,
+    build_phrase_request,
+    build_user_section,
+    cascade_template,
+    moderation_template,
+    name_moderation_template,
+    phrase_generation_template,
+)
+from resilience import (
+    AdaptiveLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    RetryPolicy,
+    UpstreamError,
+    parse_retry_after,
+)
+from routing import FAST, LARGE, ModelTier, escalation_reason, fast_tier_from_settings
+
+
+# Ответ при отклонении, как в системном промпте
+RESTRICTED_RESPONSE = "Сообщение не прошло модерацию."
+
+
+def normalize_profile(
+    age: Optional[int],
+    gender: Optional[str],
+    mood: Optional[str]
+) -> Tuple[str, str, str]:
+    """Привести пол, возраст и настроение к значениям из промпта"""
+    gender_normalized = (gender or "").strip().lower()
+    if gender_normalized in {"женщина", "female", "woman", "girl", "f"}:
+        gender_value = "женщина"
+    elif gender_normalized in {"мужчина", "male", "man", "boy", "m"}:
+        gender_value = "мужчина"
+    else:
+        gender_value = "не указан"
+
+    age_value = str(age) if age is not None else "не указан"
+
+    mood_normalized = (mood or "").strip().lower()
+    if mood_normalized in {"плохое", "плохой", "bad", "sad", "низкое"}:
+        mood_value = "плохое"
+    elif mood_normalized in {"среднее", "нормальное", "normal", "okay", "ok"}:
+        mood_value = "среднее"
+    elif mood_normalized in {"отличное", "хорошее", "great", "excellent", "perfect"}:
+        mood_value = "отличное"
+    else:
+        mood_value = "не указано"
+
+    return gender_value, age_value, mood_value
+
+
+def _parse_verdict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Вердикт полной модерации из ответа chat/completions"""
+    # Структура: data['choices'][0]['message']['content']
+    try:
+        content = data['choices'][0]['message']['content']
+        result = json.loads(content)
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        # Логируем структуру ответа для отладки
+        print(f"Error parsing OpenAI response: {e}")
+        print(f"Response structure: {data}")
+        raise Exception(f"Failed to parse OpenAI response: {e}. Response: {data}")
+    
+    # Валидация структуры ответа
+    if result is None or not isinstance(result, dict):
+        raise ValueError(f"Invalid response format from OpenAI. Response: {data}")
+    
+    if 'response' not in result or 'status' not in result:
+        raise ValueError(f"Invalid response structure from OpenAI. Missing 'response' or 'status'. Got: {result}")
+    
+    if result['status'] not in ['ok', 'restricted']:
+        raise ValueError(f"Invalid status: {result['status']}. Expected 'ok' or 'restricted'")
+    return result
+
+
+def _parse_name_verdict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Вердикт проверки только имени"""
+    try:
+        status = json.loads(data['choices'][0]['message']['content'])['status']
+    except (KeyError, IndexError, TypeError, json.JSONDecodeError) as e:
+        raise Exception(f"Failed to parse OpenAI response: {e}. Response: {data}")
+    if status not in ('ok', 'restricted'):
+        raise ValueError(f"Invalid status: {status}. Expected 'ok' or 'restricted'")
+    return {'status': status}
 
 
 class OpenAIService:
     """Сервис для проверки сообщений через OpenAI"""
     
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://api.openai.com/v1",
+        max_concurrency: int = 10,
+        total_timeout: float = 60.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        template: PromptTemplate = moderation_template,
+        cache: Optional[ModerationCache] = None,
+        rules: Optional[ModerationRules] = None,
+        deadline: float = 45.0,
+        retry: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        min_concurrency: int = 1,
+        latency_target: float = 15.0,
+        phrases: Optional[PhrasePool] = None,
+        name_check: str = "openai",
+        shared_slots: Optional[SharedSlots] = None,
+        budget: Optional[TokenBudget] = None,
+        model: Optional[str] = None,
+        fast_tier: Optional[ModelTier] = None
+    ):
         self.api_key = api_key
-        self.base_url = "https://api.openai.com/v1"
-        # Семафор для ограничения параллельных запросов (можно настроить)
-        self.semaphore = asyncio.Semaphore(10)  # Максимум 10 параллельных запросов
+        # Основная модель; None — модель из шаблона
+        self.template = template.with_model(model) if model else template
+        self.cache = cache
+        self.rules = rules
+        # Пул готовых фраз: OpenAI проверяет только имя (или не вызывается вовсе
+        # при name_check = "rules"), текст берётся из пула
+        if name_check not in ("openai", "rules"):
+            raise ValueError(f"Invalid name_check mode: {name_check}")
+        self.phrases = phrases
+        self.name_check = name_check
+        self.name_template = name_moderation_template.with_model(self.template.model)
+        self.phrase_template = phrase_generation_template.with_model(self.template.model)
+        # Учёт токенов; при превышении бюджета — дешёвая модель или без OpenAI
+        self.budget = budget
+        if budget is not None:
+            self.cheap_template = self.template.with_model(budget.cheap_model)
+            self.cheap_name_template = self.name_template.with_model(budget.cheap_model)
+        self.base_url = base_url.rstrip("/")
+        # Каскад: быстрая модель первой, основная — при сомнении
+        self.large = ModelTier(LARGE, self.template.model, self.base_url, api_key, deadline)
+        self.fast = fast_tier
+        if fast_tier is not None:
+            self.fast_template = cascade_template(self.template, fast_tier.model)
+            self.fast_name_template = cascade_template(self.name_template, fast_tier.model)
+        self.max_concurrency = max_concurrency
+        # Бюджет времени на одну проверку вместе с повторами, сек
+        self.deadline = deadline
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        if fast_tier is not None and fast_tier.breaker is None and fast_tier.base_url != self.base_url:
+            # Сбои отдельного сервера быстрой модели не отключают основную
+            fast_tier.breaker = CircuitBreaker(self.breaker.failure_threshold, self.breaker.reset_timeout)
+        # Лимит параллельных запросов снижается при 429 и медленных ответах
+        # и постепенно растёт обратно до max_concurrency
+        self.limiter = AdaptiveLimiter(
+            initial=max_concurrency,
+            min_limit=min_concurrency,
+            max_limit=max_concurrency,
+            latency_target=latency_target
+        )
+        # Общий лимит для всех процессов API (API_WORKERS > 1)
+        self.shared_slots = shared_slots
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout,
+            connect=connect_timeout,
+            sock_read=read_timeout
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        # Ключ нормализованных полей → выполняющаяся проверка
+        self._in_flight: Dict[str, asyncio.Task] = {}
+    
+    async def start(self):
+        """Создать общую HTTP-сессию с пулом keep-alive соединений"""
+        async with self._session_lock:
+            if self._session is not None and not self._session.closed:
+                return
+            connector = aiohttp.TCPConnector(
+                # Соединений не больше, чем параллельных запросов
+                limit=self.max_concurrency,
+                limit_per_host=self.max_concurrency,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+                enable_cleanup_closed=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                # Authorization добавляется к запросу: у уровней каскада свои ключи
+                headers={"Content-Type": "application/json"}
+            )
+    
+    async def close(self):
+        """Закрыть HTTP-сессию"""
+        async with self._session_lock:
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Получить общую сессию, создав её при первом обращении"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    async def _post_completion(
+        self,
+        body: bytes,
+        timeout: float,
+        model: str,
+        tier: Optional[ModelTier] = None
+    ) -> Dict[str, Any]:
+        """Отправить запрос к /chat/completions и вернуть разобранный ответ.
+
+        tier — уровень каскада со своим адресом и ключом (по умолчанию
+        основной). Любая неудача поднимает UpstreamError; повторять или
+        нет, решает _request_completion.
+        """
+        tier = tier or self.large
+        session = await self._get_session()
+        status = "error"
+        started = time.perf_counter()
+        # Таймаут попытки не выходит за оставшийся бюджет проверки
+        request_timeout = aiohttp.ClientTimeout(
+            total=min(self.timeout.total, timeout),
+            connect=self.timeout.connect,
+            sock_read=self.timeout.sock_read
+        )
+        OPENAI_IN_FLIGHT.inc()
+        try:
+            async with session.post(
+                f"{tier.base_url}/chat/completions",
+                data=body,
+                headers={"Authorization": f"Bearer {tier.api_key}"} if tier.api_key else None,
+                timeout=request_timeout
+            ) as response:
+                status = response.status
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                response_text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(f"OpenAI request failed: {type(e).__name__}: {e}") from e
+        finally:
+            OPENAI_IN_FLIGHT.dec()
+            OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - started, model=model, status=status)
+            OPENAI_REQUESTS.inc(model=model, status=status)
+        
+        if status != 200:
+            # Логируем ошибку для отладки
+            print(f"OpenAI API error: Status {status}")
+            print(f"Response: {response_text}")
+            raise UpstreamError(
+                f"OpenAI API error: {status} - {response_text}",
+                status=status,
+                retry_after=retry_after
+            )
+        
+        try:
+            data = json.loads(response_text)
+        except json.JSONDecodeError:
+            # Если ответ не JSON (например, страница ошибки прокси), логируем и повторяем
+            print(f"OpenAI API returned non-JSON response: {response_text}")
+            raise UpstreamError(f"OpenAI API returned non-JSON response: {response_text}")
+        
+        if self.budget is not None:
+            self.budget.record(model, data)
+        return data
+    
+    async def _request_completion(
+        self,
+        body: bytes,
+        deadline: float,
+        template: Optional[PromptTemplate] = None,
+        tier: Optional[ModelTier] = None,
+        max_attempts: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Запрос с повторами, автоматом отключения и адаптивным лимитом.
+
+        deadline — момент time.monotonic(), после которого попыток больше не будет.
+        tier — уровень каскада (по умолчанию основной); его автомат отключения,
+        если он свой, иначе общий.
+        """
+        model = (template or self.template).model
+        tier = tier or self.large
+        breaker = tier.breaker or self.breaker
+        max_attempts = max_attempts or self.retry.max_attempts
+        attempt = 0
+        while True:
+            attempt += 1
+            wait_started = time.perf_counter()
+            await self.limiter.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            slot = None
+            try:
+                if self.shared_slots is not None:
+                    slot = await self.shared_slots.acquire(timeout=max(0.0, deadline - time.monotonic()))
+                OPENAI_SEMAPHORE_WAIT_SECONDS.observe(time.perf_counter() - wait_started)
+                probe = breaker.state == CircuitBreaker.HALF_OPEN
+                if not breaker.allow():
+                    raise CircuitOpenError(
+                        f"OpenAI circuit is open, retry in {breaker.retry_in():.1f}s"
+                    )
+                started = time.monotonic()
+                try:
+                    data = await self._post_completion(body, timeout=deadline - started, model=model, tier=tier)
+                except UpstreamError as e:
+                    error = e
+                    if error.retryable:
+                        breaker.record_failure()
+                    else:
+                        # Сервис отвечает, ошибка в самом запросе
+                        breaker.record_success()
+                    if error.status == 429:
+                        self.limiter.on_overload()
+                else:
+                    breaker.record_success()
+                    self.limiter.on_success(time.monotonic() - started)
+                    return data
+                finally:
+                    if probe:
+                        # Отмена или ошибка вне UpstreamError не должны оставить
+                        # автомат в ожидании пробного запроса
+                        breaker.release_probe()
+            finally:
+                if slot is not None:
+                    self.shared_slots.release(slot)
+                await self.limiter.release()
+            
+            if not error.retryable or attempt >= max_attempts:
+                raise error
+            delay = self.retry.delay(attempt, error.retry_after)
+            if time.monotonic() + delay >= deadline:
+                raise DeadlineExceeded(f"Deadline exceeded after {attempt} attempts: {error}")
+            OPENAI_RETRIES.inc(model=model)
+            print(f"[OpenAIService] Retry {attempt} in {delay:.2f}s: {error}")
+            await asyncio.sleep(delay)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limiter": self.limiter.stats(),
+            "breaker": self.breaker.stats(),
+            "shared_slots": self.shared_slots.stats() if self.shared_slots is not None else None,
+            "phrase_pool": self.phrases.stats() if self.phrases is not None else None,
+            "budget": self.budget.stats() if self.budget is not None else None,
+            "tiers": {
+                tier.name: tier.stats() for tier in (self.fast, self.large) if tier is not None
+            },
+        }
+
+    def _usage(self, template: PromptTemplate, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self.budget.usage(template.model, data) if self.budget is not None else None
+    
+    async def _fast_verdict(
+        self,
+        template: PromptTemplate,
+        user_content: str,
+        require_response: bool
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Спросить быструю модель каскада.
+
+        Возвращает (вердикт, usage); вердикт None — проверку нужно
+        передать основной модели. Один запрос без повторов: при сбое
+        дешевле сразу спросить основную модель. Запрос проходит тот же
+        лимит параллельности и автомат отключения, что и основной;
+        ожидание слота входит в таймаут уровня.
+        """
+        started = time.perf_counter()
+        outcome = "error"
+        usage = None
+        try:
+            data = await self._request_completion(
+                template.render(user_content),
+                time.monotonic() + self.fast.timeout,
+                template,
+                tier=self.fast,
+                max_attempts=1
+            )
+            usage = self._usage(template, data)
+            try:
+                result = json.loads(data['choices'][0]['message']['content'])
+                status = result.get('status')
+            except (KeyError, IndexError, TypeError, AttributeError, json.JSONDecodeError):
+                result, status = None, None
+            if require_response and status == 'ok' and not (
+                isinstance(result.get('response'), str) and result['response'].strip()
+            ):
+                status = None
+            reason = escalation_reason(self.fast, status)
+            outcome = status if status in ('ok', 'restricted', 'uncertain') else "invalid"
+            if reason is None:
+                return {'response': result.get('response', ''), 'status': status}, usage
+        except (UpstreamError, CircuitOpenError, DeadlineExceeded) as e:
+            print(f"[OpenAIService] Fast model failed: {e}")
+            reason = "error"
+        finally:
+            self.fast.record(outcome, time.perf_counter() - started, usage)
+        MODERATION_ESCALATIONS.inc(reason=reason)
+        return None, usage
     
     async def check_message(
         self,
@@ -29,239 +429,289 @@ class OpenAIService:
         Returns:
             {
                 'response': str,  # Ответ от OpenAI
-                'status': str     # 'ok' или 'restricted'
+                'status': str     # 'ok', 'restricted' или 'error' (проверка не удалась)
             }
         """
-        async with self.semaphore:  # Ограничение параллельных запросов
-            try:
-                gender_normalized = (gender or "").strip().lower()
-                if gender_normalized in {"женщина", "female", "woman", "girl", "f"}:
-                    gender_value = "женщина"
-                elif gender_normalized in {"мужчина", "male", "man", "boy", "m"}:
-                    gender_value = "мужчина"
-                else:
-                    gender_value = "не указан"
-
-                age_value = str(age) if age is not None else "не указан"
-
-                mood_normalized = (mood or "").strip().lower()
-                if mood_normalized in {"плохое", "плохой", "bad", "sad", "низкое"}:
-                    mood_value = "плохое"
-                elif mood_normalized in {"среднее", "нормальное", "normal", "okay", "ok"}:
-                    mood_value = "среднее"
-                elif mood_normalized in {"отличное", "хорошее", "great", "excellent", "perfect"}:
-                    mood_value = "отличное"
-                else:
-                    mood_value = "не указано"
-
-                # Формируем запрос к OpenAI API
-                # Используем стандартный эндпоинт chat/completions с JSON schema
-                previous_messages_list = previous_messages or []
-                if previous_messages_list:
-                    previous_messages_text = "\n".join(
-                        f"{idx + 1}. {msg}" for idx, msg in enumerate(previous_messages_list)
-                    )
-                else:
-                    previous_messages_text = "Сообщения отсутствуют."
-                print(f"[OpenAIService] Previous approved messages:\n{previous_messages_text}")
-
-                if previous_messages_list:
-                    previous_messages_for_user = "\n".join(previous_messages_list)
-                    previous_messages_user_section = (
-                        f"\nПредыдущие сообщения для справки (не повторяй их):\n{previous_messages_for_user}"
-                    )
-                else:
-                    previous_messages_user_section = ""
+        # Локальные правила: очевидные нарушения отклоняются без запроса к OpenAI,
+        # слабые совпадения (имена, фамилии) проверяет модель
+        match = self.rules.match(name, gender, mood) if self.rules is not None else None
+        if match is not None and not match.weak:
+            return self._rule_verdict(match)
+        
+        gender_value, age_value, mood_value = normalize_profile(age, gender, mood)
+        
+        # Бюджет исчерпан: без запросов к OpenAI, близок к пределу — дешёвая модель
+        mode = self.budget.mode() if self.budget is not None else FULL
+        if mode == LOCAL:
+            # Проверить слабое совпадение некому
+            if match is not None:
+                return self._rule_verdict(match)
+            return self._local_verdict(name, gender_value, mood_value)
+        template = self.cheap_template if mode == CHEAP else self.template
+        name_template = self.cheap_name_template if mode == CHEAP else self.name_template
+        
+        # Ключ по нормализованным полям: общий для кэша и объединения запросов
+        key = ModerationCache.make_key(
+            template.version, name, gender_value, age_value, mood_value
+        )
+        
+        # Без проверки имени моделью слабое совпадение уходит на полную проверку
+        if self.phrases is not None and self.phrases.loaded and (match is None or self.name_check == "openai"):
+            result = await self._check_with_pool(name, gender_value, mood_value, name_template)
+            if result is not None:
+                return result
+        
+        # Кэш вердиктов: отклонение возвращаем сразу, одобренный текст —
+        # только если он не совпадает с недавно показанными
+        if self.cache is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                if cached['status'] == 'restricted' or cached['response'] not in (previous_messages or []):
+                    MODERATION_VERDICTS.inc(source="cache", status=cached['status'])
+                    return cached
+        
+        return await self._single_flight(key, lambda: self._moderate(
+            name, gender_value, age_value, mood_value, previous_messages, key, template
+        ))
+    
+    def _rule_verdict(self, match: RuleMatch) -> Dict[str, Any]:
+        """Отклонение по локальному правилу"""
+        print(f"[OpenAIService] Rejected by local rule '{match.rule_id}'")
+        MODERATION_VERDICTS.inc(source="rules", status="restricted")
+        return {
+            'response': RESTRICTED_RESPONSE,
+            'status': 'restricted',
+            'rule': match.rule_id
+        }
+    
+    def _local_verdict(self, name: str, gender_value: str, mood_value: str) -> Dict[str, Any]:
+        """Одобрение по локальным правилам с готовой фразой (бюджет исчерпан)"""
+        phrase = None
+        if self.phrases is not None and self.phrases.loaded:
+            phrase = self.phrases.pick(name, gender_value, mood_value)
+        MODERATION_VERDICTS.inc(source="budget", status="ok")
+        if phrase is not None:
+            return {'response': phrase['text'], 'status': 'ok', 'phrase_id': phrase['id'], 'budget': LOCAL}
+        template = random.choice(PROKHOR_TEMPLATE_BUCKETS[PhrasePool.bucket_for(gender_value, mood_value)])
+        return {'response': render_phrase(template, name), 'status': 'ok', 'budget': LOCAL}
+    
+    async def _single_flight(self, key: str, factory: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Одинаковые одновременные проверки (двойное нажатие, повтор запроса)
+        ждут один общий запрос к OpenAI. Запрос выполняется отдельной
+        задачей, чтобы отмена первого вызывающего не отменяла остальных.
+        """
+        task = self._in_flight.get(key)
+        coalesced = task is not None
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            MODERATION_COALESCED.inc()
+        result = dict(await asyncio.shield(task))
+        if coalesced:
+            # Запрос уже оплачен первым вызывающим
+            result.pop('usage', None)
+        return result
+    
+    async def _check_with_pool(
+        self,
+        name: str,
+        gender_value: str,
+        mood_value: str,
+        name_template: PromptTemplate
+    ) -> Optional[Dict[str, Any]]:
+        """Проверить только имя и взять готовую фразу из пула.
 
-                payload = {
-                    "model": "gpt-4o",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": (
-                                f"Предыдущие одобренные сообщения:\n{previous_messages_text}\n\n"
-                                "Ты — модератор платформы творческого контента. "
-                                "Отвечай строго в формате JSON с полями \"status\" и \"response\".\n\n"
-                                "Правила модерации:\n"
-                                "1. СТРОГАЯ ПРОВЕРКА ИМЕНИ (name): Имя пользователя проверяется в первую очередь и наиболее строго.\n"
-                                "   Если имя содержит ЛЮБЫЕ из следующих элементов — сообщение НЕМЕДЛЕННО отклоняется:\n"
-                                "   - Мат, ругательства, оскорбления\n"
-                                "   - Политические темы, лозунги, призывы\n"
-                                "   - Упоминания войны, военных действий, конфликтов\n"
-                                "   - Упоминания стран: Украина, Россия, Беларусь и т.д.\n"
-                                "   - Упоминания регионов: Крым, Донбасс, ЛНР, ДНР и т.д.\n"
-                                "   - Тема СВО (специальная военная операция)\n"
-                                "   - Упоминания солдат, военных, армии\n"
-                                "   - Территориальная принадлежность, националистические лозунги\n"
-                                "   - Политические призывы: \"Слава Украине!\", \"Русские орки\", \"Z\", \"V\" и т.д.\n"
-                                "   - Любые оскорбительные или провокационные фразы, связанные с войной или политикой\n"
-                                "\n"
-                                "   ПРИМЕРЫ ЗАПРЕЩЕННЫХ ИМЕН (должны быть отклонены):\n"
-                                "   - \"Слава Украине!\"\n"
-                                "   - \"Русские орки\"\n"
-                                "   - \"Иван Украина\"\n"
-                                "   - \"Мария Крым\"\n"
-                                "   - \"Солдат Петр\"\n"
-                                "   - \"Z-воин\"\n"
-                                "   - Любые имена с политическими или военными отсылками\n"
-                                "\n"
-                                "2. Если пол или возраст содержат запрещенный контент (мат, политика, война и т.д.) — сообщение также отклоняется.\n"
-                                "\n"
-                                "3. Если имя, пол или возраст прошли проверку, но содержат запрещенный контент — сообщение отклоняется.\n"
-                                "\n"
-                                "При отклонении ответ:\n"
-                                "{\n"
-                                "  \"status\": \"restricted\",\n"
-                                "  \"response\": \"Сообщение не прошло модерацию.\"\n"
-                                "}\n"
-                                "\n"
-                                "4. Если нарушений нет — сообщение одобряется, статус \"ok\". "
-                                "В поле \"response\" сгенерируй обращение от Прохора согласно списку шаблонов.\n"
-                                "Используй пол и настроение. Если пол или настроение не распознаны, выбери любой "
-                                "подходящий шаблон и подстрой фразу под указанные данные. Важно! Немного измени фразу шаблона, но чтобы она была также коротка, была такой же темы, просто по-дргому сформулирована.\n"
-                                "Важно! Не повторяй тексты предыдущих сообщений, подбирай свежую формулировку.\n\n"
-                                "Шаблоны ответов:\n"
-                                "### Женщины — плохое настроение\n"
-                                "- [Имя], выключи тоску — у неё плохой вкус.\n"
-                                "- [Имя], выдохни и поправь корону.\n"
-                                "- [Имя], оформи отпуск — душе нужны каникулы.\n"
-                                "- [Имя], сегодня просто живи красиво — без объяснений.\n"
-                                "- [Имя], улыбнись — чудеса уже на подходе.\n\n"
-                                "### Женщины — среднее настроение\n"
-                                "- [Имя], запланируй отпуск — и забудь пароль от почты.\n"
-                                "- [Имя], не спеши, звезда всегда появляется эффектно.\n"
-                                "- [Имя], сделай себе комплимент — он будет точнее всех.\n"
-                                "- [Имя], живи с изяществом, как ты умеешь.\n"
-                                "- [Имя], день серый? Надень настроение поярче.\n"
-                                "- [Имя], просто свети, даже без причин.\n\n"
-                                "### Женщины — отличное настроение\n"
-                                "- [Имя], ты сегодня — праздник без повода.\n"
-                                "- [Имя], даже солнце взяло твой автограф.\n"
-                                "- [Имя], не скромничай — скромность скучна.\n"
-                                "- [Имя], держи темп — публика не дышит.\n"
-                                "- [Имя], блеск зафиксирован, не выключай.\n"
-                                "- [Имя], настроение божественное — оставь так.\n\n"
-                                "### Мужчины — плохое настроение\n"
-                                "- [Имя], отдохни — подвиги подождут.\n"
-                                "- [Имя], грусть тебе не идёт — верни улыбку.\n"
-                                "- [Имя], всё пройдёт, даже дедлайн.\n"
-                                "- [Имя], сними тревогу и добавь уверенности.\n"
-                                "- [Имя], даже супергероям нужно полежать.\n\n"
-                                "### Мужчины — среднее настроение\n"
-                                "- [Имя], живи красиво, даже без повода.\n"
-                                "- [Имя], добавь харизмы — день станет лучше.\n"
-                                "- [Имя], улыбнись, жизнь наблюдает.\n"
-                                "- [Имя], меньше дел, больше блеска.\n"
-                                "- [Имя], добавь света — миру понравится.\n\n"
-                                "### Мужчины — отличное настроение\n"
-                                "- [Имя], ты сегодня — премьера, без дублей.\n"
-                                "- [Имя], блеск на максимуме — не ослепи зал.\n"
-                                "- [Имя], не скромничай — это не твой жанр.\n"
-                                "- [Имя], ты великолепен, без комментариев.\n\n"
-                                "Всегда подставляй имя пользователя на место [Имя]. "
-                                "Если пол или настроение не указаны или не распознаны, выбери любой подходящий шаблон."
-                            )
-                        },
-                        {
-                            "role": "user",
-                            "content": (
-                                f"Имя пользователя: {name}\n"
-                                f"Пол: {gender_value}\n"
-                                f"Возраст: {age_value}\n"
-                                f"Настроение: {mood_value}"
-                                f"{previous_messages_user_section}"
-                            )
-                        }
-                    ],
-                    "response_format": {
-                        "type": "json_schema",
-                        "json_schema": {
-                            "name": "moderation_result",
-                            "schema": {
-                                "type": "object",
-                                "properties": {
-                                    "response": {
-                                        "type": "string",
-                                        "description": "Brief explanation of the moderation decision"
-                                    },
-                                    "status": {
-                                        "type": "string",
-                                        "enum": ["ok", "restricted"],
-                                        "description": "Moderation status: 'ok' if message is approved, 'restricted' if rejected"
-                                    }
-                                },
-                                "required": ["response", "status"],
-                                "additionalProperties": False
-                            },
-                            "strict": True
-                        }
-                    }
-                }
-                
-                # Отправляем запрос к OpenAI API
-                async with aiohttp.ClientSession() as session:
-                    headers = {
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                    
-                    async with session.post(
-                        f"{self.base_url}/chat/completions",
-                        headers=headers,
-                        json=payload
-                    ) as response:
-                        response_text = await response.text()
-                        
-                        if response.status != 200:
-                            # Логируем ошибку для отладки
-                            print(f"OpenAI API error: Status {response.status}")
-                            print(f"Response: {response_text}")
-                            raise Exception(f"OpenAI API error: {response.status} - {response_text}")
-                        
-                        try:
-                            data = await response.json()
-                        except json.JSONDecodeError:
-                            # Если ответ не JSON, логируем и возвращаем ошибку
-                            print(f"OpenAI API returned non-JSON response: {response_text}")
-                            raise Exception(f"OpenAI API returned non-JSON response: {response_text}")
-                        
-                        # Извлекаем результат из стандартного ответа chat/completions
-                        # Структура: data['choices'][0]['message']['content']
-                        try:
-                            content = data['choices'][0]['message']['content']
-                            result = json.loads(content)
-                        except (KeyError, IndexError, json.JSONDecodeError) as e:
-                            # Логируем структуру ответа для отладки
-                            print(f"Error parsing OpenAI response: {e}")
-                            print(f"Response structure: {data}")
-                            raise Exception(f"Failed to parse OpenAI response: {e}. Response: {data}")
-                        
-                        # Валидация структуры ответа
-                        if result is None or not isinstance(result, dict):
-                            raise ValueError(f"Invalid response format from OpenAI. Response: {data}")
-                        
-                        if 'response' not in result or 'status' not in result:
-                            raise ValueError(f"Invalid response structure from OpenAI. Missing 'response' or 'status'. Got: {result}")
-                        
-                        if result['status'] not in ['ok', 'restricted']:
-                            raise ValueError(f"Invalid status: {result['status']}. Expected 'ok' or 'restricted'")
-                        
-                        return result
-                
-            except json.JSONDecodeError as e:
-                # Если OpenAI вернул не JSON, возвращаем ошибку
-                return {
-                    'response': f'Ошибка парсинга ответа: {str(e)}',
-                    'status': 'restricted'
-                }
-            except Exception as e:
-                # Обработка других ошибок
-                return {
-                    'response': f'Ошибка при проверке сообщения: {str(e)}',
-                    'status': 'restricted'
-                }
+        None — в нужной группе пула нет фраз, нужна полная проверка.
+        """
+        verdict = None
+        if self.name_check == "openai":
+            key = ModerationCache.make_key(name_template.version, name, "", "", "")
+            verdict = await self.cache.get(key) if self.cache is not None else None
+            if verdict is not None:
+                MODERATION_VERDICTS.inc(source="cache", status=verdict['status'])
+            else:
+                verdict = await self._single_flight(key, lambda: self._moderate_name(name, key, name_template))
+            if verdict['status'] != 'ok':
+                return verdict
+        
+        phrase = self.phrases.pick(name, gender_value, mood_value)
+        if phrase is None:
+            return None
+        MODERATION_VERDICTS.inc(source="pool", status="ok")
+        result = {
+            'response': phrase['text'],
+            'status': 'ok',
+            'phrase_id': phrase['id']
+        }
+        if verdict is not None and verdict.get('usage') is not None:
+            result['usage'] = verdict['usage']
+        return result
+    
+    async def _ask_large(
+        self,
+        body: bytes,
+        deadline: float,
+        template: PromptTemplate,
+        parse: Callable[[Dict[str, Any]], Dict[str, Any]]
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """Запрос к основной модели с повторами; (вердикт, usage)"""
+        started = time.perf_counter()
+        try:
+            data = await self._request_completion(body, deadline, template)
+            result = parse(data)
+        except Exception:
+            self.large.record("error", time.perf_counter() - started)
+            raise
+        usage = self._usage(template, data)
+        self.large.record(result['status'], time.perf_counter() - started, usage)
+        return result, usage
+    
+    async def _moderate_name(self, name: str, cache_key: str, template: PromptTemplate) -> Dict[str, Any]:
+        """Проверка только имени через OpenAI; сбой — статус 'error'"""
+        deadline = time.monotonic() + self.deadline
+        try:
+            user_content = f"Имя пользователя: {name}"
+            verdict, usage, tier = None, None, LARGE
+            if self.fast is not None:
+                verdict, usage = await self._fast_verdict(self.fast_name_template, user_content, require_response=False)
+                tier = FAST
+            if verdict is None:
+                verdict, large_usage = await self._ask_large(
+                    template.render(user_content), deadline, template, _parse_name_verdict
+                )
+                usage, tier = combine_usage(usage, large_usage), LARGE
+            status = verdict['status']
+            
+            result = {
+                'response': RESTRICTED_RESPONSE if status == 'restricted' else '',
+                'status': status
+            }
+            if self.cache is not None:
+                await self.cache.put(cache_key, result)
+            MODERATION_VERDICTS.inc(source="openai", status=status)
+            result['usage'] = usage
+            if self.fast is not None:
+                result['tier'] = tier
+            return result
+        except Exception as e:
+            print(f"[OpenAIService] Name moderation failed: {e}")
+            MODERATION_VERDICTS.inc(source="error", status="error")
+            return {
+                'response': f'Ошибка при проверке сообщения: {str(e)}',
+                'status': 'error'
+            }
+    
+    async def generate_phrases(
+        self,
+        gender_value: str,
+        mood_value: str,
+        count: int,
+        examples: List[str]
+    ) -> List[str]:
+        """Сгенерировать вариации фраз Прохора для пула"""
+        if self.budget is not None and self.budget.mode() != FULL:
+            # Пул пополняется позже, когда расходы снизятся
+            raise Exception("OpenAI budget limit reached, phrase generation paused")
+        body = self.phrase_template.render(
+            build_phrase_request(gender_value, mood_value, count, examples)
+        )
+        data = await self._request_completion(
+            body, time.monotonic() + self.deadline, self.phrase_template
+        )
+        try:
+            phrases = json.loads(data['choices'][0]['message']['content'])['phrases']
+        except (KeyError, IndexError, TypeError, json.JSONDecodeError) as e:
+            raise Exception(f"Failed to parse OpenAI response: {e}. Response: {data}")
+        return [phrase for phrase in phrases if isinstance(phrase, str)]
+    
+    async def _moderate(
+        self,
+        name: str,
+        gender_value: str,
+        age_value: str,
+        mood_value: str,
+        previous_messages: Optional[List[str]],
+        cache_key: str,
+        template: PromptTemplate
+    ) -> Dict[str, Any]:
+        """Проверка через OpenAI; сбой возвращается как статус 'error'"""
+        deadline = time.monotonic() + self.deadline
+        try:
+            # Формируем запрос к OpenAI API
+            # Статическая часть (правила, шаблоны, схема) собрана заранее,
+            # подставляется только секция пользователя; недавние сообщения
+            # передаются один раз, в ней же
+            user_section = build_user_section(
+                name=name,
+                gender_value=gender_value,
+                age_value=age_value,
+                mood_value=mood_value,
+                previous_messages=previous_messages or []
+            )
+            
+            # Сначала быстрая модель (если каскад включён), при сомнении —
+            # основная через общую сессию
+            result, usage, tier = None, None, LARGE
+            if self.fast is not None:
+                result, usage = await self._fast_verdict(self.fast_template, user_section, require_response=True)
+                tier = FAST
+            if result is None:
+                result, large_usage = await self._ask_large(
+                    template.render(user_section), deadline, template, _parse_verdict
+                )
+                usage, tier = combine_usage(usage, large_usage), LARGE
+            
+            if self.cache is not None:
+                await self.cache.put(cache_key, result)
+            MODERATION_VERDICTS.inc(source="openai", status=result['status'])
+            result['usage'] = usage
+            if self.fast is not None:
+                result['tier'] = tier
+            return result
+        
+        except Exception as e:
+            # Сбой проверки — не отказ: сообщение остаётся на повторную модерацию
+            print(f"[OpenAIService] Moderation failed: {e}")
+            MODERATION_VERDICTS.inc(source="error", status="error")
+            return {
+                'response': f'Ошибка при проверке сообщения: {str(e)}',
+                'status': 'error'
+            }
 
 
 # Глобальный экземпляр сервиса
-openai_service = OpenAIService(settings.openai_api_key)
+openai_service = OpenAIService(
+    settings.openai_api_key,
+    base_url=settings.openai_base_url,
+    max_concurrency=settings.openai_max_concurrency,
+    total_timeout=settings.openai_timeout,
+    connect_timeout=settings.openai_connect_timeout,
+    read_timeout=settings.openai_read_timeout,
+    cache=moderation_cache if settings.moderation_cache_ttl > 0 else None,
+    rules=moderation_rules,
+    deadline=settings.openai_deadline,
+    retry=RetryPolicy(
+        max_attempts=settings.openai_max_attempts,
+        base_delay=settings.openai_retry_base_delay,
+        max_delay=settings.openai_retry_max_delay
+    ),
+    breaker=CircuitBreaker(
+        failure_threshold=settings.openai_breaker_threshold,
+        reset_timeout=settings.openai_breaker_reset
+    ),
+    min_concurrency=settings.openai_min_concurrency,
+    latency_target=settings.openai_latency_target,
+    phrases=phrase_pool if settings.phrase_pool_enabled else None,
+    name_check=settings.phrase_pool_name_check,
+    # Процессы делят один лимит OPENAI_MAX_CONCURRENCY (файлы блокировок рядом с БД)
+    shared_slots=(
+        SharedSlots(settings.database_path + ".openai", settings.openai_max_concurrency)
+        if settings.api_workers > 1 else None
+    ),
+    budget=token_budget,
+    model=settings.openai_model,
+    fast_tier=fast_tier_from_settings()
+)
 
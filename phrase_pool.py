@@ -0,0 +1,262 @@
+"""Пул заранее сгенерированных фраз Прохора.
+
+Вариации фраз с плейсхолдером [Имя] хранятся в таблице phrase_pool по
+группам (пол, настроение). На запрос выбирается давно не показанная
+фраза из памяти, а генерация новых вариаций идёт в фоне, когда свежих
+фраз в группе становится меньше порога.
+"""
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import settings
+from database import Database, db
+from prompts import PROKHOR_TEMPLATE_BUCKETS
+
+NAME_PLACEHOLDER = "[Имя]"
+GENDERS = ("женщина", "мужчина")
+MOODS = ("плохое", "среднее", "отличное")
+
+# (пол, настроение, сколько нужно, уже имеющиеся) → новые фразы
+PhraseGenerator = Callable[[str, str, int, List[str]], Awaitable[List[str]]]
+
+
+def render_phrase(template: str, name: str) -> str:
+    """Подставить имя вместо [Имя]"""
+    return template.replace(NAME_PLACEHOLDER, name)
+
+
+class PhrasePool:
+    """Пул фраз в памяти с фоновым пополнением.
+
+    Внутри группы фразы упорядочены от давно показанных к недавним;
+    выбирается случайная из нескольких самых давних, чтобы процессы
+    с одинаковым пулом не показывали фразы в одном порядке.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        low_watermark: int = 10,
+        batch_size: int = 10,
+        max_size: int = 200,
+        reuse_after: float = 3600.0,
+        refill_interval: float = 30.0,
+        seed_templates: Dict[Tuple[str, str], List[str]] = PROKHOR_TEMPLATE_BUCKETS
+    ):
+        self.database = database
+        self.low_watermark = low_watermark
+        self.batch_size = batch_size
+        self.max_size = max_size
+        # Фраза считается свежей, если её не показывали дольше reuse_after секунд
+        self.reuse_after = reuse_after
+        self.refill_interval = refill_interval
+        self.seed_templates = seed_templates
+        # (пол, настроение) → {id: [шаблон, время последнего показа]}
+        self._buckets: Dict[Tuple[str, str], "OrderedDict[int, list]"] = {
+            (gender, mood): OrderedDict() for gender in GENDERS for mood in MOODS
+        }
+        # Показы, ещё не записанные в базу: id → [время, количество]
+        self._uses: Dict[int, list] = {}
+        # Группа → когда можно повторить генерацию после ошибки
+        self._retry_at: Dict[Tuple[str, str], float] = {}
+        self._generator: Optional[PhraseGenerator] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.loaded = False
+        # Метрики
+        self.picks = 0
+        self.misses = 0
+        self.generated = 0
+        self.generation_errors = 0
+
+    @staticmethod
+    def bucket_for(gender_value: str, mood_value: str) -> Tuple[str, str]:
+        """Группа для нормализованных пола и настроения.
+
+        Нераспознанный пол — любая из групп, настроение — среднее.
+        """
+        gender = gender_value if gender_value in GENDERS else random.choice(GENDERS)
+        mood = mood_value if mood_value in MOODS else "среднее"
+        return gender, mood
+
+    async def load(self):
+        """Добавить исходные шаблоны (при первом запуске) и загрузить пул из базы"""
+        for (gender, mood), templates in self.seed_templates.items():
+            await self.database.add_phrases(gender, mood, templates, source="template")
+        for bucket in self._buckets.values():
+            bucket.clear()
+        phrases = await self.database.get_phrases()
+        phrases.sort(key=lambda p: p['last_used_at'] or 0)
+        for phrase in phrases:
+            bucket = self._buckets.get((phrase['gender'], phrase['mood']))
+            if bucket is not None:
+                bucket[phrase['id']] = [phrase['template'], phrase['last_used_at']]
+        self.loaded = True
+
+    def fresh_count(self, key: Tuple[str, str]) -> int:
+        """Сколько фраз группы не показывались дольше reuse_after"""
+        threshold = time.time() - self.reuse_after
+        count = 0
+        # Порядок от давно показанных: считаем до первой недавней
+        for _, last_used in self._buckets[key].values():
+            if last_used is not None and last_used > threshold:
+                break
+            count += 1
+        return count
+
+    def pick(self, name: str, gender_value: str, mood_value: str) -> Optional[Dict[str, Any]]:
+        """Выбрать давно не показанную фразу и подставить имя"""
+        key = self.bucket_for(gender_value, mood_value)
+        bucket = self._buckets[key]
+        if not bucket:
+            self.misses += 1
+            return None
+
+        phrase_id, entry = random.choice(list(islice(bucket.items(), 3)))
+        now = time.time()
+        entry[1] = now
+        bucket.move_to_end(phrase_id)
+        use = self._uses.setdefault(phrase_id, [now, 0])
+        use[0] = now
+        use[1] += 1
+        self.picks += 1
+
+        if self._wake is not None and self.fresh_count(key) < self.low_watermark:
+            self._wake.set()
+        return {
+            'id': phrase_id,
+            'template': entry[0],
+            'text': render_phrase(entry[0], name)
+        }
+
+    async def flush_uses(self):
+        """Записать накопленные показы в базу"""
+        if not self._uses:
+            return
+        uses, self._uses = self._uses, {}
+        await self.database.mark_phrases_used(
+            [(phrase_id, used_at, count) for phrase_id, (used_at, count) in uses.items()]
+        )
+
+    @staticmethod
+    def _clean(phrase: str) -> Optional[str]:
+        phrase = phrase.strip().lstrip("-•").strip()
+        if not phrase.startswith(NAME_PLACEHOLDER) or len(phrase) > 150:
+            return None
+        return phrase
+
+    async def sync(self):
+        """Добавить фразы, сгенерированные другим процессом"""
+        known = {phrase_id for bucket in self._buckets.values() for phrase_id in bucket}
+        for phrase in await self.database.get_phrases():
+            bucket = self._buckets.get((phrase['gender'], phrase['mood']))
+            if bucket is None or phrase['id'] in known:
+                continue
+            bucket[phrase['id']] = [phrase['template'], phrase['last_used_at']]
+            bucket.move_to_end(phrase['id'], last=False)
+
+    async def refill(self):
+        """Догенерировать фразы в группах, где свежих меньше порога.
+
+        Без генератора (процесс API не лидер) подхватываются фразы,
+        сгенерированные лидером.
+        """
+        if self._generator is None:
+            if any(self.fresh_count(key) < self.low_watermark for key in self._buckets):
+                await self.sync()
+            return
+        for key, bucket in self._buckets.items():
+            if self.fresh_count(key) >= self.low_watermark or len(bucket) >= self.max_size:
+                continue
+            if self._retry_at.get(key, 0) > time.monotonic():
+                continue
+            gender, mood = key
+            count = min(self.batch_size, self.max_size - len(bucket))
+            examples = [entry[0] for entry in bucket.values()]
+            try:
+                phrases = await self._generator(gender, mood, count, examples)
+            except Exception as e:
+                self.generation_errors += 1
+                self._retry_at[key] = time.monotonic() + self.refill_interval
+                print(f"[PhrasePool] Generation failed for {gender}/{mood}: {e}")
+                continue
+            cleaned = [p for p in (self._clean(p) for p in phrases) if p]
+            added = await self.database.add_phrases(gender, mood, cleaned, source="generated")
+            for phrase in added:
+                # Новые фразы ещё не показывались — в начало очереди
+                bucket[phrase['id']] = [phrase['template'], None]
+                bucket.move_to_end(phrase['id'], last=False)
+            self.generated += len(added)
+            if not added:
+                # Модель повторяет имеющиеся фразы — не спрашивать на каждый показ
+                self._retry_at[key] = time.monotonic() + self.refill_interval
+            print(f"[PhrasePool] Added {len(added)} phrases to {gender}/{mood}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush_uses()
+                await self.refill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[PhrasePool] Refill failed: {e}")
+
+    async def start(self, generator: Optional[PhraseGenerator] = None):
+        """Загрузить пул и запустить фоновое пополнение"""
+        await self.load()
+        self._generator = generator
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._wake.set()  # Сразу проверить пороги
+            self._task = asyncio.create_task(self._run(), name="phrase-pool-refill")
+
+    def set_generator(self, generator: PhraseGenerator):
+        """Включить генерацию в этом процессе (процесс стал лидером)"""
+        self._generator = generator
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self):
+        """Остановить пополнение и записать показы"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_uses()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "picks": self.picks,
+            "misses": self.misses,
+            "generated": self.generated,
+            "generation_errors": self.generation_errors,
+            "buckets": {
+                f"{gender}/{mood}": {"size": len(bucket), "fresh": self.fresh_count((gender, mood))}
+                for (gender, mood), bucket in self._buckets.items()
+            },
+        }
+
+
+# Глобальный пул фраз
+phrase_pool = PhrasePool(
+    db,
+    low_watermark=settings.phrase_pool_low_watermark,
+    batch_size=settings.phrase_pool_batch_size,
+    max_size=settings.phrase_pool_max_size,
+    reuse_after=settings.phrase_pool_reuse_after,
+    refill_interval=settings.phrase_pool_refill_interval
+)
@@ -0,0 +1,329 @@
+"""Шаблоны промптов для модерации.
+
+Статическая часть запроса (правила, каталог шаблонов Прохора и JSON-схема
+ответа) собирается один раз при импорте и хранится в виде готовых байтов.
+На каждый запрос подставляется только пользовательская секция, поэтому
+префикс запроса побайтово совпадает между вызовами и может попадать
+в кэш промптов на стороне провайдера.
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Увеличивайте при смысловых изменениях промпта; хэш текста добавляется автоматически
+PROMPT_REVISION = 2
+
+# Правила проверки имени: общие для полной модерации и проверки только имени
+NAME_RULES = (
+    "1. СТРОГАЯ ПРОВЕРКА ИМЕНИ (name): Имя пользователя проверяется в первую очередь и наиболее строго.\n"
+    "   Если имя содержит ЛЮБЫЕ из следующих элементов — сообщение НЕМЕДЛЕННО отклоняется:\n"
+    "   - Мат, ругательства, оскорбления\n"
+    "   - Политические темы, лозунги, призывы\n"
+    "   - Упоминания войны, военных действий, конфликтов\n"
+    "   - Упоминания стран: Украина, Россия, Беларусь и т.д.\n"
+    "   - Упоминания регионов: Крым, Донбасс, ЛНР, ДНР и т.д.\n"
+    "   - Тема СВО (специальная военная операция)\n"
+    "   - Упоминания солдат, военных, армии\n"
+    "   - Территориальная принадлежность, националистические лозунги\n"
+    "   - Политические призывы: \"Слава Украине!\", \"Русские орки\", \"Z\", \"V\" и т.д.\n"
+    "   - Любые оскорбительные или провокационные фразы, связанные с войной или политикой\n"
+    "\n"
+    "   ПРИМЕРЫ ЗАПРЕЩЕННЫХ ИМЕН (должны быть отклонены):\n"
+    "   - \"Слава Украине!\"\n"
+    "   - \"Русские орки\"\n"
+    "   - \"Иван Украина\"\n"
+    "   - \"Мария Крым\"\n"
+    "   - \"Солдат Петр\"\n"
+    "   - \"Z-воин\"\n"
+    "   - Любые имена с политическими или военными отсылками\n"
+)
+
+MODERATION_RULES = (
+    "Ты — модератор платформы творческого контента. "
+    "Отвечай строго в формате JSON с полями \"status\" и \"response\".\n\n"
+    "Правила модерации:\n"
+    + NAME_RULES
+    + "\n"
+    "2. Если пол или возраст содержат запрещенный контент (мат, политика, война и т.д.) — сообщение также отклоняется.\n"
+    "\n"
+    "3. Если имя, пол или возраст прошли проверку, но содержат запрещенный контент — сообщение отклоняется.\n"
+    "\n"
+    "При отклонении ответ:\n"
+    "{\n"
+    "  \"status\": \"restricted\",\n"
+    "  \"response\": \"Сообщение не прошло модерацию.\"\n"
+    "}\n"
+    "\n"
+    "4. Если нарушений нет — сообщение одобряется, статус \"ok\". "
+    "В поле \"response\" сгенерируй обращение от Прохора согласно списку шаблонов.\n"
+    "Используй пол и настроение. Если пол или настроение не распознаны, выбери любой "
+    "подходящий шаблон и подстрой фразу под указанные данные. Важно! Немного измени фразу шаблона, но чтобы она была также коротка, была такой же темы, просто по-дргому сформулирована.\n"
+    "Важно! Не повторяй тексты предыдущих сообщений, подбирай свежую формулировку.\n\n"
+)
+
+# Каталог шаблонов ответов Прохора (по полу и настроению)
+PROKHOR_TEMPLATES = (
+    "### Женщины — плохое настроение\n"
+    "- [Имя], выключи тоску — у неё плохой вкус.\n"
+    "- [Имя], выдохни и поправь корону.\n"
+    "- [Имя], оформи отпуск — душе нужны каникулы.\n"
+    "- [Имя], сегодня просто живи красиво — без объяснений.\n"
+    "- [Имя], улыбнись — чудеса уже на подходе.\n\n"
+    "### Женщины — среднее настроение\n"
+    "- [Имя], запланируй отпуск — и забудь пароль от почты.\n"
+    "- [Имя], не спеши, звезда всегда появляется эффектно.\n"
+    "- [Имя], сделай себе комплимент — он будет точнее всех.\n"
+    "- [Имя], живи с изяществом, как ты умеешь.\n"
+    "- [Имя], день серый? Надень настроение поярче.\n"
+    "- [Имя], просто свети, даже без причин.\n\n"
+    "### Женщины — отличное настроение\n"
+    "- [Имя], ты сегодня — праздник без повода.\n"
+    "- [Имя], даже солнце взяло твой автограф.\n"
+    "- [Имя], не скромничай — скромность скучна.\n"
+    "- [Имя], держи темп — публика не дышит.\n"
+    "- [Имя], блеск зафиксирован, не выключай.\n"
+    "- [Имя], настроение божественное — оставь так.\n\n"
+    "### Мужчины — плохое настроение\n"
+    "- [Имя], отдохни — подвиги подождут.\n"
+    "- [Имя], грусть тебе не идёт — верни улыбку.\n"
+    "- [Имя], всё пройдёт, даже дедлайн.\n"
+    "- [Имя], сними тревогу и добавь уверенности.\n"
+    "- [Имя], даже супергероям нужно полежать.\n\n"
+    "### Мужчины — среднее настроение\n"
+    "- [Имя], живи красиво, даже без повода.\n"
+    "- [Имя], добавь харизмы — день станет лучше.\n"
+    "- [Имя], улыбнись, жизнь наблюдает.\n"
+    "- [Имя], меньше дел, больше блеска.\n"
+    "- [Имя], добавь света — миру понравится.\n\n"
+    "### Мужчины — отличное настроение\n"
+    "- [Имя], ты сегодня — премьера, без дублей.\n"
+    "- [Имя], блеск на максимуме — не ослепи зал.\n"
+    "- [Имя], не скромничай — это не твой жанр.\n"
+    "- [Имя], ты великолепен, без комментариев.\n\n"
+)
+
+MODERATION_SYSTEM_PROMPT = (
+    MODERATION_RULES
+    + "Шаблоны ответов:\n"
+    + PROKHOR_TEMPLATES
+    + "Всегда подставляй имя пользователя на место [Имя]. "
+    + "Если пол или настроение не указаны или не распознаны, выбери любой подходящий шаблон."
+)
+
+# Проверка только имени (для режима с пулом готовых фраз)
+NAME_MODERATION_SYSTEM_PROMPT = (
+    "Ты — модератор платформы творческого контента. "
+    "Отвечай строго в формате JSON с полем \"status\".\n\n"
+    + NAME_RULES
+    + "\n"
+    "Если имя нарушает правила — \"status\": \"restricted\", иначе \"status\": \"ok\"."
+)
+
+NAME_MODERATION_RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "name_moderation_result",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "status": {"type": "string", "enum": ["ok", "restricted"]}
+            },
+            "required": ["status"],
+            "additionalProperties": False
+        },
+        "strict": True
+    }
+}
+
+# Генерация вариаций фраз Прохора для пула
+PHRASE_GENERATION_SYSTEM_PROMPT = (
+    "Ты пишешь короткие обращения от Прохора для экрана на мероприятии.\n"
+    "По заданным полу и настроению сгенерируй указанное количество новых вариаций "
+    "в стиле шаблонов ниже. Каждая вариация начинается с \"[Имя], \", такая же "
+    "короткая (одно предложение), той же темы, но сформулирована по-другому. "
+    "Не повторяй шаблоны и переданные примеры, без политики, войны и грубости.\n\n"
+    "Шаблоны:\n"
+    + PROKHOR_TEMPLATES
+)
+
+PHRASE_GENERATION_RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "phrase_variations",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "phrases": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["phrases"],
+            "additionalProperties": False
+        },
+        "strict": True
+    }
+}
+
+MODERATION_RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "moderation_result",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "response": {
+                    "type": "string",
+                    "description": "Brief explanation of the moderation decision"
+                },
+                "status": {
+                    "type": "string",
+                    "enum": ["ok", "restricted"],
+                    "description": "Moderation status: 'ok' if message is approved, 'restricted' if rejected"
+                }
+            },
+            "required": ["response", "status"],
+            "additionalProperties": False
+        },
+        "strict": True
+    }
+}
+
+
+# Заголовки каталога → значения пола и настроения из normalize_profile
+_TEMPLATE_GENDERS = {"Женщины": "женщина", "Мужчины": "мужчина"}
+_TEMPLATE_MOODS = {"плохое": "плохое", "среднее": "среднее", "отличное": "отличное"}
+
+
+def _parse_templates(text: str) -> Dict[Tuple[str, str], List[str]]:
+    """Разобрать каталог шаблонов на группы (пол, настроение) → фразы"""
+    buckets: Dict[Tuple[str, str], List[str]] = {}
+    bucket: Optional[List[str]] = None
+    for line in text.splitlines():
+        if line.startswith("### "):
+            gender_title, _, mood_title = line[4:].partition(" — ")
+            key = (_TEMPLATE_GENDERS[gender_title], _TEMPLATE_MOODS[mood_title.split()[0]])
+            bucket = buckets.setdefault(key, [])
+        elif line.startswith("- ") and bucket is not None:
+            bucket.append(line[2:].strip())
+    return buckets
+
+
+# Исходные шаблоны по группам; ими же заполняется пул фраз при первом запуске
+PROKHOR_TEMPLATE_BUCKETS = _parse_templates(PROKHOR_TEMPLATES)
+
+
+def _dumps(value: Any) -> bytes:
+    """Компактная сериализация JSON в UTF-8"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class PromptTemplate:
+    """Предкомпилированный запрос к chat/completions.
+
+    Тело запроса имеет вид ``prefix + <user content> + suffix``, где prefix
+    содержит модель и системное сообщение, а suffix — схему ответа.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        system_prompt: str,
+        response_format: Dict[str, Any],
+        revision: int = PROMPT_REVISION
+    ):
+        self.model = model
+        self.system_prompt = system_prompt
+        self.response_format = response_format
+        self.revision = revision
+
+        digest = hashlib.sha256(
+            _dumps([model, system_prompt, response_format])
+        ).hexdigest()[:12]
+        # Версия меняется при любом изменении промпта и инвалидирует внешние кэши
+        self.version = f"{revision}-{digest}"
+
+        self._prefix = (
+            b'{"model":' + _dumps(model)
+            + b',"messages":[{"role":"system","content":' + _dumps(system_prompt)
+            + b'},{"role":"user","content":'
+        )
+        self._suffix = b'}],"response_format":' + _dumps(response_format) + b"}"
+
+    def with_model(self, model: str) -> "PromptTemplate":
+        """Тот же промпт для другой модели (со своей версией)"""
+        return PromptTemplate(model, self.system_prompt, self.response_format, self.revision)
+
+    def render(self, user_content: str) -> bytes:
+        """Собрать тело запроса, подставив пользовательскую секцию"""
+        return self._prefix + _dumps(user_content) + self._suffix
+
+
+# Дополнение промпта для быстрой модели каскада
+UNCERTAIN_NOTE = (
+    "\n\nЕсли не уверен, что имя, пол или возраст безопасны (незнакомое слово, "
+    "двусмысленность, возможный намёк на запрещённые темы), верни \"status\": \"uncertain\" — "
+    "сообщение проверит более сильная модель."
+)
+
+
+def cascade_template(template: PromptTemplate, model: str) -> PromptTemplate:
+    """Шаблон для быстрой модели каскада: статус 'uncertain' вместо догадки"""
+    response_format = json.loads(json.dumps(template.response_format))
+    status = response_format["json_schema"]["schema"]["properties"]["status"]
+    status["enum"] = status["enum"] + ["uncertain"]
+    return PromptTemplate(model, template.system_prompt + UNCERTAIN_NOTE, response_format, template.revision)
+
+
+def build_user_section(
+    name: str,
+    gender_value: str,
+    age_value: str,
+    mood_value: str,
+    previous_messages: Optional[List[str]] = None
+) -> str:
+    """Динамическая часть запроса: данные пользователя и недавние сообщения"""
+    section = (
+        f"Имя пользователя: {name}\n"
+        f"Пол: {gender_value}\n"
+        f"Возраст: {age_value}\n"
+        f"Настроение: {mood_value}"
+    )
+    if previous_messages:
+        previous_messages_text = "\n".join(previous_messages)
+        section += (
+            f"\nПредыдущие сообщения для справки (не повторяй их):\n{previous_messages_text}"
+        )
+    return section
+
+
+def build_phrase_request(gender_value: str, mood_value: str, count: int, examples: List[str]) -> str:
+    """Пользовательская секция запроса на генерацию вариаций"""
+    section = (
+        f"Пол: {gender_value}\n"
+        f"Настроение: {mood_value}\n"
+        f"Количество: {count}"
+    )
+    if examples:
+        section += "\nУже есть (не повторяй):\n" + "\n".join(examples)
+    return section
+
+
+# Шаблон модерации, собирается один раз при импорте
+moderation_template = PromptTemplate(
+    model="gpt-4o",
+    system_prompt=MODERATION_SYSTEM_PROMPT,
+    response_format=MODERATION_RESPONSE_FORMAT
+)
+
+# Проверка только имени и генерация фраз для пула
+name_moderation_template = PromptTemplate(
+    model="gpt-4o",
+    system_prompt=NAME_MODERATION_SYSTEM_PROMPT,
+    response_format=NAME_MODERATION_RESPONSE_FORMAT
+)
+
+phrase_generation_template = PromptTemplate(
+    model="gpt-4o",
+    system_prompt=PHRASE_GENERATION_SYSTEM_PROMPT,
+    response_format=PHRASE_GENERATION_RESPONSE_FORMAT
+)
+
@@ -0,0 +1,217 @@
+"""Устойчивость запросов к внешним сервисам: повторы, автомат отключения, адаптивный лимит"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class UpstreamError(Exception):
+    """Ошибка ответа внешнего сервиса.
+
+    status — HTTP-код (None для ошибок соединения и таймаутов),
+    retry_after — пауза из заголовка Retry-After, секунды.
+    """
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        # 408/409/429 и 5xx — временные; остальные 4xx повторять бессмысленно
+        return self.status is None or self.status in (408, 409, 429) or self.status >= 500
+
+
+class CircuitOpenError(Exception):
+    """Автомат отключения разомкнут: запросы не отправляются"""
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени запроса исчерпан"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разобрать Retry-After: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Экспоненциальная пауза с полным случайным разбросом (full jitter)"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Пауза перед попыткой attempt + 1 (attempt считается с 1).
+
+        Retry-After от сервера — нижняя граница паузы.
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            return max(backoff, retry_after)
+        return backoff
+
+
+class CircuitBreaker:
+    """Автомат отключения.
+
+    После failure_threshold ошибок подряд размыкается и reset_timeout
+    секунд сразу отказывает. Затем пропускает один пробный запрос
+    (half-open): успех замыкает автомат, ошибка снова размыкает.
+    Пробный запрос, завершившийся без ответа (отмена, ошибка вне
+    запроса), отпускается release_probe, иначе автомат не пропустит
+    следующий.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def retry_in(self) -> float:
+        """Через сколько секунд автомат пропустит пробный запрос"""
+        if self._state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._state = self.CLOSED
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Пробный запрос завершился без результата: пропустить следующий"""
+        self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in": round(self.retry_in(), 3),
+        }
+
+
+class AdaptiveLimiter:
+    """Ограничитель параллельности с AIMD-регулировкой.
+
+    Каждый успешный запрос быстрее latency_target увеличивает лимит на
+    1/limit (примерно +1 за «окно» запросов). Ответ 429 или слишком
+    медленный ответ уменьшают лимит вдвое, но не чаще раза за
+    latency_target, чтобы одна волна ошибок не обнулила лимит.
+    """
+
+    def __init__(
+        self,
+        initial: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 10,
+        latency_target: float = 10.0,
+        backoff_ratio: float = 0.5
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Создаётся лениво внутри работающего event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """Занять слот; DeadlineExceeded, если не дождались за timeout"""
+        condition = self._get_condition()
+        async with condition:
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self.in_flight < int(self.limit)),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("Timed out waiting for a concurrency slot")
+            self.in_flight += 1
+
+    async def release(self):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def on_success(self, latency: float):
+        if latency > self.latency_target:
+            self.on_overload()
+            return
+        previous = int(self.limit)
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        if int(self.limit) > previous and self._condition is not None:
+            # Освободился слот — будим ожидающих без захвата условия
+            asyncio.get_running_loop().create_task(self._wake())
+
+    def on_overload(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+
+    async def _wake(self):
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+        }
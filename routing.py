@@ -0,0 +1,106 @@
+"""Каскад моделей модерации.
+
+Сообщение, не отклонённое локальными правилами, сначала проверяет
+быстрая модель (например gpt-4o-mini или локальная модель за
+OpenAI-совместимым API) с коротким таймаутом. Её уверенный ответ
+принимается; если модель не уверена, ответила некорректно, не успела
+или (по умолчанию) отклонила сообщение, проверка передаётся основной
+модели. Для каждого уровня считаются время, вызовы и стоимость.
+"""
+from typing import Any, Dict, Optional
+
+from config import settings
+from metrics import MODERATION_TIER_COST, MODERATION_TIER_SECONDS
+from resilience import CircuitBreaker
+
+# Уровни каскада
+FAST = "fast"
+LARGE = "large"
+
+
+class ModelTier:
+    """Уровень каскада: модель, адрес OpenAI-совместимого API и таймаут"""
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        base_url: str,
+        api_key: str = "",
+        timeout: float = 5.0,
+        escalate_restricted: bool = True
+    ):
+        self.name = name
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        # Пустой ключ — запрос без заголовка Authorization (локальный сервер)
+        self.api_key = api_key
+        # Время на один ответ уровня, сек
+        self.timeout = timeout
+        # Отклонения быстрой модели перепроверяет основная
+        self.escalate_restricted = escalate_restricted
+        # Свой автомат отключения для отдельного адреса; None — общий с основной моделью
+        self.breaker: Optional[CircuitBreaker] = None
+        # Метрики
+        self.calls = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+        self.cost = 0.0
+        self.outcomes: Dict[str, int] = {}
+
+    def record(self, outcome: str, seconds: float, usage: Optional[Dict[str, Any]] = None):
+        """Учесть ответ уровня: ok, restricted, uncertain, invalid или error"""
+        self.calls += 1
+        self.seconds_total += seconds
+        self.seconds_max = max(self.seconds_max, seconds)
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        MODERATION_TIER_SECONDS.observe(seconds, tier=self.name, outcome=outcome)
+        if usage is not None:
+            self.cost += usage['cost']
+            MODERATION_TIER_COST.inc(usage['cost'], tier=self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "base_url": self.base_url,
+            "timeout": self.timeout,
+            "calls": self.calls,
+            "avg_ms": self.seconds_total / self.calls * 1000 if self.calls else 0.0,
+            "max_ms": self.seconds_max * 1000,
+            "cost": self.cost,
+            "outcomes": dict(self.outcomes),
+            "breaker": self.breaker.stats() if self.breaker is not None else None,
+        }
+
+
+def escalation_reason(tier: ModelTier, status: Optional[str]) -> Optional[str]:
+    """Почему ответ быстрой модели не принят; None — ответ принят"""
+    if status == 'ok':
+        return None
+    if status == 'restricted':
+        return "restricted" if tier.escalate_restricted else None
+    if status == 'uncertain':
+        return "uncertain"
+    return "invalid"
+
+
+def fast_tier_from_settings() -> Optional[ModelTier]:
+    """Быстрый уровень из настроек; None — каскад выключен"""
+    if not settings.moderation_fast_model:
+        return None
+    base_url = settings.moderation_fast_base_url or settings.openai_base_url
+    # Ключ OpenAI не уходит на чужой адрес
+    if settings.moderation_fast_api_key:
+        api_key = settings.moderation_fast_api_key
+    elif not settings.moderation_fast_base_url:
+        api_key = settings.openai_api_key
+    else:
+        api_key = ""
+    return ModelTier(
+        FAST,
+        settings.moderation_fast_model,
+        base_url,
+        api_key=api_key,
+        timeout=settings.moderation_fast_timeout,
+        escalate_restricted=settings.moderation_fast_escalate_restricted
+    )
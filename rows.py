@@ -0,0 +1,100 @@
+"""Строки таблицы messages без промежуточных словарей"""
+import json
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+
+# Все колонки сообщения в порядке полей MessageRow
+MESSAGE_FIELDS = (
+    "id", "name", "age", "gender", "mood", "message_text", "openai_response",
+    "status", "created_at", "is_fetched", "fetched_at", "updated_at",
+)
+
+
+class MessageRow(NamedTuple):
+    """Сообщение из базы: кортеж с доступом к полям по имени.
+
+    Поддерживает и `row.status`, и `row['status']`, поэтому заменяет
+    словарь там, где сообщение только читается. Словарь (as_dict)
+    нужен лишь на границах: кэш последних сообщений, события, JSON.
+    Колонки, не попавшие в проекцию, равны None.
+    """
+    id: int
+    name: Optional[str] = None
+    age: Optional[int] = None
+    gender: Optional[str] = None
+    mood: Optional[str] = None
+    message_text: Optional[str] = None
+    openai_response: Optional[str] = None
+    status: Optional[str] = None
+    created_at: Optional[str] = None
+    is_fetched: Optional[bool] = None
+    fetched_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(zip(MESSAGE_FIELDS, self))
+
+    @property
+    def verdict(self) -> Optional[Dict[str, Any]]:
+        """Разобранный openai_response; декодируется только при обращении"""
+        if not self.openai_response:
+            return None
+        try:
+            return json.loads(self.openai_response)
+        except json.JSONDecodeError:
+            return None
+
+
+def message_row(cursor, row) -> MessageRow:
+    """row_factory для выборок с колонками MessageColumns.sql.
+
+    Вызывается в потоке соединения aiosqlite, а не в event loop.
+    Лишние колонки после двенадцатой (например, из RETURNING) отбрасываются.
+    """
+    is_fetched = row[9]
+    return MessageRow(
+        row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8],
+        None if is_fetched is None else bool(is_fetched), row[10], row[11]
+    )
+
+
+class MessageColumns:
+    """Проекция колонок messages.
+
+    sql всегда даёт все двенадцать колонок в порядке MESSAGE_FIELDS,
+    исключённые заменяются на NULL: SQLite не читает их с диска, а
+    message_row остаётся единственным преобразователем. json_sql —
+    JSON-объект только из выбранных колонок.
+    """
+
+    def __init__(self, exclude: Iterable[str] = ()):
+        exclude = set(exclude)
+        unknown = exclude - set(MESSAGE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown message columns: {sorted(unknown)}")
+        if "id" in exclude:
+            raise ValueError("Column 'id' cannot be excluded")
+        self.fields = tuple(f for f in MESSAGE_FIELDS if f not in exclude)
+        self.sql = ", ".join(f if f in self.fields else f"NULL AS {f}" for f in MESSAGE_FIELDS)
+        pairs = []
+        for field in self.fields:
+            if field == "is_fetched":
+                pairs.append("'is_fetched', json(CASE WHEN is_fetched THEN 'true' ELSE 'false' END)")
+            else:
+                pairs.append(f"'{field}', {field}")
+        self.json_sql = "json_object(" + ", ".join(pairs) + ")"
+
+
+# Полная строка и строка для списков (без тяжёлого openai_response)
+ALL_COLUMNS = MessageColumns()
+LIST_COLUMNS = MessageColumns(exclude=("openai_response",))
@@ -0,0 +1,51 @@
+"""Разовый перенос старых сообщений в архив (см. archive.py).
+
+Можно запускать при работающем сервисе: перенос идёт небольшими
+транзакциями, а ожидающие модерации и непоказанные одобренные
+сообщения не переносятся.
+
+Запуск из корня проекта:
+    python scripts/archive.py --older-than-days 90
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from archive import MessageArchiver  # noqa: E402
+from config import settings  # noqa: E402
+from database import Database  # noqa: E402
+
+
+async def run(days: float, archive_dir: str) -> int:
+    database = Database(settings.database_path, pool_size=1)
+    try:
+        await database.init_db()
+        archiver = MessageArchiver(database, archive_dir, chunk_size=settings.export_chunk_size)
+        return await archiver.run_once(days)
+    finally:
+        await database.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--older-than-days", type=float, default=settings.archive_after_days or None,
+        help="Переносить сообщения старше N дней (по умолчанию ARCHIVE_AFTER_DAYS)"
+    )
+    parser.add_argument("--archive-dir", default=settings.archive_dir, help="Каталог архива")
+    args = parser.parse_args()
+
+    if not args.older_than_days or args.older_than_days <= 0:
+        print("Ошибка: укажите --older-than-days или ARCHIVE_AFTER_DAYS")
+        return 1
+    moved = asyncio.run(run(args.older_than_days, args.archive_dir))
+    print(f"Перенесено в архив: {moved}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
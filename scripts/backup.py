@@ -0,0 +1,72 @@
+"""Онлайн-бэкап базы сообщений.
+
+Копия снимается через SQLite backup API, поэтому она согласована даже
+при работающем сервисе и включённом WAL (простое копирование файла
+может потерять последние коммиты из messages.db-wal). Копия сжимается
+gzip, бэкапы старше --keep-days удаляются.
+
+Запуск из корня проекта:
+    python scripts/backup.py --dest /opt/shalapin-bot/backups
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from config import settings  # noqa: E402
+from database import Database  # noqa: E402
+
+
+async def backup(source: str, dest_dir: str) -> str:
+    os.makedirs(dest_dir, exist_ok=True)
+    target = os.path.join(dest_dir, f"messages_{datetime.now():%Y%m%d_%H%M%S}.db")
+    database = Database(source, pool_size=1)
+    try:
+        await database.pool.open()
+        await database.backup(target)
+    finally:
+        await database.close()
+
+    with open(target, "rb") as src, gzip.open(target + ".gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(target)
+    return target + ".gz"
+
+
+def remove_old(dest_dir: str, keep_days: float) -> int:
+    threshold = time.time() - keep_days * 86400
+    removed = 0
+    for name in os.listdir(dest_dir):
+        path = os.path.join(dest_dir, name)
+        if name.startswith("messages_") and name.endswith(".db.gz") and os.path.getmtime(path) < threshold:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", default=settings.database_path, help="Файл базы (по умолчанию DATABASE_PATH)")
+    parser.add_argument("--dest", default="./backups", help="Каталог бэкапов")
+    parser.add_argument("--keep-days", type=float, default=30, help="Сколько дней хранить бэкапы")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"Ошибка: База данных не найдена: {args.source}")
+        return 1
+    path = asyncio.run(backup(args.source, args.dest))
+    print(f"Бэкап создан: {path}")
+    removed = remove_old(args.dest, args.keep_days)
+    print(f"Удалено старых бэкапов: {removed}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,16 @@
 #!/bin/bash
 
 # Скрипт для резервного копирования базы данных
+# Копия снимается внутри контейнера через SQLite backup API (scripts/backup.py):
+# она согласована при работающем сервисе, а простой cp файла может потерять
+# данные, ещё не перенесённые из messages.db-wal
 
-BACKUP_DIR="/opt/shalapin-bot/backups"
-DATE=$(date +%Y%m%d_%H%M%S)
-BACKUP_FILE="$BACKUP_DIR/messages_$DATE.db"
-SOURCE_DB="/opt/shalapin-bot/data/messages.db"
+APP_DIR="/opt/shalapin-bot"
+BACKUP_DIR="$APP_DIR/backups"
+SOURCE_DB="$APP_DIR/data/messages.db"
+CONTAINER="shalapin-bot-backend"
+# Каталог в смонтированном томе data/, доступный и контейнеру, и хосту
+STAGING_DIR="$APP_DIR/data/backups"
 
 # Создаем директорию для бэкапов если её нет
 mkdir -p "$BACKUP_DIR"
@@ -16,16 +21,13 @@ if [ ! -f "$SOURCE_DB" ]; then
     exit 1
 fi
 
-# Копируем базу данных
-cp "$SOURCE_DB" "$BACKUP_FILE"
+# Онлайн-бэкап и сжатие
+docker exec "$CONTAINER" python scripts/backup.py --dest /app/data/backups
 
 if [ $? -eq 0 ]; then
-    echo "Бэкап создан успешно: $BACKUP_FILE"
-    
-    # Сжимаем бэкап
-    gzip "$BACKUP_FILE"
-    echo "Бэкап сжат: $BACKUP_FILE.gz"
-    
+    mv "$STAGING_DIR"/messages_*.db.gz "$BACKUP_DIR"/
+    echo "Бэкап перенесен в $BACKUP_DIR"
+
     # Удаляем старые бэкапы (оставляем последние 30 дней)
     find "$BACKUP_DIR" -name "messages_*.db.gz" -mtime +30 -delete
     echo "Старые бэкапы удалены (старше 30 дней)"
@@ -33,4 +35,3 @@ else
     echo "Ошибка при создании бэкапа"
     exit 1
 fi
-
@@ -0,0 +1,65 @@
+"""Проверка планов горячих запросов к таблице messages.
+
+Создаёт временную базу, применяет все миграции, заполняет таблицу
+и проверяет через EXPLAIN QUERY PLAN, что каждый горячий запрос
+использует свой индекс и не сортирует результат во временном B-дереве.
+
+Запуск из корня проекта:
+    python scripts/check_query_plans.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+import aiosqlite  # noqa: E402
+
+from database import HOT_QUERIES  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+# Запрос → индекс, который должен быть в плане
+EXPECTED_INDEXES = {
+    "latest_approved": "idx_messages_ok_created",
+    "last_approved_texts": "idx_messages_ok_created",
+    "claimable_ids": "idx_messages_unfetched",
+    "pending_ids": "idx_messages_pending",
+    "queue_depth": "idx_messages_unfetched",
+    "pending_count": "idx_messages_pending",
+}
+
+
+async def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiosqlite.connect(os.path.join(tmp, "plans.db")) as db:
+            await migrate(db)
+            statuses = ["ok", "ok", "ok", "restricted", "pending"]
+            await db.executemany(
+                """
+                INSERT INTO messages (name, message_text, status, is_fetched, created_at, updated_at)
+                VALUES (?, 'text', ?, ?, datetime('now', ?), datetime('now', ?))
+                """,
+                [
+                    (f"name{i}", statuses[i % len(statuses)], i % 2, f"-{i} seconds", f"-{i} seconds")
+                    for i in range(5000)
+                ]
+            )
+            await db.commit()
+            await db.execute("ANALYZE")
+
+            failed = 0
+            for name, (sql, params) in HOT_QUERIES.items():
+                cursor = await db.execute("EXPLAIN QUERY PLAN " + sql, params)
+                plan = " | ".join(row[3] for row in await cursor.fetchall())
+                expected = EXPECTED_INDEXES[name]
+                ok = expected in plan and "TEMP B-TREE" not in plan
+                failed += not ok
+                print(f"{'OK  ' if ok else 'FAIL'} {name}: {plan} (expected {expected})")
+            return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,57 @@
+"""Быстрая сериализация JSON для ответов API"""
+import json
+from typing import Any, Optional
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Без orjson работает стандартный json, только медленнее
+    orjson = None
+
+# Готовый JSON внутри ответа без повторного разбора (orjson >= 3.9)
+_Fragment = getattr(orjson, "Fragment", None)
+
+
+def dumps(content: Any) -> bytes:
+    """Компактный JSON в UTF-8 (кириллица не экранируется)"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_text(content: Any) -> str:
+    """Компактный JSON строкой — для хранения в TEXT-колонке"""
+    return dumps(content).decode("utf-8")
+
+
+def raw_json(text: Optional[str]) -> Any:
+    """Вставить сохранённый JSON в ответ как есть.
+
+    С orjson строка не разбирается, а попадает в ответ фрагментом;
+    без него приходится разобрать её обратно в объект.
+    """
+    if not text:
+        return None
+    if _Fragment is not None:
+        return _Fragment(text)
+    return json.loads(text)
+
+
+def json_array(items: list) -> bytes:
+    """Склеить готовые JSON-объекты (строки из SQLite) в массив"""
+    return ("[" + ",".join(items) + "]").encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse через orjson, без jsonable_encoder и проверки модели ответа.
+
+    Эндпоинт возвращает экземпляр этого класса напрямую, поэтому FastAPI
+    не валидирует и не перекладывает результат. Уже готовые байты
+    (JSON из кэша или из SQLite) отдаются без изменений.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
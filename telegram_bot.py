@@ -1,13 +1,299 @@
 """Telegram бот"""
 import asyncio
-import json
-from aiogram import Bot, Dispatcher, types
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import Message, Update
+
 from config import settings
+from coordination import change_watcher
 from database import db
-from openai_service import openai_service
+from message_pipeline import submit_message
+from metrics import TELEGRAM_PROCESS_SECONDS, TELEGRAM_QUEUE, TELEGRAM_UPDATES
+
+
+# Ответы пользователю
+PROCESSING_TEXT = "⏳ Обрабатываю ваше сообщение..."
+PENDING_TEXT = "⏳ Проверка задерживается, ответ придёт сюда же."
+APPROVED_TEXT = "✅ Объява промодерирована, скоро будет на экране!"
+RESTRICTED_TEXT = "❌ Надо переписать"
+ERROR_TEXT = "Произошла ошибка, попробуйте ещё раз."
+NOT_TEXT = "Пожалуйста, отправьте имя текстом."
+RATE_LIMITED_TEXT = "Слишком много сообщений, попробуйте через {seconds} с."
+
+# Ограничение длины имени, как у поля name в API
+MAX_NAME_LENGTH = 100
+
+
+class UserRateLimiter:
+    """Токен-бакет на пользователя: burst сообщений сразу, дальше rate в минуту.
+
+    Хранит не больше max_users пользователей; давно не писавшие
+    вытесняются первыми (их бакет всё равно уже полон).
+    """
+
+    def __init__(self, rate_per_minute: float = 6.0, burst: int = 3, max_users: int = 10000):
+        self.rate = max(rate_per_minute, 0.001) / 60
+        self.burst = max(1, burst)
+        self.max_users = max_users
+        self._buckets: "OrderedDict[int, list]" = OrderedDict()
+
+    def acquire(self, user_id: int) -> float:
+        """0 — сообщение можно принять, иначе секунды до следующей попытки"""
+        now = time.monotonic()
+        bucket = self._buckets.pop(user_id, None)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[user_id] = [tokens, now]
+        if len(self._buckets) > self.max_users:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class RecentKeys:
+    """Ключи, виденные за последние window секунд (для отсева повторов)"""
+
+    def __init__(self, window: float = 60.0, max_size: int = 10000):
+        self.window = window
+        self.max_size = max_size
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def seen(self, key: Hashable) -> bool:
+        """Запомнить ключ; True, если он уже встречался в пределах окна"""
+        now = time.monotonic()
+        while self._seen:
+            oldest_key, oldest_at = next(iter(self._seen.items()))
+            if now - oldest_at < self.window and len(self._seen) < self.max_size:
+                break
+            del self._seen[oldest_key]
+        if key in self._seen:
+            return True
+        self._seen[key] = now
+        return False
+
+    def forget(self, key: Hashable):
+        self._seen.pop(key, None)
+
+
+class BotIngestion:
+    """Приём сообщений бота: очередь и фиксированный пул обработчиков.
+
+    Обработчик диспетчера только проверяет лимиты и ставит сообщение в
+    ограниченную очередь. Когда очередь полна, put ждёт — при long
+    polling диспетчер перестаёт забирать обновления, и всплеск
+    копится на стороне Telegram, а не в памяти процесса. Модерация и
+    сохранение идут тем же путём, что и POST /api/messages/create;
+    статус показывается одним ответом, который редактируется на месте.
+    С enqueue_only сообщение только сохраняется в статусе 'pending',
+    а модерирует его пул обработчиков процесса API.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        queue_size: int = 100,
+        rate_per_minute: float = 6.0,
+        burst: int = 3,
+        dedup_window: float = 60.0,
+        enqueue_only: bool = False,
+        max_awaiting: int = 1000
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.enqueue_only = enqueue_only
+        # Сколько ответов ждут фоновой модерации; остальные не обновляются
+        self.max_awaiting = max_awaiting
+        self.limiter = UserRateLimiter(rate_per_minute, burst)
+        self.recent = RecentKeys(dedup_window)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        # id сообщения в статусе 'pending' → ответ бота, который нужно обновить
+        self._awaiting: Dict[int, Message] = {}
+        self._edits: set = set()
+        self._warned: set = set()
+        # Метрики
+        self.accepted = 0
+        self.duplicates = 0
+        self.rate_limited = 0
+        self.processed = 0
+        self.errors = 0
+
+    async def start(self):
+        """Запустить обработчики и подписаться на завершение фоновой модерации"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        db.hub.add_observer(self._message_changed)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"telegram-worker-{idx}")
+            for idx in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Остановить обработчики; сообщения из очереди не обрабатываются"""
+        db.hub.remove_observer(self._message_changed)
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *self._edits, return_exceptions=True)
+        self._queue = None
+        self._awaiting.clear()
+        TELEGRAM_QUEUE.set(0)
+
+    async def handle(self, message: Message):
+        """Обработчик диспетчера: отсеять повторы и лишнее, поставить в очередь"""
+        user_id = message.from_user.id if message.from_user else message.chat.id
+        # Повторная доставка того же обновления
+        if self.recent.seen(("update", message.chat.id, message.message_id)):
+            self.duplicates += 1
+            TELEGRAM_UPDATES.inc(outcome="duplicate")
+            return
 
+        name = (message.text or "").strip()
+        if not name or name.startswith("/"):
+            TELEGRAM_UPDATES.inc(outcome="invalid")
+            await message.answer(NOT_TEXT)
+            return
+        name = name[:MAX_NAME_LENGTH]
+
+        # То же имя от того же пользователя (двойная отправка)
+        name_key = ("name", user_id, name.casefold())
+        if self.recent.seen(name_key):
+            self.duplicates += 1
+            TELEGRAM_UPDATES.inc(outcome="duplicate")
+            return
+
+        wait = self.limiter.acquire(user_id)
+        if wait > 0:
+            self.rate_limited += 1
+            TELEGRAM_UPDATES.inc(outcome="rate_limited")
+            # Отклонённое имя можно прислать снова, когда лимит позволит
+            self.recent.forget(name_key)
+            # Предупреждаем один раз, пока пользователь не уложится в лимит
+            if user_id not in self._warned:
+                self._warned.add(user_id)
+                await message.answer(RATE_LIMITED_TEXT.format(seconds=int(wait) + 1))
+            return
+        self._warned.discard(user_id)
+
+        if self._queue is None:
+            await self.start()
+        self.accepted += 1
+        TELEGRAM_UPDATES.inc(outcome="accepted")
+        await self._queue.put((message, name, time.perf_counter()))
+        TELEGRAM_QUEUE.set(self._queue.qsize())
+
+    async def _worker(self):
+        while True:
+            message, name, received = await self._queue.get()
+            TELEGRAM_QUEUE.set(self._queue.qsize())
+            try:
+                await self._process(message, name, received)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"[BotIngestion] Failed to process message from chat {message.chat.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, message: Message, name: str, received: float):
+        reply = await message.answer(PROCESSING_TEXT)
+        try:
+            result = await submit_message(name=name, async_mode=self.enqueue_only)
+        except Exception:
+            await reply.edit_text(ERROR_TEXT)
+            raise
+        self.processed += 1
+        if result['status'] == 'pending':
+            # Ответ обновится после фоновой модерации
+            if len(self._awaiting) < self.max_awaiting:
+                self._awaiting[result['id']] = reply
+            if not self.enqueue_only:
+                # OpenAI недоступен, проверка отложена
+                await reply.edit_text(PENDING_TEXT)
+            return
+        await reply.edit_text(APPROVED_TEXT if result['status'] == 'ok' else RESTRICTED_TEXT)
+        TELEGRAM_PROCESS_SECONDS.observe(time.perf_counter() - received)
+
+    def _message_changed(self, event_type: str, message: Dict[str, Any]):
+        """Наблюдатель EventHub: фоновая модерация завершила ожидающее сообщение"""
+        if message['status'] == 'pending':
+            return
+        reply = self._awaiting.pop(message['id'], None)
+        if reply is None:
+            return
+        text = APPROVED_TEXT if message['status'] == 'ok' else RESTRICTED_TEXT
+        # Число таких задач ограничено размером _awaiting
+        task = asyncio.create_task(self._edit(reply, text))
+        self._edits.add(task)
+        task.add_done_callback(self._edits.discard)
+
+    @staticmethod
+    async def _edit(reply: Message, text: str):
+        try:
+            await reply.edit_text(text)
+        except Exception as e:
+            print(f"[BotIngestion] Failed to update reply in chat {reply.chat.id}: {e}")
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def has_room(self, extra: int = 0) -> bool:
+        """Поместятся ли в очередь ещё сообщения сверх extra уже принятых обновлений"""
+        return self.queue_depth() + extra < self.queue_size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue": self.queue_depth(),
+            "queue_size": self.queue_size,
+            "awaiting_moderation": len(self._awaiting),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rate_limited": self.rate_limited,
+            "processed": self.processed,
+            "errors": self.errors,
+        }
+
+
+def webhook_secret(token: str, secret: str = "") -> str:
+    """Секрет вебхука: заданный или устойчиво выведенный из токена бота.
+
+    Одинаков у всех процессов API и между перезапусками.
+    """
+    return secret or hashlib.sha256(f"webhook:{token}".encode("utf-8")).hexdigest()
+
+
+def create_bot(token: str, api_url: str = "") -> Bot:
+    """Bot с общим HTTP-клиентом; api_url — свой сервер Bot API (например, заглушка)"""
+    if api_url:
+        return Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    return Bot(token=token)
+
+
+ingestion = BotIngestion(
+    workers=settings.telegram_workers,
+    queue_size=settings.telegram_queue_size,
+    rate_per_minute=settings.telegram_user_rate,
+    burst=settings.telegram_user_burst,
+    dedup_window=settings.telegram_dedup_window,
+    # Отдельный процесс бота только сохраняет сообщения, модерирует API
+    enqueue_only=settings.telegram_mode == "polling"
+)
 
 # Инициализация бота (только если токен валидный)
 bot = None
@@ -15,7 +301,7 @@ dp = None
 
 try:
     if settings.telegram_bot_token and settings.telegram_bot_token != "your_telegram_bot_token_here":
-        bot = Bot(token=settings.telegram_bot_token)
+        bot = create_bot(settings.telegram_bot_token, settings.telegram_api_url)
         dp = Dispatcher()
     else:
         print("WARNING: Telegram bot token not configured. Bot will not start.")
@@ -29,75 +315,122 @@ if dp:
     async def cmd_start(message: Message):
         """Обработчик команды /start"""
         await message.answer(
-            "Привет! Отправь мне сообщение, и я проверю его через OpenAI."
+            "Привет! Напиши своё имя, и Прохор передаст тебе привет на экране."
         )
 
 
     @dp.message()
     async def handle_message(message: Message):
         """Обработчик всех сообщений"""
-        try:
-            # Получаем текст сообщения
-            message_text = message.text or message.caption or ""
-            
-            if not message_text:
-                await message.answer("Пожалуйста, отправьте текстовое сообщение.")
-                return
-            
-            # Показываем пользователю, что сообщение обрабатывается
-            processing_msg = await message.answer("⏳ Обрабатываю ваше сообщение...")
-            
-            # Проверяем сообщение через OpenAI
-            result = await openai_service.check_message(message_text)
-            
-            # Сохраняем в базу данных
-            await db.add_message(
-                user_id=message.from_user.id,
-                username=message.from_user.username,
-                message_text=message_text,
-                openai_response=json.dumps(result, ensure_ascii=False),
-                status=result['status']
-            )
-            
-            # Удаляем сообщение об обработке
-            await processing_msg.delete()
-            
-            # Отвечаем пользователю в зависимости от статуса
-            if result['status'] == 'ok':
-                await message.answer("✅ Объява промодерирована, скоро будет на экране!")
-            else:
-                await message.answer("❌ Надо переписать")
-                
-        except Exception as e:
-            # Обработка ошибок
-            await message.answer(f"Произошла ошибка: {str(e)}")
+        await ingestion.handle(message)
+
+
+# Обновления из вебхука, которые ещё проходят через диспетчер
+_webhook_tasks: set = set()
+
+
+def webhook_enabled() -> bool:
+    """Бот работает через вебхук в процессе API"""
+    return bot is not None and settings.telegram_mode == "webhook"
+
+
+def check_webhook_secret(value: Optional[str]) -> bool:
+    expected = webhook_secret(settings.telegram_bot_token, settings.telegram_webhook_secret)
+    return value is not None and hmac.compare_digest(value.encode("utf-8"), expected.encode("utf-8"))
+
+
+async def start_webhook():
+    """Запустить обработчики бота в процессе API (каждый процесс)"""
+    await ingestion.start()
+
+
+async def register_webhook():
+    """Сообщить Telegram адрес вебхука (достаточно одного процесса)"""
+    url = settings.telegram_webhook_url.rstrip("/") + settings.telegram_webhook_path
+    await bot.set_webhook(
+        url,
+        secret_token=webhook_secret(settings.telegram_bot_token, settings.telegram_webhook_secret),
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    print(f"[Telegram] Webhook set to {url}")
+
+
+def feed_webhook_update(payload: Dict[str, Any]) -> bool:
+    """Передать обновление из вебхука диспетчеру, не дожидаясь обработки.
+
+    False — очередь заполнена: ответ 429 заставит Telegram повторить
+    доставку позже. Обработчик ставит сообщение в очередь сразу, поэтому
+    число фоновых задач не превышает размер очереди.
+    """
+    if not ingestion.has_room(len(_webhook_tasks)):
+        return False
+    update = Update.model_validate(payload, context={"bot": bot})
+    task = asyncio.create_task(dp.feed_update(bot, update))
+    _webhook_tasks.add(task)
+    task.add_done_callback(_webhook_tasks.discard)
+    return True
+
+
+async def stop_webhook():
+    """Дождаться принятых обновлений и остановить обработчики бота.
+
+    Вебхук в Telegram не снимается: пока API перезапускается, Telegram
+    копит обновления и доставит их позже.
+    """
+    if _webhook_tasks:
+        await asyncio.wait(list(_webhook_tasks), timeout=5)
+    await ingestion.stop()
+    try:
+        await bot.session.close()
+    except Exception:
+        pass
 
 
 async def start_bot():
-    """Запуск бота"""
+    """Запуск бота в режиме long polling (отдельный процесс)"""
+    if settings.telegram_mode == "webhook":
+        print("Telegram bot runs in webhook mode inside the API (TELEGRAM_MODE=webhook).")
+        return
+    if not (bot and dp):
+        print("Telegram bot is not configured. Skipping bot startup.")
+        return
+    
     # Инициализируем базу данных
     await db.init_db()
-    
-    # Запускаем бота только если он инициализирован
-    if bot and dp:
-        await dp.start_polling(bot)
-    else:
-        print("Telegram bot is not configured. Skipping bot startup.")
-        # Бесконечный цикл, чтобы задача не завершилась
-        while True:
-            await asyncio.sleep(3600)  # Спим час
+    # Сообщения модерирует лидер процессов API; о результатах бот узнаёт
+    # из общей базы и обновляет ответы пользователям
+    await change_watcher.start()
+
+    await ingestion.start()
+    # Вебхук и getUpdates несовместимы
+    await bot.delete_webhook()
+    # Обновления обрабатываются по одному: обработчик лишь ставит их в
+    # очередь, а полная очередь приостанавливает получение новых
+    await dp.start_polling(bot, handle_as_tasks=False)
 
 
 async def stop_bot():
     """Остановка бота"""
-    if not bot or not dp:
-        return
-    try:
-        await dp.stop_polling()
-    except Exception:
-        pass
+    if bot and dp:
+        try:
+            await dp.stop_polling()
+        except Exception:
+            pass
+        await ingestion.stop()
+        try:
+            await bot.session.close()
+        except Exception:
+            pass
+    await change_watcher.stop()
+    await db.close()
+
+
+async def main():
     try:
-        await bot.session.close()
-    except Exception:
-        pass
+        await start_bot()
+    finally:
+        await stop_bot()
+
 
+if __name__ == "__main__":
+    asyncio.run(main())